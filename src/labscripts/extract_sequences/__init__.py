@@ -0,0 +1,7 @@
+"""Make independent sequence files from a file that has multiple sequences.
+
+`split` does it from Python; the command line tool is `extract_sequences`.
+"""
+from labscripts.extract_sequences.extract_sequences import split
+
+__all__ = ['split']
@@ -1,7 +1,7 @@
-from extract_sequences.extract_sequences import extractor
+from labscripts.extract_sequences.extract_sequences import extractor
 
 def main():
     extractor()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
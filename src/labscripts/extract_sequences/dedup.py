@@ -0,0 +1,91 @@
+"""Find records with the same sequence while extracting them.
+
+Sequences are hashed as they are read, so no sequence is kept to compare.
+Only an 8-byte digest of every distinct sequence is remembered: most of
+them in a sorted numpy array and the newest ones in a small set, which is
+merged into the array when it fills up. 100 million distinct sequences take
+about 800 MB. Two different sequences get the same digest with a
+probability of about n^2 / 2^65, i.e. 3 in 10000 for 100 million sequences.
+"""
+from pathlib import Path
+from typing import Union
+import hashlib
+
+import numpy as np
+
+# Digests kept in the set before merging them into the sorted array.
+BUFFER_SIZE = 2**20
+DIGEST_SIZE = 8
+MAPPING_HEADER = 'sequence_hash\tid\tduplicate\n'
+
+
+class DigestSet:
+    """Class to store the 64-bit digests of the sequences seen."""
+    def __init__(self, buffer_size: int = BUFFER_SIZE):
+        self.buffer_size = buffer_size
+        self.sorted = np.empty(0, dtype=np.uint64)
+        self.buffer = set()
+
+    def __len__(self) -> int:
+        return len(self.sorted) + len(self.buffer)
+
+    def __contains__(self, digest: int) -> bool:
+        if digest in self.buffer:
+            return True
+        i = np.searchsorted(self.sorted, np.uint64(digest))
+        return i < len(self.sorted) and self.sorted[i] == digest
+
+    def add(self, digest: int) -> bool:
+        """Add digest; return True if it wasn't in the set."""
+        if digest in self:
+            return False
+        self.buffer.add(digest)
+        if len(self.buffer) >= self.buffer_size:
+            self.merge()
+        return True
+
+    def merge(self) -> None:
+        """Move the digests of the buffer to the sorted array."""
+        merged = np.concatenate((
+            self.sorted, np.fromiter(self.buffer, dtype=np.uint64)
+        ))
+        merged.sort()
+        self.sorted = merged
+        self.buffer.clear()
+
+
+class SequenceDeduplicator:
+    """Class to tell the first record of every sequence from its copies.
+
+    If mapping_file is given, a row with the sequence hash and the id of
+    every record checked is written to it.
+    """
+    def __init__(self, mapping_file: Union[Path, None] = None):
+        self.digests = DigestSet()
+        self.mapping = open(mapping_file, 'w') if mapping_file else None
+        if self.mapping:
+            self.mapping.write(MAPPING_HEADER)
+
+    @staticmethod
+    def new_hasher() -> 'hashlib._Hash':
+        """Get a hasher to feed the sequence of a record, in pieces."""
+        return hashlib.blake2b(digest_size=DIGEST_SIZE)
+
+    def add(self, hasher: 'hashlib._Hash', name: str) -> bool:
+        """Check the record hashed by hasher; True if its sequence is new."""
+        digest = hasher.digest()
+        is_new = self.digests.add(int.from_bytes(digest, 'big'))
+        if self.mapping:
+            duplicate = 'no' if is_new else 'yes'
+            self.mapping.write(f'{digest.hex()}\t{name}\t{duplicate}\n')
+        return is_new
+
+    def close(self) -> None:
+        if self.mapping:
+            self.mapping.close()
+
+    def __enter__(self) -> 'SequenceDeduplicator':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
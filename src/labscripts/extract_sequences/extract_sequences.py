@@ -6,7 +6,14 @@ import sys
 import argparse
 from argparse import Namespace
 from pathlib import Path
-from typing import Union
+from typing import Iterable, Union
+from io import StringIO
+import re
+
+from labscripts.extract_sequences.dedup import SequenceDeduplicator
+
+# Table of sequence hashes and ids written in the output folder by --dedup.
+DEDUP_TABLE = 'dedup_table.tsv'
 
 
 class UserInput:
@@ -16,10 +23,73 @@ class UserInput:
             infile: Union[Path, None] = None,
             sequence_type: Union[str, None] = None,
             output_folder: Union[Path, None] = None,
+            record_filter: Union['RecordFilter', None] = None,
+            dedup: bool = False,
     ):
         self.infile = infile
         self.sequence_type = sequence_type
         self.output_folder = output_folder
+        self.record_filter = record_filter
+        self.dedup = dedup
+
+
+class RecordFilter:
+    """Class to store the filters a record must pass to be extracted.
+
+    Filters that are None are not applied. The organism and molecule type
+    filters are only used with GenBank files.
+    """
+    def __init__(
+            self,
+            ids: Union[set[str], None] = None,
+            id_regex: Union[re.Pattern, None] = None,
+            min_length: Union[int, None] = None,
+            max_length: Union[int, None] = None,
+            organism: Union[str, None] = None,
+            molecule_type: Union[str, None] = None,
+    ):
+        self.ids = ids
+        self.id_regex = id_regex
+        self.min_length = min_length
+        self.max_length = max_length
+        self.organism = organism
+        self.molecule_type = molecule_type
+
+    @property
+    def uses_length(self) -> bool:
+        return self.min_length is not None or self.max_length is not None
+
+    def match_id(self, *names: str) -> bool:
+        """Check if any of the names of a record passes the id filters."""
+        if self.ids is not None and not any(
+            name in self.ids for name in names
+        ):
+            return False
+        if self.id_regex and not any(
+            self.id_regex.search(name) for name in names
+        ):
+            return False
+        return True
+
+    def match_length(self, length: int) -> bool:
+        if self.min_length is not None and length < self.min_length:
+            return False
+        if self.max_length is not None and length > self.max_length:
+            return False
+        return True
+
+    def match_organism(self, organism: str) -> bool:
+        """Check the organism; the filter is a case-insensitive substring."""
+        return (
+            self.organism is None or
+            self.organism.lower() in organism.lower()
+        )
+
+    def match_molecule_type(self, molecule_type: str) -> bool:
+        return (
+            self.molecule_type is None or
+            self.molecule_type.lower() == molecule_type.lower()
+        )
 
 
 def parse_command_line_input() -> UserInput:
@@ -57,6 +127,51 @@ def parse_command_line_input() -> UserInput:
         '-o', '--output',
         help='Path to output folder.\nDefault: current working directory.'
     )
+    optional.add_argument(
+        '--dedup', action='store_true',
+        help=(
+            'Write each distinct sequence once, as the first record that\n' +
+            'has it. A table of the sequence hash of every record is\n' +
+            f'saved as `{DEDUP_TABLE}` in the output folder.'
+        )
+    )
+    # Make filter arguments.
+    filters = parser.add_argument_group(
+        'Filters', 'Only the records that pass all the filters are extracted.'
+    )
+    filters.add_argument(
+        '--ids',
+        help=(
+            'Path to txt file with the ids of the records to extract,\n' +
+            'one per line, with or without version.'
+        )
+    )
+    filters.add_argument(
+        '--id_regex',
+        help='Extract the records whose id matches this regular expression.'
+    )
+    filters.add_argument(
+        '--min_length', type=int,
+        help='Extract the records of at least this length.'
+    )
+    filters.add_argument(
+        '--max_length', type=int,
+        help='Extract the records of at most this length.'
+    )
+    filters.add_argument(
+        '--organism',
+        help=(
+            'Extract the records whose organism contains this text\n' +
+            '(case-insensitive). GenBank only.'
+        )
+    )
+    filters.add_argument(
+        '--molecule_type',
+        help=(
+            'Extract the records of this molecule type, e.g. `DNA` or\n' +
+            '`mRNA`, as given in the LOCUS line. GenBank only.'
+        )
+    )
     # Parse command line arguments and check their correctness.
     user_input = parse_command_line_arguments(parser.parse_args())
 
@@ -73,9 +188,88 @@ def parse_command_line_arguments(command_line_input: Namespace) -> UserInput:
     user_input.sequence_type = get_input_file_extension(user_input.infile)
     # Check if output folder is valid.
     user_input.output_folder = check_output_folder(command_line_input.output)
+    user_input.dedup = command_line_input.dedup
+    # Check the filters.
+    user_input.record_filter = check_record_filter(
+        command_line_input, user_input.sequence_type
+    )
     return user_input
 
 
+def check_record_filter(
+        command_line_input: Namespace, sequence_type: str
+) -> Union[RecordFilter, None]:
+    """Make the record filter from the command line, if any was given."""
+    args = command_line_input
+    ids = None
+    if args.ids:
+        with open(check_infile(args.ids), 'r') as f:
+            ids = [line.strip() for line in f if line.strip()]
+    try:
+        return make_record_filter(
+            sequence_type,
+            ids=ids,
+            id_regex=args.id_regex,
+            min_length=args.min_length,
+            max_length=args.max_length,
+            organism=args.organism,
+            molecule_type=args.molecule_type
+        )
+    except ValueError as error:
+        sys.exit(f'Error: {error}')
+
+
+def make_record_filter(
+        sequence_type: str,
+        ids: Union[Iterable[str], None] = None,
+        id_regex: Union[str, None] = None,
+        min_length: Union[int, None] = None,
+        max_length: Union[int, None] = None,
+        organism: Union[str, None] = None,
+        molecule_type: Union[str, None] = None
+) -> Union[RecordFilter, None]:
+    """Make a record filter, or None if no filter was given.
+
+    It raises ValueError if a filter is not valid.
+    """
+    if ids is None and not any((
+        id_regex, min_length is not None, max_length is not None, organism,
+        molecule_type
+    )):
+        return None
+    if sequence_type != 'gb' and (organism or molecule_type):
+        raise ValueError(
+            '`organism` and `molecule_type` can only be used with GenBank ' +
+            'files.'
+        )
+    if ids is not None:
+        ids = set(ids)
+        # Records are also matched by accession number without version.
+        ids |= {name.split('.')[0] for name in ids}
+    pattern = None
+    if id_regex:
+        try:
+            pattern = re.compile(id_regex)
+        except re.error as error:
+            raise ValueError(f'invalid `id_regex`: {error}') from error
+    for length in (min_length, max_length):
+        if length is not None and length < 0:
+            raise ValueError('lengths must be positive.')
+    if (
+        min_length is not None and max_length is not None and
+        min_length > max_length
+    ):
+        raise ValueError('`min_length` is larger than `max_length`.')
+    return RecordFilter(
+        ids=ids,
+        id_regex=pattern,
+        min_length=min_length,
+        max_length=max_length,
+        organism=organism,
+        molecule_type=molecule_type
+    )
+
+
 def check_infile(infile: Union[str, None]) -> Union[Path, None]:
     """Get infile and check if it's valid."""
     # if user provided input file check if valid.
@@ -92,8 +286,19 @@ def check_infile(infile: Union[str, None]) -> Union[Path, None]:
 
 def get_input_file_extension(infile: Path) -> str:
     """Get input file extension and check if it's valid."""
-    extension = infile.name.split('.')[-1:][0]
-    if extension == 'gb' or extension == 'bgk':
+    try:
+        return sequence_type_of(infile)
+    except ValueError as error:
+        sys.exit(f'Error: {error}')
+
+
+def sequence_type_of(infile: Path) -> str:
+    """Get the sequence type, `gb` or `fasta`, from the file extension.
+
+    It raises ValueError if the extension is not valid.
+    """
+    extension = Path(infile).name.split('.')[-1:][0]
+    if extension == 'gb' or extension == 'gbk':
         return 'gb'
     elif (
         extension == 'fasta' or extension == 'fna' or extension == 'ffn'
@@ -101,8 +306,8 @@ def get_input_file_extension(infile: Path) -> str:
     ):
         return 'fasta'
     else:
-        sys.exit(
-            f"Error: submitted input file `{infile.name}` doesn't have a " + 
+        raise ValueError(
+            f"submitted input file `{Path(infile).name}` doesn't have a " +
             "valid extension."
         )
 
@@ -123,59 +328,177 @@ def check_output_folder(output_folder: Union[str, None]) -> Path:
         return output_folder
 
 
-def extract_gb_files(inputfile: Path, output_folder: Path) -> None:
-    """Extract sequences from a GenBank file."""
+def extract_gb_files(
+        inputfile: Path,
+        output_folder: Path,
+        record_filter: Union[RecordFilter, None] = None,
+        deduplicator: Union[SequenceDeduplicator, None] = None
+) -> list[Path]:
+    """Extract sequences from a GenBank file.
+
+    Records are read line by line. With a filter, the lines of a record are
+    kept in memory only until its ORGANISM line, when all the filters can be
+    checked; the rest of the record is written or skipped as it's read.
+    With a deduplicator, records are kept in memory until their sequence is
+    hashed and only written if the sequence is new. It returns the paths of
+    the files written.
+    """
+    extracted = []
+    hasher = None
+    in_sequence = False
+    # Lines of the current record until the filters can be checked.
+    pending = []
+    # Whether the current record is written (True), skipped (False) or not
+    # checked yet (None).
+    keep = False
     with open(inputfile, 'r') as f:
         # Read file by lines until line is empty (EOF).
         while line := f.readline():
-            # If line is header open a new file to save the sequence.
-            if "LOCUS" in line:
+            # If line is header start a new record.
+            if line.startswith('LOCUS'):
                 # Get accession number for naming file.
-                name = line.split()[1]
-                # Make output path.
-                output_file = output_folder / f"{name}.gb"
-                # Open new file for writting.
-                writter = open(output_file, 'w')
-                # Write gb header.
-                writter.write(line)
-            # If `//` is at the begining of the line close file.
-            elif "/" in line[0] and "/" in line[1]:
-                writter.close()
+                fields = line.split()
+                name = fields[1]
+                pending = [line]
+                keep = None
+                if record_filter:
+                    length = int(fields[2]) if fields[2].isdigit() else 0
+                    molecule_type = fields[4] if len(fields) > 4 else ''
+                    if not (
+                        record_filter.match_id(name, name.split('.')[0]) and
+                        record_filter.match_length(length) and
+                        record_filter.match_molecule_type(molecule_type)
+                    ):
+                        keep = False
+                    elif record_filter.organism is None:
+                        keep = True
+                else:
+                    keep = True
+            elif keep is None:
+                pending.append(line)
+                # The organism is in the header, before the features.
+                if line.startswith('  ORGANISM'):
+                    keep = record_filter.match_organism(line[12:].strip())
+                elif line.startswith(('FEATURES', 'ORIGIN')):
+                    keep = record_filter.match_organism('')
+                else:
+                    continue
+                pending.pop()
             # If line is empty, do nothing.
             elif line == '\n':
                 continue
+            if keep and pending:
+                # Open new file for writting and write gb header.
+                if deduplicator:
+                    writter = StringIO()
+                    hasher = deduplicator.new_hasher()
+                    in_sequence = False
+                else:
+                    writter = open(output_folder / f"{name}.gb", 'w')
+                    extracted.append(output_folder / f"{name}.gb")
+                writter.writelines(pending)
+                pending = []
+                if line.startswith('LOCUS'):
+                    continue
+            if not keep:
+                continue
+            # If `//` is at the begining of the line end the record.
+            if line.startswith('//'):
+                writter.write(line)
+                if deduplicator and deduplicator.add(hasher, name):
+                    with open(output_folder / f"{name}.gb", 'w') as output:
+                        output.write(writter.getvalue())
+                    extracted.append(output_folder / f"{name}.gb")
+                writter.close()
+                keep = False
             # Else, concatenate lines into current working file.
             else:
                 writter.write(line)
+                # Hash the sequence, without positions and spaces.
+                if in_sequence:
+                    hasher.update(''.join(line.split()[1:]).upper().encode())
+                elif deduplicator and line.startswith('ORIGIN'):
+                    in_sequence = True
+    return extracted
+
+
+def extract_fasta_files(
+        inputfile: Path,
+        output_folder: Path,
+        record_filter: Union[RecordFilter, None] = None,
+        deduplicator: Union[SequenceDeduplicator, None] = None
+) -> list[Path]:
+    """Extract sequences from a FASTA file.
+
+    Records are read line by line. Records whose id doesn't pass the filter
+    are skipped as they're read; with a length filter or a deduplicator, the
+    lines of the other records are kept in memory until their length and
+    sequence hash are known. It returns the paths of the files written.
+    """
+    extracted = []
+    # Header and lines of a record waiting for its length to be known.
+    pending = []
+    length = 0
+    hasher = None
+    writter = None
+    keep = False
 
+    def flush_pending() -> None:
+        if (
+            pending and
+            (record_filter is None or record_filter.match_length(length)) and
+            (deduplicator is None or deduplicator.add(hasher, name))
+        ):
+            with open(output_folder / f"{name}.fa", 'w') as output:
+                output.writelines(pending)
+            extracted.append(output_folder / f"{name}.fa")
+        pending.clear()
 
-def extract_fasta_files(inputfile: Path, output_folder: Path) -> None:
-    """Extract sequences from a FASTA file."""
     with open(inputfile, 'r') as f:
-        # counter to keep track of sequences.
-        counter = 0
         # Read file by lines.
         while line := f.readline():
-            # If line is header open a new file to save the sequence.
+            # If line is header start a new record.
             if line[0] == '>':
+                # Close the previous record.
+                if writter:
+                    writter.close()
+                    writter = None
+                flush_pending()
                 # Get accession number for naming file.
                 name = get_acc_number_from_fasta_header(line)
-                # Make output path.
-                output_file = output_folder / f"{name}.fa"
-                # If sequence is not the first one, close file before opening a
-                # new one.
-                if counter > 0:
-                    writter.close()
-                # Open new file for writting.
-                writter = open(output_file, 'w')
-                # Write header.
-                writter.write(line)
-                counter += 1
+                keep = record_filter is None or record_filter.match_id(
+                    line[1:].split()[0], name
+                )
+                if not keep:
+                    continue
+                if deduplicator or (
+                    record_filter and record_filter.uses_length
+                ):
+                    pending.append(line)
+                    length = 0
+                    if deduplicator:
+                        hasher = deduplicator.new_hasher()
+                else:
+                    # Open new file for writting and write header.
+                    writter = open(output_folder / f"{name}.fa", 'w')
+                    writter.write(line)
+                    extracted.append(output_folder / f"{name}.fa")
+            elif not keep:
+                continue
             # Else, concatenate lines into current working file.
+            elif pending:
+                pending.append(line)
+                sequence = line.strip()
+                length += len(sequence)
+                if hasher:
+                    hasher.update(sequence.upper().encode())
             else:
                 writter.write(line)
         # Close last file.
-        writter.write(line)
+        if writter:
+            writter.close()
+        flush_pending()
+    return extracted
 
 
 def get_acc_number_from_fasta_header(header: str) -> str:
@@ -185,19 +508,74 @@ def get_acc_number_from_fasta_header(header: str) -> str:
     return name[1:]
 
 
+def split(
+        inputfile: Union[Path, str],
+        output_folder: Union[Path, str, None] = None,
+        ids: Union[Iterable[str], None] = None,
+        id_regex: Union[str, None] = None,
+        min_length: Union[int, None] = None,
+        max_length: Union[int, None] = None,
+        organism: Union[str, None] = None,
+        molecule_type: Union[str, None] = None,
+        dedup: bool = False
+) -> list[Path]:
+    """Write every sequence of a GenBank or FASTA file in its own file.
+
+    This is the Python interface of extract_sequences; the filters and
+    dedup are its options with the same names. The output folder defaults
+    to the current working directory. It returns the paths of the files
+    written.
+
+    It raises FileNotFoundError or NotADirectoryError for missing paths and
+    ValueError for an invalid extension or filter.
+    """
+    inputfile = Path(inputfile)
+    if not inputfile.is_file():
+        raise FileNotFoundError(f'`{inputfile}` does not exist')
+    output_folder = Path(output_folder) if output_folder else Path.cwd()
+    if not output_folder.is_dir():
+        raise NotADirectoryError(f'{output_folder} is not a directory')
+    sequence_type = sequence_type_of(inputfile)
+    record_filter = make_record_filter(
+        sequence_type, ids, id_regex, min_length, max_length, organism,
+        molecule_type
+    )
+    extract_files = (
+        extract_gb_files if sequence_type == 'gb' else extract_fasta_files
+    )
+    if not dedup:
+        return extract_files(inputfile, output_folder, record_filter)
+    with SequenceDeduplicator(output_folder / DEDUP_TABLE) as deduplicator:
+        return extract_files(
+            inputfile, output_folder, record_filter, deduplicator
+        )
+
+
 def extractor() -> UserInput:
     """Extract GenBank or FASTA sequences from a file."""
     user_input = parse_command_line_input()
+    deduplicator = None
+    if user_input.dedup:
+        deduplicator = SequenceDeduplicator(
+            user_input.output_folder / DEDUP_TABLE
+        )
     if user_input.sequence_type == 'gb':
-        extract_gb_files(
+        extracted = extract_gb_files(
             inputfile=user_input.infile,
-            output_folder=user_input.output_folder
+            output_folder=user_input.output_folder,
+            record_filter=user_input.record_filter,
+            deduplicator=deduplicator
         )
     if user_input.sequence_type == 'fasta':
-        extract_fasta_files(
+        extracted = extract_fasta_files(
             inputfile=user_input.infile,
-            output_folder=user_input.output_folder
+            output_folder=user_input.output_folder,
+            record_filter=user_input.record_filter,
+            deduplicator=deduplicator
         )
+    if deduplicator:
+        deduplicator.close()
+    print(f'{len(extracted)} sequences extracted.')
     return user_input
 
 
@@ -0,0 +1,9 @@
+"""Download DNA sequences from the nuccore database.
+
+`fetch` downloads sequences from Python; the command line tool is
+`fetch_sequences`.
+"""
+from labscripts.fetch_sequences.eutils import EutilsError
+from labscripts.fetch_sequences.fetch_sequences import fetch
+
+__all__ = ['EutilsError', 'fetch']
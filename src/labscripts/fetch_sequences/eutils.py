@@ -0,0 +1,137 @@
+"""Small client for the NCBI E-utilities.
+
+It is used for the history server mode of fetch_sequences: the accession
+numbers are uploaded with epost and the records are paged with efetch. All
+requests are sent with POST, so long lists never hit URL length limits.
+The base URL can be changed, e.g. to test against a local mock server.
+"""
+from typing import Union
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode
+from urllib.request import urlopen
+import xml.etree.ElementTree as ET
+import json
+import time
+import os
+
+# Base URL of the E-utilities; LABSCRIPTS_EUTILS_URL overrides it.
+EUTILS_URL = os.environ.get(
+    'LABSCRIPTS_EUTILS_URL', 'https://eutils.ncbi.nlm.nih.gov/entrez/eutils'
+)
+# Tries of every request, seconds to wait before trying again (times the
+# number of the try) and seconds to wait for an answer.
+MAX_TRIES = 3
+RETRY_WAIT = 5
+TIMEOUT = 300
+
+
+class EutilsError(Exception):
+    """Raised when the E-utilities answer with an error."""
+
+
+class EutilsClient:
+    """Class to send requests to the E-utilities."""
+    def __init__(
+            self,
+            email: Union[str, None] = None,
+            api_key: Union[str, None] = None,
+            base_url: str = EUTILS_URL,
+            tool: str = 'labscripts'
+    ):
+        self.email = email
+        self.api_key = api_key
+        self.base_url = base_url.rstrip('/')
+        self.tool = tool
+        # NCBI allows 3 requests per second, or 10 with an API key.
+        self.min_interval = 0.1 if api_key else 0.34
+        self.last_request = 0.0
+
+    def request(self, utility: str, params: dict) -> bytes:
+        """Send a POST request to utility and return the response body.
+
+        Requests are spaced as NCBI asks, and failed ones are tried again
+        MAX_TRIES times in total.
+        """
+        params = {key: value for key, value in params.items() if value}
+        params.update(tool=self.tool, email=self.email, api_key=self.api_key)
+        data = urlencode(
+            {key: value for key, value in params.items() if value}
+        ).encode()
+        url = f'{self.base_url}/{utility}.fcgi'
+        for attempt in range(1, MAX_TRIES + 1):
+            wait = self.last_request + self.min_interval - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            self.last_request = time.monotonic()
+            try:
+                with urlopen(url, data=data, timeout=TIMEOUT) as response:
+                    return response.read()
+            except HTTPError as error:
+                # Client errors other than rate limits won't get better.
+                if error.code < 500 and error.code != 429:
+                    raise EutilsError(f'{utility} failed: {error}') from error
+                if attempt == MAX_TRIES:
+                    raise EutilsError(f'{utility} failed: {error}') from error
+            except URLError as error:
+                if attempt == MAX_TRIES:
+                    raise EutilsError(f'{utility} failed: {error}') from error
+            time.sleep(RETRY_WAIT * attempt)
+
+    def epost(
+            self, db: str, ids: list[str], webenv: Union[str, None] = None
+    ) -> tuple[str, str]:
+        """Upload ids to the history server.
+
+        It returns the WebEnv and the query key. Give webenv to add the ids
+        to an existing WebEnv.
+        """
+        body = self.request(
+            'epost', {'db': db, 'id': ','.join(ids), 'WebEnv': webenv}
+        )
+        root = ET.fromstring(body)
+        error = root.findtext('ERROR')
+        webenv = root.findtext('WebEnv')
+        query_key = root.findtext('QueryKey')
+        if error or not webenv or not query_key:
+            raise EutilsError(f'epost failed: {error or body[:200]!r}')
+        return webenv, query_key
+
+    def esummary(self, db: str, ids: list[str]) -> list[dict]:
+        """Get the document summaries of ids.
+
+        Ids that the database doesn't have are left out.
+        """
+        body = self.request('esummary', {
+            'db': db, 'id': ','.join(ids), 'retmode': 'json'
+        })
+        try:
+            result = json.loads(body).get('result', {})
+        except ValueError as error:
+            raise EutilsError(f'esummary failed: {body[:200]!r}') from error
+        return [
+            result[uid] for uid in result.get('uids', [])
+            if uid in result and 'error' not in result[uid]
+        ]
+
+    def efetch(
+            self,
+            db: str,
+            webenv: str,
+            query_key: str,
+            retstart: int,
+            retmax: int,
+            **params
+    ) -> str:
+        """Fetch retmax records from retstart of a query of the history."""
+        body = self.request('efetch', {
+            'db': db, 'WebEnv': webenv, 'query_key': query_key,
+            'retstart': str(retstart), 'retmax': str(retmax), **params
+        })
+        return body.decode()
+
+    def efetch_ids(self, db: str, ids: list[str], **params) -> str:
+        """Fetch the records of ids, without the history server."""
+        body = self.request(
+            'efetch', {'db': db, 'id': ','.join(ids), **params}
+        )
+        return body.decode()
@@ -2,11 +2,21 @@
 import sys
 import argparse
 from argparse import Namespace
-from typing import Union
+from typing import Iterable, Union
 import re
+import os
+import shutil
+import tempfile
+from contextlib import redirect_stdout
+from io import StringIO
 from pathlib import Path
 
 from Bio import Entrez, SeqIO
+from Bio.SeqRecord import SeqRecord
+
+from labscripts.fetch_sequences.eutils import (
+    EUTILS_URL, EutilsClient, EutilsError
+)
 
 from labscripts.utils.utils import (
     check_argparse_mandatory_arguments, check_infile, check_output_folder
@@ -15,6 +25,55 @@ from labscripts.extract_sequences.extract_sequences import (
     extract_fasta_files, extract_gb_files
 )
 
+# Accession numbers with an optional region: `accession[:start-stop[:strand]]`.
+REGION_REGEX = re.compile(
+    r'^(?P<accession>[^:\s]+)'
+    r'(?::(?P<start>\d+)-(?P<stop>\d+)(?::(?P<strand>[+-]|1|2))?)?$'
+)
+# efetch strand codes.
+STRANDS = {'+': 1, '1': 1, '-': 2, '2': 2}
+# Accession numbers per esummary request when planning the batches.
+ESUMMARY_SIZE = 200
+# Bases per efetch request; longer records get a request of their own.
+BATCH_BASES = 10 * 10**6
+# Accession numbers per efetch request, whatever their length.
+MAX_BATCH_IDS = 200
+# Length assumed for records without a summary, i.e. about 10 per batch.
+UNKNOWN_LENGTH = BATCH_BASES // 10
+# Accession numbers per epost request of the history mode.
+EPOST_SIZE = 5000
+# Size (bytes) aimed at for every efetch response of the history mode.
+TARGET_RESPONSE_SIZE = 10 * 2**20
+# Records per efetch request of the history mode: first, fewest and most.
+INITIAL_RETMAX = 20
+MIN_RETMAX = 1
+MAX_RETMAX = 500
+
+
+class SequenceRegion:
+    """Class to store an accession number and the region to download."""
+    def __init__(
+            self,
+            accession: str,
+            start: Union[int, None] = None,
+            stop: Union[int, None] = None,
+            strand: Union[int, None] = None,
+    ):
+        self.accession = accession
+        self.start = start
+        self.stop = stop
+        self.strand = strand
+
+    @property
+    def is_region(self) -> bool:
+        return self.start is not None
+
+    def __str__(self) -> str:
+        if not self.is_region:
+            return self.accession
+        strand = ':-' if self.strand == 2 else ''
+        return f'{self.accession}:{self.start}-{self.stop}{strand}'
+
 
 class UserInput:
     """Class to store user input."""
@@ -27,6 +86,9 @@ class UserInput:
             output_name: Union[str, None] = None,
             path_output_file: Union[Path, None] = None,
             split_sequences: Union[bool, None] = None,
+            history: bool = False,
+            api_key: Union[str, None] = None,
+            eutils_url: str = EUTILS_URL,
     ):
         self.infile = infile
         self.sequence_type = sequence_type
@@ -35,6 +97,9 @@ class UserInput:
         self.output_name = output_name
         self.path_output_file = path_output_file
         self.split_sequences = split_sequences
+        self.history = history
+        self.api_key = api_key
+        self.eutils_url = eutils_url
 
 
 def parse_command_line_input() -> UserInput:
@@ -58,7 +123,14 @@ def parse_command_line_input() -> UserInput:
     # Make required arguments.
     required.add_argument(
         '-i', '--input', required=True,
-        help='Path to txt file with list of accession numbers.'
+        help=(
+            'Path to txt file with list of accession numbers, one per\n' +
+            'line. Use `accession:start-stop` to download only a\n' +
+            'region (1-based, both ends included), and\n' +
+            '`accession:start-stop:-` for its reverse complement.\n' +
+            'Regions are downloaded one per request, after the whole\n' +
+            'records.'
+        )
     )
     required.add_argument(
         '-t', '--type', required=True, help=(
@@ -88,6 +160,30 @@ def parse_command_line_input() -> UserInput:
             'If not provided, the sequences will be concatenated in one file.'
         )
     )
+    optional.add_argument(
+        '--history', action='store_true',
+        help=(
+            'Upload the accession numbers once to the NCBI history server\n' +
+            '(epost) and download the sequences in pages (efetch).\n' +
+            'The page size adapts to the size of the sequences.\n' +
+            'Use it for long lists of accession numbers.'
+        )
+    )
+    optional.add_argument(
+        '--api_key',
+        help=(
+            'NCBI API key, to send up to 10 requests per second.\n' +
+            'Default: the NCBI_API_KEY environment variable, if set.'
+        )
+    )
+    optional.add_argument(
+        '--eutils_url',
+        help=(
+            'Base URL of the E-utilities, e.g. of a local mock server.\n' +
+            'Used with --history and to plan the batches.\n' +
+            f'Default: {EUTILS_URL}'
+        )
+    )
     # Parse the command line arguments
     args = parser.parse_args()
     # Make sure user provided all required arguments.
@@ -122,6 +218,11 @@ def parse_command_line_arguments(args: Namespace) -> UserInput:
     )
     # Check if user wants to create independent files per retrived sequence.
     user_input.split_sequences = args.split_sequences
+    # Get the options of the history server mode.
+    user_input.history = args.history
+    user_input.api_key = args.api_key or os.environ.get('NCBI_API_KEY')
+    if args.eutils_url:
+        user_input.eutils_url = args.eutils_url
 
     return user_input
 
@@ -161,29 +262,78 @@ def check_output_name(output_name: str) -> str:
         return output_name
 
 
-def make_acc_number_batches(input_file: Path, batch_size: int = 100) -> list:
-    """Make batches of accession numbers."""
-    # Open input file to make batches of accession numbers.
+def parse_region(line: str) -> SequenceRegion:
+    """Parse a line `accession[:start-stop[:strand]]` of the input file.
+
+    It raises ValueError if the line is not valid.
+    """
+    match = REGION_REGEX.match(line)
+    if not match:
+        raise ValueError(f'invalid accession number or region `{line}`')
+    if match['start'] is None:
+        return SequenceRegion(match['accession'])
+    start, stop = int(match['start']), int(match['stop'])
+    if start < 1 or stop < start:
+        raise ValueError(f'invalid region `{line}`')
+    strand = STRANDS[match['strand']] if match['strand'] else None
+    return SequenceRegion(match['accession'], start, stop, strand)
+
+
+def read_sequence_regions(input_file: Path) -> list[SequenceRegion]:
+    """Read the accession numbers and regions of input_file, one per line."""
     with open(input_file, 'r') as f:
-        # Make list of accession numbers.
-        acc_list = f.readlines()
-        # Make acccession numbers batches.
-        batches = []
-        for i, item in enumerate(acc_list):
-            # Start batch.
-            if i % batch_size == 0:
-                batch = item.replace("\n", "")
-            # End batch and append to batches.
-            elif (i % batch_size) == (batch_size - 1):
-                batch = batch + "," + item.replace("\n", "")
-                batches.append(batch)
-            # Add items to batch.
-            else:
-                batch = batch + "," + item.replace("\n", "")
-        # If last batch is smaller than batch_size append it to batches.
-        if (batch.count(',') + 1) != batch_size:
-            batches.append(batch)
+        try:
+            return [parse_region(line.strip()) for line in f if line.strip()]
+        except ValueError as error:
+            sys.exit(f'Error: {error}')
 
+
+def sequence_lengths(
+        accession_numbers: list[str], client: EutilsClient
+) -> dict[str, int]:
+    """Get the length of the records from their esummary.
+
+    Lengths are stored by accession number with and without version, so
+    that both can be looked up.
+    """
+    lengths = {}
+    for i in range(0, len(accession_numbers), ESUMMARY_SIZE):
+        summaries = client.esummary(
+            'nuccore', accession_numbers[i:i + ESUMMARY_SIZE]
+        )
+        for summary in summaries:
+            for key in ('accessionversion', 'caption'):
+                if summary.get(key) and summary.get('slen'):
+                    lengths[summary[key]] = int(summary['slen'])
+    return lengths
+
+
+def plan_batches(
+        accession_numbers: list[str],
+        lengths: dict[str, int],
+        max_bases: int = BATCH_BASES,
+        max_ids: int = MAX_BATCH_IDS
+) -> list[str]:
+    """Make batches of accession numbers of up to max_bases bases.
+
+    The order of the accession numbers is kept. Records of max_bases or
+    more are batched alone, so they are streamed in a request of their own.
+    """
+    batches = []
+    batch = []
+    batch_bases = 0
+    for accession in accession_numbers:
+        length = lengths.get(accession, UNKNOWN_LENGTH)
+        if batch and (
+            batch_bases + length > max_bases or len(batch) == max_ids
+        ):
+            batches.append(','.join(batch))
+            batch = []
+            batch_bases = 0
+        batch.append(accession)
+        batch_bases += length
+    if batch:
+        batches.append(','.join(batch))
     return batches
 
 
@@ -211,6 +361,113 @@ def fetcher(batches: list, rettype: str, path_output_file: Path) -> None:
     output.close()
 
 
+def next_retmax(
+        retmax: int, n_records: int, response_size: int,
+        target_size: int = TARGET_RESPONSE_SIZE
+) -> int:
+    """Get the records of the next efetch from the size of the last one.
+
+    The page size is set to get responses of about target_size bytes, but
+    it is at most doubled at once, so a few short records don't make the
+    next request huge.
+    """
+    if not n_records or not response_size:
+        return min(retmax * 2, MAX_RETMAX)
+    record_size = response_size / n_records
+    retmax = min(int(target_size / record_size), retmax * 2)
+    return max(MIN_RETMAX, min(retmax, MAX_RETMAX))
+
+
+def fetcher_history(
+        accession_numbers: list[str],
+        rettype: str,
+        path_output_file: Path,
+        client: EutilsClient
+) -> None:
+    """Fetch DNA sequences through the NCBI history server.
+
+    The accession numbers are uploaded with epost, all in the same WebEnv,
+    and the sequences are downloaded with efetch in pages of adaptive size.
+    """
+    # Upload accession numbers.
+    webenv = None
+    query_keys = []
+    for i in range(0, len(accession_numbers), EPOST_SIZE):
+        webenv, query_key = client.epost(
+            'nuccore', accession_numbers[i:i + EPOST_SIZE], webenv
+        )
+        query_keys.append(
+            (query_key, len(accession_numbers[i:i + EPOST_SIZE]))
+        )
+    # Open file to save sequences in append mode.
+    output = open(path_output_file, 'a')
+    # Variable to keep track of downloaded accession numbers.
+    end = 0
+    retmax = INITIAL_RETMAX
+    for query_key, n_ids in query_keys:
+        retstart = 0
+        while retstart < n_ids:
+            size = min(retmax, n_ids - retstart)
+            print(f"Downloading sequence {end + 1} to {end + size}")
+            text = client.efetch(
+                'nuccore', webenv, query_key, retstart, size,
+                rettype=rettype, retmode='text', style='master'
+            )
+            # Parse and save the sequences.
+            records = list(SeqIO.parse(StringIO(text), rettype))
+            SeqIO.write(records, output, rettype)
+            if len(records) < size:
+                print(
+                    f'Warning: got {len(records)} of {size} sequences ' +
+                    f'{end + 1} to {end + size}.'
+                )
+            retstart += size
+            end += size
+            # The last page of a query key is cut short; the next pages
+            # grow from the page size asked for, not from it.
+            retmax = next_retmax(retmax, len(records), len(text))
+    # Close output file.
+    output.close()
+
+
+def fetch_regions(
+        regions: list[SequenceRegion],
+        rettype: str,
+        path_output_file: Path,
+        client: Union[EutilsClient, None] = None
+) -> None:
+    """Fetch the regions of DNA sequences, one request per region.
+
+    efetch takes a single range per request, so regions can't be batched.
+    The client is used if given; Bio.Entrez otherwise.
+    """
+    # Open file to save sequences in append mode.
+    output = open(path_output_file, 'a')
+    for region in regions:
+        print(f"Downloading region {region}")
+        params = {
+            'rettype': rettype, 'retmode': 'text',
+            'seq_start': region.start, 'seq_stop': region.stop
+        }
+        if region.strand:
+            params['strand'] = region.strand
+        # Access nuccore database to retrieve the region.
+        if client:
+            handle = StringIO(
+                client.efetch_ids('nuccore', [region.accession], **params)
+            )
+        else:
+            handle = Entrez.efetch(
+                db='nuccore', id=region.accession, **params
+            )
+        with handle:
+            # Parse and save the sequence.
+            record = SeqIO.parse(handle, rettype)
+            SeqIO.write(record, output, rettype)
+    # Close output file.
+    output.close()
+
+
 def extractor(
         sequence_file: Path, sequence_type: str, output_folder: Path
     ) -> None:
@@ -225,22 +482,132 @@ def extractor(
         )
 
 
+def download_sequences(
+        sequence_regions: list[SequenceRegion],
+        sequence_type: str,
+        path_output_file: Path,
+        email: Union[str, None] = None,
+        api_key: Union[str, None] = None,
+        history: bool = False,
+        eutils_url: str = EUTILS_URL
+) -> None:
+    """Download whole records and regions and append them to a file.
+
+    It raises EutilsError, or the urllib errors of Bio.Entrez, if a request
+    fails.
+    """
+    # Provide email to NCBI
+    Entrez.email = email
+    Entrez.api_key = api_key
+    # Whole records and regions are fetched apart.
+    accession_numbers = [
+        region.accession for region in sequence_regions
+        if not region.is_region
+    ]
+    regions = [region for region in sequence_regions if region.is_region]
+    client = EutilsClient(email=email, api_key=api_key, base_url=eutils_url)
+    if history:
+        # Fetch sequences through the history server.
+        if accession_numbers:
+            fetcher_history(
+                accession_numbers=accession_numbers,
+                rettype=sequence_type,
+                path_output_file=path_output_file,
+                client=client
+            )
+        fetch_regions(
+            regions=regions,
+            rettype=sequence_type,
+            path_output_file=path_output_file,
+            client=client
+        )
+    else:
+        # Make batches of accession numbers by the length of the records.
+        print('Planning batches from the length of the records.')
+        try:
+            lengths = sequence_lengths(accession_numbers, client)
+        except EutilsError as error:
+            print(f'Warning: {error}; using batches of 10 sequences.')
+            lengths = {}
+        batches = plan_batches(accession_numbers, lengths)
+        # fetch sequences.
+        fetcher(
+            batches=batches,
+            rettype=sequence_type,
+            path_output_file=path_output_file
+        )
+        fetch_regions(
+            regions=regions,
+            rettype=sequence_type,
+            path_output_file=path_output_file
+        )
+
+
+def fetch(
+        accessions: Union[str, Iterable[str]],
+        sequence_type: str = 'fasta',
+        email: Union[str, None] = None,
+        api_key: Union[str, None] = None,
+        history: bool = False,
+        eutils_url: str = EUTILS_URL,
+        output_file: Union[Path, str, None] = None
+) -> list[SeqRecord]:
+    """Download sequences from the nuccore database and return them.
+
+    This is the Python interface of fetch_sequences. accessions can have
+    regions, `accession[:start-stop[:strand]]`; a single accession can be
+    given as a string. sequence_type is `gb` or `fasta`. If output_file is given, the sequences are also appended to it.
+
+    It raises ValueError for an invalid type, email or accession number, and
+    EutilsError, or the urllib errors of Bio.Entrez, if a request fails.
+    """
+    if sequence_type not in ('gb', 'fasta'):
+        raise ValueError(f'`{sequence_type}` is not a valid type')
+    if email and not is_valid_email(email):
+        raise ValueError(f'invalid email `{email}`')
+    # A string is one accession, not an iterable of one-letter ids.
+    if isinstance(accessions, str):
+        accessions = [accessions]
+    sequence_regions = [
+        parse_region(accession.strip()) for accession in accessions
+        if accession.strip()
+    ]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path_sequences = Path(tmp_dir) / f'sequences.{sequence_type}'
+        path_sequences.touch()
+        # The progress messages are not shown.
+        with redirect_stdout(StringIO()):
+            download_sequences(
+                sequence_regions, sequence_type, path_sequences, email,
+                api_key, history, eutils_url
+            )
+        if output_file:
+            with (
+                open(path_sequences, 'r') as f,
+                open(output_file, 'a') as output
+            ):
+                shutil.copyfileobj(f, output)
+        return list(SeqIO.parse(path_sequences, sequence_type))
+
+
 def main():
     # Parse command line arguments.
     user_input = parse_command_line_input()
-    # Provide email to NCBI
-    Entrez.email = user_input.email
-    # Make batches of accession numbers.
-    batches = make_acc_number_batches(
-        input_file=user_input.infile, batch_size=10
-    )
+    # Read accession numbers and regions.
+    sequence_regions = read_sequence_regions(user_input.infile)
     print('\nConecting to nuccore database to donwload sequences.\n')
-    # fetch sequences.
-    fetcher(
-        batches=batches,
-        rettype=user_input.sequence_type,
-        path_output_file=user_input.path_output_file
-    )
+    try:
+        download_sequences(
+            sequence_regions=sequence_regions,
+            sequence_type=user_input.sequence_type,
+            path_output_file=user_input.path_output_file,
+            email=user_input.email,
+            api_key=user_input.api_key,
+            history=user_input.history,
+            eutils_url=user_input.eutils_url
+        )
+    except EutilsError as error:
+        sys.exit(f'Error: {error}')
     # If requested, split sequences into individual files
     if user_input.split_sequences:
         extractor(
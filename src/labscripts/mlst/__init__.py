@@ -0,0 +1,8 @@
+"""MLST typing of genomes and reads.
+
+`Typer` types genomes from Python; the command line tool is `mlst`.
+"""
+from labscripts.mlst.mlst_utils import MlstError
+from labscripts.mlst.mlst_api import Typer, TypingResult
+
+__all__ = ['MlstError', 'Typer', 'TypingResult']
@@ -0,0 +1,264 @@
+"""Type genomes with MLST from Python, without the command line.
+
+Example:
+
+    from labscripts.mlst import Typer
+
+    typer = Typer('ecoli')
+    result = typer.type('genome.fasta')
+    print(result.sequence_type)
+
+Errors are raised as exceptions, MlstError for typing errors, and every
+call to `type` gets its own scratch folder, which is removed at the end.
+A Typer can be used from several threads at once: the work is done by
+blastn or KMA, so `type_many` keeps `jobs` of them busy from one process.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from importlib import resources
+from pathlib import Path
+from typing import Iterable, Union
+import re
+import shutil
+
+from Bio import SeqIO
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+
+from labscripts.mlst.mlst_utils import (
+    InputMlstyper, MlstError, has_fasta_extension, results_by_scheme
+)
+from labscripts.mlst.mlst_cge import mlstyper
+from labscripts.mlst.mlst_scratch import SHM_MIN_FREE, ScratchSpace
+from labscripts.mlst.mlst_screen import detect_schemes, load_sketch_index
+
+# Name of the genome written in the scratch folder when given as sequences.
+GENOME_FILE = 'genome.fasta'
+# Strings that are taken as a sequence and not as the path to a file: IUPAC
+# nucleotide codes, gaps and white space only.
+SEQUENCE_REGEX = re.compile(r'^[ACGTURYSWKMBDHVNacgturyswkmbdhvn\-\s]+$')
+
+Genome = Union[str, Path, Seq, SeqRecord, Iterable[SeqRecord], list[Path]]
+
+
+def default_database() -> Path:
+    """Get the MLST database installed with labscripts."""
+    return Path(str(resources.files('labscripts.mlst') / 'mlst_db'))
+
+def raised_by_cgecore(error: BaseException) -> bool:
+    """Check if error was raised by the code of cgecore."""
+    traceback = error.__traceback__
+    if traceback is None:
+        return False
+    while traceback.tb_next is not None:
+        traceback = traceback.tb_next
+    module = traceback.tb_frame.f_globals.get('__name__', '')
+    return module == 'cgecore' or module.startswith('cgecore.')
+
+def database_schemes(database: Path) -> list[str]:
+    """Get the schemes in the config file of database."""
+    config_file = Path(database) / 'config'
+    if not config_file.is_file():
+        raise MlstError(f'{database} is not an MLST database.')
+    with open(config_file, 'r') as f:
+        return [
+            line.split('\t')[0] for line in f
+            if line.strip() and not line.startswith('#')
+        ]
+
+
+class TypingResult:
+    """Class to store the MLST results of a genome.
+
+    results holds the results of every scheme, as in the json file of
+    mlstyper: the sequence type, the allele profile, the nearest STs and the
+    notes. It is empty if the species is `auto` and no scheme was found.
+    """
+    def __init__(self, genome_id: str, results: dict[str, dict]):
+        self.id = genome_id
+        self.results = results
+
+    def __repr__(self) -> str:
+        return f'TypingResult({self.id!r}, {self.sequence_types!r})'
+
+    @property
+    def schemes(self) -> list[str]:
+        return list(self.results)
+
+    @property
+    def sequence_types(self) -> dict[str, str]:
+        """Get the sequence type of every scheme."""
+        return {
+            scheme: scheme_results['sequence_type']
+            for scheme, scheme_results in self.results.items()
+        }
+
+    @property
+    def sequence_type(self) -> Union[str, None]:
+        """Get the sequence type if a single scheme was typed.
+
+        With several schemes, use sequence_types.
+        """
+        if len(self.results) != 1:
+            return None
+        return next(iter(self.results.values()))['sequence_type']
+
+    def alleles(self, scheme: Union[str, None] = None) -> dict[str, str]:
+        """Get the allele of every locus of scheme.
+
+        Novel alleles get their provisional name if a registry was used.
+        scheme can be left out if a single scheme was typed.
+        """
+        if scheme is None:
+            if len(self.results) != 1:
+                raise ValueError('Give the scheme of the alleles.')
+            scheme = self.schemes[0]
+        if scheme not in self.results:
+            raise KeyError(scheme)
+        return {
+            locus: allele_info.get('novel_allele') or
+            allele_info['allele_name']
+            for locus, allele_info in
+            self.results[scheme]['allele_profile'].items()
+        }
+
+
+class Typer:
+    """Class to type genomes with one or more MLST schemes.
+
+    species can be a scheme (`ecoli`), several schemes separated by commas
+    (`ecoli,ecoli_2`) or `auto` to detect the schemes of every genome. The
+    other arguments are the options of `mlst run` with the same names.
+    A Typer can type any number of genomes.
+    """
+    def __init__(
+            self,
+            species: str,
+            database: Union[Path, str, None] = None,
+            method_path: Union[Path, str, None] = None,
+            two_stage: bool = False,
+            novel_registry: Union[Path, str, None] = None,
+            scratch_dir: Union[Path, str, None] = None,
+            shm_min_free: int = SHM_MIN_FREE
+    ):
+        self.database = Path(database) if database else default_database()
+        known_schemes = database_schemes(self.database)
+        self.species = species
+        self.sketch_index = None
+        if species == 'auto':
+            self.sketch_index = load_sketch_index(self.database)
+        else:
+            for scheme in species.split(','):
+                if scheme not in known_schemes:
+                    raise MlstError(f'{scheme} is not a valid species option.')
+        if method_path and shutil.which(str(method_path)) is None:
+            raise MlstError(f'{method_path} is not an executable.')
+        self.method_path = str(method_path) if method_path else None
+        self.two_stage = two_stage
+        self.novel_registry = Path(novel_registry) if novel_registry else None
+        self.scratch_dir = scratch_dir
+        self.shm_min_free = shm_min_free
+
+    def type(
+            self, genome: Genome, genome_id: Union[str, None] = None
+    ) -> TypingResult:
+        """Type a genome and return its results.
+
+        genome can be the path to a FASTA file, a list with the paths to one
+        or two FASTQ files of a sample, or the sequence(s) themselves: a
+        string of IUPAC nucleotide codes or a Seq, a SeqRecord or several
+        SeqRecords, e.g. contigs. Other strings are taken as paths.
+        genome_id defaults to the file name or the id of the first record.
+        """
+        with ScratchSpace(self.scratch_dir, self.shm_min_free) as scratch:
+            infiles, default_id = self.write_genome(genome, scratch)
+            genome_id = genome_id or default_id
+            species = self.species
+            if self.sketch_index is not None:
+                # Sketches are only made from FASTA files.
+                if len(infiles) > 1 or not has_fasta_extension(infiles[0]):
+                    raise MlstError('`auto` works only with FASTA genomes.')
+                schemes = detect_schemes(self.sketch_index, Path(infiles[0]))
+                if not schemes:
+                    return TypingResult(genome_id, {})
+                species = ','.join(schemes)
+            input_mlstyper = InputMlstyper(
+                infile=infiles,
+                species=species,
+                database=self.database,
+                tmp_dir=scratch,
+                method_path=self.method_path,
+                outdir_mlstyper=scratch,
+                extented_output=False,
+                quiet=True,
+                novel_registry=self.novel_registry,
+                two_stage=self.two_stage
+            )
+            # cgecore calls sys.exit when BLAST or KMA fail. Any other
+            # SystemExit, e.g. from a signal handler of the caller, is
+            # left alone.
+            try:
+                data = mlstyper(input_mlstyper)
+            except SystemExit as error:
+                if not raised_by_cgecore(error):
+                    raise
+                raise MlstError(str(error.code)) from error
+        return TypingResult(genome_id, results_by_scheme(data))
+
+    def type_many(
+            self, genomes: Iterable[Genome], jobs: int = 1
+    ) -> list[TypingResult]:
+        """Type several genomes, jobs at a time, in threads.
+
+        The results are in the order of genomes. The first error is raised
+        once the genomes being typed are done.
+        """
+        if jobs < 1:
+            raise ValueError('jobs must be at least 1.')
+        if jobs == 1:
+            return [self.type(genome) for genome in genomes]
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            return list(executor.map(self.type, genomes))
+
+    @staticmethod
+    def write_genome(
+            genome: Genome, scratch: Path
+    ) -> tuple[list[str], str]:
+        """Get the input files of genome and its default id.
+
+        Sequences are written as a FASTA file in scratch.
+        """
+        if isinstance(genome, Path) or (
+            isinstance(genome, str) and Path(genome).is_file()
+        ):
+            path = Path(genome)
+            if not path.is_file():
+                raise FileNotFoundError(f'{path} does not exist.')
+            return [str(path)], path.name.split('.')[0]
+        if isinstance(genome, (list, tuple)) and genome and all(
+            isinstance(path, (str, Path)) for path in genome
+        ):
+            paths = [Path(path) for path in genome]
+            for path in paths:
+                if not path.is_file():
+                    raise FileNotFoundError(f'{path} does not exist.')
+            return [str(path) for path in paths], paths[0].name.split('.')[0]
+        if isinstance(genome, str) and not SEQUENCE_REGEX.match(genome):
+            raise FileNotFoundError(f'{genome} does not exist.')
+        if isinstance(genome, str):
+            # Sequences pasted from a file may be wrapped.
+            records = [SeqRecord(Seq(''.join(genome.split())), id='sequence')]
+        elif isinstance(genome, Seq):
+            records = [SeqRecord(genome, id='sequence')]
+        elif isinstance(genome, SeqRecord):
+            records = [genome]
+        else:
+            records = list(genome)
+            if not records or not all(
+                isinstance(record, SeqRecord) for record in records
+            ):
+                raise TypeError(
+                    'genome must be a path, a sequence or SeqRecords.'
+                )
+        path = scratch / GENOME_FILE
+        SeqIO.write(records, path, 'fasta')
+        return [str(path)], records[0].id
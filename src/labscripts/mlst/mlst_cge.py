@@ -20,10 +20,15 @@ All modification are indicated with comments that have the IMG innitials.
 import os, sys, re, time, pprint, io, shutil
 import argparse, subprocess
 import tempfile
+import functools
+import threading
 from pathlib import Path
 from typing import Union
 from importlib import resources
+from collections.abc import Mapping
 
+from Bio import SeqIO
+from Bio.Blast import NCBIXML
 from cgecore.alignment import extended_cigar
 from cgecore.blaster.blaster import Blaster
 from cgecore.cgefinder import CGEFinder
@@ -31,7 +36,9 @@ import json, gzip
 from tabulate import tabulate
 
 from labscripts import mlst
-from labscripts.mlst.mlst_utils import InputMlstyper
+from labscripts.mlst.mlst_utils import InputMlstyper, MlstError, quiet_stdout
+from labscripts.mlst.mlst_novel import NovelAlleleRegistry
+from labscripts.mlst.mlst_tables import ProfileTable
 
 def get_read_filename(infiles):
     ''' Infiles must be a list with 1 or 2 input files.
@@ -57,8 +64,8 @@ def get_read_filename(infiles):
             sample_name += seq_file[i]
         else:
             break
-    if sample_name == "":
-        sys.error("Input error: sample names of input files, {} and {}, \
+    if sample_name == "": # <- IMG: sys.error does not exist
+        raise MlstError("Input error: sample names of input files, {} and {}, \
                    does not share a common sample name. If these files \
                    are paired end reads from the same sample, please rename \
                    them with a common sample name (e.g. 's22_R1.fq', 's22_R2.fq') \
@@ -148,6 +155,65 @@ def import_profile(database, species, loci_list):
 
     return st_profiles
 
+# Profile table of a scheme, written by `mlst db build` (IMG)
+PROFILE_CACHE_SUFFIX = ".profiles"
+# Cache of older versions, removed when the table is written (IMG)
+OLD_PROFILE_CACHE_SUFFIX = ".profiles.pickle"
+
+def profile_cache_file(database, species):
+    """Path to the profile table of species, next to its .tsv file (IMG)"""
+    return Path(database) / species / "{}{}".format(species, PROFILE_CACHE_SUFFIX)
+
+def profile_stamp(database, species):
+    """Size and modification time of the .tsv file of species (IMG)"""
+    stat = os.stat("{0}/{1}/{1}.tsv".format(database, species))
+    return [stat.st_size, stat.st_mtime_ns]
+
+def write_profile_cache(database, species, loci_list):
+    """Parse the profiles of species once and save them as a table that
+    the typer maps read-only, see mlst_tables (IMG)
+    """
+    stamp = profile_stamp(database, species)
+    table = ProfileTable.from_profiles(
+        import_profile(database, species, loci_list), stamp
+    )
+    table.save(profile_cache_file(database, species))
+    old_cache = Path(database) / species / "{}{}".format(
+        species, OLD_PROFILE_CACHE_SUFFIX
+    )
+    if old_cache.exists():
+        old_cache.unlink()
+
+# Profiles already loaded by this process, shared by its threads. Tables
+# are mapped, so worker processes share their memory (IMG)
+_loaded_profiles = {}
+_loaded_profiles_lock = threading.Lock()
+
+def load_profile(database, species, loci_list):
+    """Same as import_profile, but the profile table written by
+    `mlst db build` is used when it matches the .tsv file. Profiles are
+    kept in memory while the .tsv file doesn't change; they must not be
+    modified (IMG)
+    """
+    key = (str(database), species, tuple(loci_list))
+    stamp = profile_stamp(database, species)
+    with _loaded_profiles_lock:
+        loaded = _loaded_profiles.get(key)
+    if loaded is not None and loaded[0] == stamp:
+        return loaded[1]
+    profiles = None
+    try:
+        table = ProfileTable.load(profile_cache_file(database, species))
+        if table.stamp == stamp and table.loci == list(loci_list):
+            profiles = table
+    except (OSError, ValueError, KeyError):
+        pass
+    if profiles is None:
+        profiles = import_profile(database, species, loci_list)
+    with _loaded_profiles_lock:
+        _loaded_profiles[key] = (stamp, profiles)
+    return profiles
+
 def st_typing(st_profiles, allele_matches, loci_list):
     """
     Takes the path to a dictionary, the inp list of the allele
@@ -423,22 +489,629 @@ def parse_command_line():
     return args
 
 
+# -- Modified by IMG ----------------------------------------------------------
+# Type several MLST schemes with a single blastn search. The alleles of all the
+# schemes are written in one subject file with their headers prefixed by the
+# scheme name, and the hits are split back by scheme after the search.
+# -----------------------------------------------------------------------------
+SCHEME_SEPARATOR = ":"
+
+def scheme_allele_files(database, scheme):
+    """Get the FASTA file(s) with the alleles of scheme.
+
+    The `<scheme>/<scheme>.fsa` file is used if it exists. Otherwise, the
+    per-locus files in `alleles/<scheme>/` are used.
+    """
+    fsa_file = Path(database) / scheme / "{}.fsa".format(scheme)
+    if fsa_file.exists():
+        return [fsa_file]
+    return sorted((Path(database) / "alleles" / scheme).glob("*.tfa"))
+
+def make_schemes_subject(database, schemes, tmp_dir, name):
+    """Write the alleles of schemes in `<tmp_dir>/<name>.fsa`.
+
+    Each header is prefixed with the scheme name and SCHEME_SEPARATOR.
+    """
+    with open("{}/{}.fsa".format(tmp_dir, name), "w") as subject:
+        for scheme in schemes:
+            for allele_file in scheme_allele_files(database, scheme):
+                with open(allele_file, "r") as alleles:
+                    for line in alleles:
+                        if line.startswith(">"):
+                            line = ">{}{}{}".format(
+                                scheme, SCHEME_SEPARATOR, line[1:].lstrip()
+                            )
+                        subject.write(line)
+
+class SchemesBlaster(Blaster):
+    """Blaster for a subject file with the alleles of several schemes.
+
+    Overlapping hits are only compared between alleles of the same scheme, so
+    each scheme gets the hits it would get if it was searched alone.
+    """
+    @staticmethod
+    def compare_results(save, best_hsp, tmp_results, tmp_gene_split,
+                        allowed_overlap):
+        scheme = best_hsp["sbjct_header"].split(SCHEME_SEPARATOR, 1)[0]
+        same_scheme = {}
+        other_schemes = {}
+        for hit_id, hit in tmp_results.items():
+            hit_scheme = hit["sbjct_header"].split(SCHEME_SEPARATOR, 1)[0]
+            if hit_scheme == scheme:
+                same_scheme[hit_id] = hit
+            else:
+                other_schemes[hit_id] = hit
+        save, tmp_gene_split, same_scheme = Blaster.compare_results(
+            save, best_hsp, same_scheme, tmp_gene_split, allowed_overlap
+        )
+        other_schemes.update(same_scheme)
+        return save, tmp_gene_split, other_schemes
+
+# -- Modified by IMG ----------------------------------------------------------
+# Search the BLAST databases built by `mlst db build` with `-db`, so that the
+# alleles are not read and indexed again for every genome. Their headers have
+# the scheme prefix of the subject files above.
+# -----------------------------------------------------------------------------
+# Alleles of a scheme with the scheme prefix, kept next to its BLAST
+# database. Blaster reads the full allele of partial hits from them.
+BLAST_ALLELES_SUFFIX = ".alleles.fsa"
+# Files made by makeblastdb for a nucleotide database, and the alleles.
+BLAST_DB_SUFFIXES = [".nhr", ".nin", ".nsq", BLAST_ALLELES_SUFFIX]
+# Files made by kma_index. The `.comp.b` file holds the k-mer hash.
+KMA_INDEX_SUFFIXES = [".comp.b", ".length.b", ".name", ".seq.b"]
+
+def has_blast_database(database, scheme):
+    """Check if the BLAST database of scheme was built."""
+    prefix = Path(database) / scheme / scheme
+    return all(
+        prefix.with_name(scheme + suffix).exists()
+        for suffix in BLAST_DB_SUFFIXES
+    )
+
+class DbBlaster(SchemesBlaster):
+    """SchemesBlaster that searches the BLAST databases of schemes.
+
+    blastn is run here with `-db`; Blaster only parses its output, which it
+    finds in place thanks to reuse_results. Blaster reads the full allele of
+    partial hits from `<out_path>/schemes.fsa`, which is linked to the
+    alleles kept with the database, or made from them for several schemes.
+    """
+    def __init__(self, inputfile, schemes, database, out_path, min_cov=0.6,
+                 threshold=0.9, blast="blastn", max_target_seqs=50000):
+        out_file = "{}/tmp/out_schemes.xml".format(out_path)
+        os.makedirs(os.path.dirname(out_file), exist_ok=True)
+        # Several databases are searched as one; quotes protect spaces.
+        db_list = " ".join(
+            '"{}"'.format(Path(database) / scheme / scheme) for scheme in schemes
+        )
+        cmd = [blast, "-db", db_list, "-query", str(inputfile),
+               "-out", out_file, "-outfmt", "5",
+               "-perc_identity", str(100 * float(threshold)),
+               "-max_target_seqs", str(max_target_seqs), "-dust", "no"]
+        # In its own session, so Ctrl-C reaches only mlst (IMG)
+        process = subprocess.run(cmd, capture_output=True, text=True,
+                                 start_new_session=True)
+        if process.returncode != 0:
+            raise MlstError("BLAST did not run as expected.\n"
+                            "BLAST finished with the following response:\n{}\n{}"
+                            .format(process.stdout, process.stderr))
+        write_schemes_alleles(database, schemes, out_path)
+        super().__init__(inputfile, ["schemes"], out_path, out_path, min_cov,
+                         threshold, blast, cut_off=False,
+                         max_target_seqs=max_target_seqs, reuse_results=True)
+
+def write_schemes_alleles(database, schemes, out_path):
+    """Put the prefixed alleles of schemes in `<out_path>/schemes.fsa`."""
+    subject = Path(out_path) / "schemes.fsa"
+    if subject.is_symlink() or subject.exists():
+        subject.unlink()
+    allele_files = [
+        Path(database) / scheme / (scheme + BLAST_ALLELES_SUFFIX)
+        for scheme in schemes
+    ]
+    if len(allele_files) == 1:
+        os.symlink(allele_files[0].resolve(), subject)
+        return
+    with open(subject, "wb") as outfile:
+        for allele_file in allele_files:
+            with open(allele_file, "rb") as infile:
+                shutil.copyfileobj(infile, outfile)
+
+def split_scheme_hits(scheme_hits, schemes):
+    """Split the hits of a SchemesBlaster search by scheme.
+
+    The scheme prefix is removed from the subject headers.
+    """
+    results = {scheme: {} for scheme in schemes}
+    if scheme_hits != "No hit found":
+        for hit, locus_hit in scheme_hits.items():
+            if (SCHEME_SEPARATOR not in locus_hit["sbjct_header"]
+                    and len(schemes) == 1):
+                # A BLAST database from before the prefixed headers.
+                locus_hit = dict(locus_hit, sbjct_header="{}{}{}".format(
+                    schemes[0], SCHEME_SEPARATOR, locus_hit["sbjct_header"]))
+            scheme, header = locus_hit["sbjct_header"].split(
+                SCHEME_SEPARATOR, 1
+            )
+            locus_hit = dict(locus_hit, sbjct_header=header)
+            results[scheme][hit] = locus_hit
+    for scheme in schemes:
+        if not results[scheme]:
+            results[scheme] = "No hit found"
+    return results
+
+# -- Modified by IMG ----------------------------------------------------------
+# Two-stage search of FASTA genomes. A few representative alleles per locus
+# locate the loci in the genome, and all the alleles are then searched only
+# against windows around them. The windows are as long as the hit plus the
+# longest allele of the locus on each side, so every allele that the whole
+# genome would give is found whole. If a locus is not located, the whole
+# genome is searched as before.
+# -----------------------------------------------------------------------------
+# Alleles per locus used to locate the loci.
+REPRESENTATIVE_ALLELES = 3
+# Identity (%) of the locating hits; lower than the typing threshold because
+# the allele of the genome may be far from the representatives.
+LOCATE_IDENTITY = 70
+# Minimum fraction of a representative allele aligned by its hit.
+LOCATE_COVERAGE = 0.5
+REPRESENTATIVE_REGEX = re.compile(r"(\S+){}(\S+)__rep\d+".format(SCHEME_SEPARATOR))
+
+def read_alleles(allele_file):
+    """Yield (header, sequence) of the alleles in allele_file."""
+    header, chunks = None, []
+    with open(allele_file, "r") as f:
+        for line in f:
+            if line.startswith(">"):
+                if header is not None:
+                    yield header, "".join(chunks)
+                header, chunks = line[1:].strip(), []
+            else:
+                chunks.append(line.strip())
+    if header is not None:
+        yield header, "".join(chunks)
+
+@functools.lru_cache(maxsize=None)
+def scheme_representatives(database, scheme):
+    """Get the representative alleles of every locus of scheme and the length
+    of its longest allele. They are read once per process.
+    """
+    alleles = {}
+    for allele_file in scheme_allele_files(database, scheme):
+        for header, sequence in read_alleles(allele_file):
+            allele_obj = ALLELE_NAME_REGEX.search(header.split()[0])
+            if allele_obj:
+                alleles.setdefault(allele_obj.group(1), []).append(sequence)
+    representatives = []
+    longest = {}
+    for locus, sequences in alleles.items():
+        longest[locus] = max(len(sequence) for sequence in sequences)
+        # Take them spread over the file, which is sorted by allele number.
+        step = max(1, len(sequences) // REPRESENTATIVE_ALLELES)
+        representatives += [
+            (locus, sequence)
+            for sequence in sequences[::step][:REPRESENTATIVE_ALLELES]
+        ]
+    return tuple(representatives), longest
+
+def locate_loci(infile, schemes, database, tmp_dir, blast):
+    """Find the loci of schemes in the genome with the representatives.
+
+    It returns a list of (contig, start, end, flank) and the set of
+    (scheme, locus) found.
+    """
+    reps_file = "{}/representatives.fsa".format(tmp_dir)
+    out_file = "{}/representatives.xml".format(tmp_dir)
+    flanks = {}
+    with open(reps_file, "w") as f:
+        for scheme in schemes:
+            representatives, longest = scheme_representatives(
+                str(database), scheme)
+            for i, (locus, sequence) in enumerate(representatives):
+                f.write(">{}{}{}__rep{}\n{}\n".format(
+                    scheme, SCHEME_SEPARATOR, locus, i, sequence))
+            for locus, length in longest.items():
+                flanks[(scheme, locus)] = length
+    cmd = [blast, "-subject", reps_file, "-query", str(infile),
+           "-out", out_file, "-outfmt", "5",
+           "-perc_identity", str(LOCATE_IDENTITY), "-dust", "no"]
+    # In its own session, so Ctrl-C reaches only mlst (IMG)
+    process = subprocess.run(cmd, capture_output=True, text=True,
+                             start_new_session=True)
+    if process.returncode != 0:
+        raise MlstError("BLAST did not run as expected.\n"
+                        "BLAST finished with the following response:\n{}\n{}"
+                        .format(process.stdout, process.stderr))
+    hits = []
+    found = set()
+    with open(out_file, "r") as f:
+        for record in NCBIXML.parse(f):
+            for alignment in record.alignments:
+                rep_obj = REPRESENTATIVE_REGEX.search(alignment.title)
+                if rep_obj is None:
+                    continue
+                key = (rep_obj.group(1), rep_obj.group(2))
+                for hsp in alignment.hsps:
+                    if hsp.align_length < LOCATE_COVERAGE * alignment.length:
+                        continue
+                    start = min(hsp.query_start, hsp.query_end)
+                    end = max(hsp.query_start, hsp.query_end)
+                    hits.append((record.query, start, end, flanks[key]))
+                    found.add(key)
+    return hits, found
+
+def write_locus_windows(infile, schemes, loci_lists, database, tmp_dir, blast):
+    """Write the windows around the loci of the genome in a FASTA file.
+
+    It returns the path to the file and, for every window, its contig and
+    offset; or None if a locus could not be located.
+    """
+    hits, found = locate_loci(infile, schemes, database, tmp_dir, blast)
+    for scheme in schemes:
+        for locus in loci_lists[scheme]:
+            if (scheme, locus) not in found:
+                return None
+    # Regions of every contig, merged where they overlap.
+    regions = {}
+    for contig, start, end, flank in hits:
+        regions.setdefault(contig, []).append((start - flank, end + flank))
+    windows_file = "{}/windows.fsa".format(tmp_dir)
+    windows = {}
+    with open(windows_file, "w") as f:
+        for record in SeqIO.parse(infile, "fasta"):
+            if record.description not in regions:
+                continue
+            merged = []
+            for start, end in sorted(regions.pop(record.description)):
+                start, end = max(start, 1), min(end, len(record.seq))
+                if merged and start <= merged[-1][1] + 1:
+                    merged[-1][1] = max(merged[-1][1], end)
+                else:
+                    merged.append([start, end])
+            for start, end in merged:
+                name = "window_{}".format(len(windows) + 1)
+                windows[name] = (record.description, start - 1)
+                f.write(">{}\n{}\n".format(name, record.seq[start - 1:end]))
+    # Contig names that don't match the FASTA headers.
+    if regions:
+        return None
+    return windows_file, windows
+
+def remap_window_hits(method_obj, windows):
+    """Give the hits of a search of the windows the names and positions of
+    the contigs of the genome.
+    """
+    hits = method_obj.results["schemes"]
+    if hits == "No hit found":
+        return
+    aligns = [method_obj.gene_align_query["schemes"],
+              method_obj.gene_align_homo["schemes"],
+              method_obj.gene_align_sbjct["schemes"]]
+    for hit_id in list(hits):
+        hit = hits.pop(hit_id)
+        contig, offset = windows[hit["contig_name"]]
+        old_prefix = "{}:{}..{}:".format(
+            hit["contig_name"], hit["query_start"], hit["query_end"])
+        hit["contig_name"] = contig
+        hit["query_start"] += offset
+        hit["query_end"] += offset
+        new_id = hit_id.replace(old_prefix, "{}:{}..{}:".format(
+            contig, hit["query_start"], hit["query_end"]), 1)
+        hit["hit_id"] = new_id
+        hits[new_id] = hit
+        for align in aligns:
+            if hit_id in align:
+                align[new_id] = align.pop(hit_id)
+
+# -- Modified by IMG ----------------------------------------------------------
+# Allele calling and extended output of one scheme, taken out of mlstyper so
+# that they can be run for every scheme of a search.
+# -----------------------------------------------------------------------------
+ALLELE_NAME_REGEX = re.compile(r"(\w+)[_|-](\d+$)")
+
+class AlleleHit(Mapping):
+    """Allele chosen for a locus.
+
+    It reads like the dict used before, but only the fields needed for typing
+    are stored. The alignment strings and the CIGAR are taken from the BLAST
+    (or KMA) hit when they are asked for, so the many hits that lose are
+    never copied.
+    """
+    __slots__ = ("score", "allele", "coverage", "identity", "match_priority",
+                 "align_len", "gaps", "sbj_len", "allele_name", "hit_name",
+                 "alternative_hit", "novel_allele", "_locus_hit",
+                 "_sbjct_align", "_query_align", "_cigar")
+    _fields = __slots__[:12]
+
+    def __init__(self, locus_hit, sbjct_align, query_align, score, allele,
+                 coverage, identity, match_priority, allele_name, hit_name):
+        self.score = score
+        self.allele = allele
+        self.coverage = coverage
+        self.identity = identity
+        self.match_priority = match_priority
+        self.align_len = locus_hit["HSP_length"]
+        self.gaps = int(locus_hit["gaps"])
+        self.sbj_len = int(locus_hit["sbjct_length"])
+        self.allele_name = allele_name
+        self.hit_name = hit_name
+        # Other perfect hits of the locus; only perfect hits get them.
+        self.alternative_hit = {}
+        # Provisional number of a novel allele (see mlst_novel).
+        self.novel_allele = None
+        self._locus_hit = locus_hit
+        self._sbjct_align = sbjct_align
+        self._query_align = query_align
+        self._cigar = None
+
+    def __getitem__(self, key):
+        if key not in self._fields:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self._fields:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __iter__(self):
+        return iter(self._fields)
+
+    def __len__(self):
+        return len(self._fields)
+
+    @property
+    def sbjct_seq(self):
+        return self._locus_hit["sbjct_string"]
+
+    @property
+    def query_seq(self):
+        return self._locus_hit["query_string"]
+
+    @property
+    def homol_seq(self):
+        return self._locus_hit["homo_string"]
+
+    @property
+    def cigar(self):
+        if self._cigar is None:
+            self._cigar = extended_cigar(self._sbjct_align, self._query_align)
+        return self._cigar
+
+def select_alleles(species, results, query_aligns, sbjct_aligns, file_format,
+                   min_depth):
+    """Choose the allele of each locus from the hits of species.
+
+    Perfect hits are preferred, then hits with full coverage, then hits
+    with full identity and then the hit with the best score. Loci without
+    hits are left out.
+    """
+    allele_matches = {}
+
+    # Get the found allele profile contained in the results dict
+    for hit, locus_hit in results[species].items():
+
+        # Check for required depth
+        if file_format == "fastq" and min_depth > float(locus_hit["depth"]):
+            continue
+
+        # Get allele number for locus
+        allele_name = locus_hit["sbjct_header"]
+        allele_obj  = ALLELE_NAME_REGEX.search(allele_name)
+
+        # Get variable to later storage in the results dict
+        locus     = allele_obj.group(1)
+        allele    = allele_obj.group(2)
+        coverage  = float(locus_hit["perc_coverage"])
+        identity  = float(locus_hit["perc_ident"])
+        score     = float(locus_hit["cal_score"])
+
+        # Priority and score of the allele stored so far for the locus
+        best = allele_matches.get(locus)
+        if best is None:
+            best_priority, best_score = 4, 0
+        else:
+            best_priority, best_score = best.match_priority, best.score
+
+        # Check for perfect hits
+        if coverage == 100 and identity == 100:
+            # If a perfect hit was already found the list more_perfect hits will exist this new hit is appended to this list
+            if best is not None and best_priority == 1:
+                best.alternative_hit[allele_name] = {"allele":allele+"!", "align_len":locus_hit["HSP_length"],
+                                                     "sbj_len":int(locus_hit["sbjct_length"]), "coverage":coverage,
+                                                     "identity":identity, "hit_name":hit}
+                if best.allele[-1] != "!":
+                    best.allele += "!"
+                continue
+            # Overwrite alleles already saved, save the perfect match
+            mark, priority = "", 1
+        # We weight full coverage higher than perfect identity match
+        elif coverage == 100 and identity != 100:
+            # Check that better (higher prioritized) 100% coverage hit has not been stored yet
+            if not (best_priority > 2 or (best_priority == 2 and score > best_score)):
+                continue
+            mark, priority = "*", 2
+        elif coverage != 100 and identity == 100:
+            # Check that higher prioritized hit was not already stored
+            if not (best_priority > 3 or (best_priority == 3 and score > best_score)):
+                continue
+            mark, priority = "?", 3
+        else: # coverage != 100 and identity != 100:
+            if not (best_priority == 4 and score > best_score):
+                continue
+            mark, priority = "?*", 4
+        allele_matches[locus] = AlleleHit(locus_hit, sbjct_aligns[species][hit], query_aligns[species][hit],
+                                          score, allele + mark, coverage, identity, priority, allele_name, hit)
+    return allele_matches
+
+def name_novel_alleles(registry, species, allele_matches):
+    """Give the novel alleles (marked with `*`) their provisional number.
+
+    The sequence found in the genome is looked up in the registry; alleles
+    seen before get the number they already have, new ones are registered
+    with the nearest known allele.
+    """
+    for locus, allele_hit in allele_matches.items():
+        if allele_hit.match_priority != 2:
+            continue
+        allele_hit.novel_allele = registry.resolve(
+            species, locus, allele_hit.query_seq, allele_hit.allele_name,
+            allele_hit.identity
+        )
+
+def write_extended_output(outdir, prefix, service, species, organism, st,
+                          nearest_sts, note, allele_matches, query_aligns,
+                          homol_aligns, sbjct_aligns):
+    """Write the alignment files, hits and allele profile table of species.
+
+    The names of the files start with prefix.
+    """
+    # Define extented output
+    table_filename  = "{}/{}results_tab.tsv".format(outdir, prefix)
+    query_filename  = "{}/{}Hit_in_genome_seq.fsa".format(outdir, prefix)
+    sbjct_filename  = "{}/{}MLST_allele_seq.fsa".format(outdir, prefix)
+    result_filename = "{}/{}results.txt".format(outdir, prefix)
+    table_file  = open(table_filename, "w")
+    query_file  = open(query_filename, "w")
+    sbjct_file  = open(sbjct_filename, "w")
+    result_file = open(result_filename, "w")
+
+    # Make results file
+    result_file.write("{0} Results\n\n{0} Profile: {1}\n\n".format(service, species))
+    result_file.write("Organism: {}\n\nSequence Type: {}\n".format(organism, st))
+    # If ST is unknown report nearest ST
+    if st == "Unknown" and nearest_sts != "":
+        if len(nearest_sts.split(",")) == 1:
+            result_file.write("Nearest ST: {}\n".format(nearest_sts))
+        else:
+            result_file.write("Nearest STs: {}\n".format(nearest_sts))
+
+    # Write tsv table header
+    table_header = ["Locus", "Identity", "Coverage", "Alignment Length", "Allele Length", "Gaps", "Allele"]
+    table_file.write("\t".join(table_header) + "\n")
+    rows = []
+    for locus, allele_info in allele_matches.items():
+
+        identity = str(allele_info["identity"])
+        coverage = str(allele_info["coverage"])
+        allele = allele_info["allele"]
+        allele_name = allele_info["allele_name"]
+        align_len = str(allele_info["align_len"])
+        sbj_len = str(allele_info["sbj_len"])
+        gaps = str(allele_info["gaps"])
+
+
+        # Write alleles names with indications of imperfect hits
+        if allele_name != "No hit found":
+            allele_name_w_mark = locus + "_" + allele
+        else:
+            allele_name_w_mark = allele_name
+
+        # Write allele results to tsv table
+        row = [locus, identity, coverage, align_len, sbj_len, gaps, allele_name_w_mark]
+        rows.append(row)
+        if "alternative_hit" in allele_info:
+            for allele_name, dic in allele_info["alternative_hit"].items():
+                row = [locus, identity, coverage, str(dic["align_len"]), str(dic["sbj_len"]), "0", allele_name + "!"]
+                rows.append(row)
+        #
+
+        if allele_name == "No hit found":
+            continue
+
+        # Write query fasta output
+        hit_name = allele_info["hit_name"]
+        query_seq = query_aligns[species][hit_name]
+        sbjct_seq = sbjct_aligns[species][hit_name]
+        homol_seq = homol_aligns[species][hit_name]
+
+        if allele_info["match_priority"] == 1:
+            match = "PERFECT MATCH"
+        else:
+            match = "WARNING"
+        header = ">{}:{} ID:{}% COV:{}% Best_match:{}\n".format(locus, match, allele_info["identity"],
+                                                allele_info["coverage"], allele_info["allele_name"])
+        query_file.write(header)
+        for i in range(0,len(query_seq),60):
+            query_file.write(query_seq[i:i+60] + "\n")
+
+        # Write template fasta output
+        header = ">{}\n".format(allele_info["allele_name"])
+        sbjct_file.write(header)
+        for i in range(0,len(sbjct_seq),60):
+            sbjct_file.write(sbjct_seq[i:i+60] + "\n")
+
+        if "alternative_hit" in allele_info:
+            for allele_name in allele_info["alternative_hit"]:
+                header = ">{}:{} ID:{}% COV:{}% Best_match:{}\n".format(locus, "PERFECT MATCH", 100,
+                                                                        100, allele_name)
+                hit_name = allele_info["alternative_hit"][allele_name]["hit_name"]
+                query_seq = query_aligns[species][hit_name]
+                sbjct_seq = sbjct_aligns[species][hit_name]
+                homol_seq = homol_aligns[species][hit_name]
+                query_file.write(header)
+                for i in range(0,len(query_seq),60):
+                    query_file.write(query_seq[i:i+60] + "\n")
+
+                # Write template fasta output
+                header = ">{}\n".format(allele_name)
+                sbjct_file.write(header)
+                for i in range(0,len(sbjct_seq),60):
+                    sbjct_file.write(sbjct_seq[i:i+60] + "\n")
+
+
+    # Write Allele profile results tables in results file and table file
+    rows.sort(key=lambda x: x[0])
+    result_file.write(text_table(table_header, rows))
+    for row in rows:
+        table_file.write("\t".join(row) + "\n")
+    # Write any notes
+    if note != "":
+        result_file.write("\nNotes: {}\n\n".format(note))
+
+    # Write allignment output
+    result_file.write("\n\nExtended Output:\n\n")
+    make_aln(species, result_file, allele_matches, query_aligns, homol_aligns, sbjct_aligns)
+
+    # Close all files
+    query_file.close()
+    sbjct_file.close()
+    table_file.close()
+    result_file.close()
+
 # -- Modified by IMG ----------------------------------------------------------
 # Modified by Ivan Munoz Gutierrez
 # The rest of the script is encapsulated in a function called mlstyper.
 # -----------------------------------------------------------------------------
-def mlstyper(input_mlstyper: InputMlstyper) -> None:
+def mlstyper(input_mlstyper: InputMlstyper) -> dict:
+    """Perform mlst and return the data also saved in data.json.
+
+    If `input_mlstyper.quiet` is set, what is printed by the calling thread
+    is dropped. Other threads keep printing, so several genomes can be
+    typed at the same time in threads of one process (IMG)
+    """
+    if input_mlstyper.quiet:
+        with quiet_stdout():
+            return run_mlstyper(input_mlstyper)
+    return run_mlstyper(input_mlstyper)
+
+def run_mlstyper(input_mlstyper: InputMlstyper) -> dict:
     """Main fuction to perform mlst.
 
+    `input_mlstyper.species` can hold several schemes separated by commas,
+    e.g. `ecoli,ecoli_2`. The alleles of all of them are then searched with a
+    single blastn run and the results are reported per scheme.
+
     parameters
     ----------
     input_mlstyper : InputMlstyper object
         Class to store input for msltyper
-    """
-    if input_mlstyper.quiet:
-        f = open('/dev/null', 'w')
-        sys.stdout = f
 
+    raises
+    ------
+    MlstError
+        If the input is not valid or BLAST/KMA fails (IMG)
+    """
     #TODO what are the clonal complex data used for??
 
     # TODO error handling
@@ -446,7 +1119,7 @@ def mlstyper(input_mlstyper: InputMlstyper) -> None:
 
     # Check that outdir is an existing dir...
     outdir = os.path.abspath(input_mlstyper.outdir_mlstyper) # <- IMG
-    species = input_mlstyper.species # <- IMG
+    schemes = input_mlstyper.species.split(",") # <- IMG
     database = os.path.abspath(input_mlstyper.database) # <- IMG
     #creating unique tmp_dir
     tmp_dir = tempfile.mkdtemp(prefix='tmp_', dir=input_mlstyper.tmp_dir) # <- IMG
@@ -460,34 +1133,45 @@ def mlstyper(input_mlstyper: InputMlstyper) -> None:
     # Check file format (fasta, fastq or other format)
     file_format = get_file_format(infile)
 
-    db_path = "{}/{}/".format(database, species)
-
     config_file = open(database + "/config","r")
 
     if (input_mlstyper.kma_matrix): # <- IMG
         extra_args = "-matrix"
     else:
         extra_args = None
+    # Use the index loaded in shared memory by the runner (IMG)
+    if input_mlstyper.kma_shm:
+        extra_args = " ".join(filter(None, [extra_args, "-shm 1"]))
 
     # Get loci list from config file
     species_list = []
+    organisms = {} # <- IMG
+    loci_lists = {} # <- IMG
     for line in config_file:
         if line.startswith("#"):
             continue
         line = line.split("\t")
         species_list.append(line[0])
-        if line[0] == species:
-            organism = line[1]
-            loci_list = line[2].strip().split(",")
-    if species not in species_list:
-        sys.exit("{}, is not a valid species. \n\nPlease choose a species available in the database:\n{}".format(species, ", ".join(species_list)))
+        if line[0] in schemes: # <- IMG
+            organisms[line[0]] = line[1]
+            loci_lists[line[0]] = line[2].strip().split(",")
+    config_file.close()
+    for species in schemes: # <- IMG
+        if species not in species_list:
+            raise MlstError("{}, is not a valid species. \n\nPlease choose a species available in the database:\n{}".format(species, ", ".join(species_list))) # <- IMG
+
+    # Results and alignments of every scheme (IMG)
+    results = {}
+    query_aligns = {}
+    homol_aligns = {}
+    sbjct_aligns = {}
 
     # Call appropriate method (kma or blastn) based on file format
     if file_format == "fastq":
         if not method_path:
             method_path = "kma"
             if shutil.which(method_path) == None:
-                sys.exit("No valid path to a kma program was provided. Use the -mp flag to provide the path.")
+                raise MlstError("No valid path to a kma program was provided. Use the -mp flag to provide the path.") # <- IMG
         # Check the number of files
         if len(infile) == 1:
             infile_1 = infile[0]
@@ -496,162 +1180,148 @@ def mlstyper(input_mlstyper: InputMlstyper) -> None:
             infile_1 = infile[0]
             infile_2 = infile[1]
         else:
-            sys.exit("Only 2 input file accepted for raw read data,\
+            raise MlstError("Only 2 input file accepted for raw read data,\
                     if data from more runs is avaliable for the same\
                     sample, please concatinate the reads into two files")
 
         sample_name = get_read_filename(infile)
         method = "kma"
 
-        # Call KMA
-        method_obj = CGEFinder.kma(infile_1, outdir, [species], db_path, min_cov=min_cov,
-                                    threshold=threshold, kma_path=method_path, sample_name=sample_name,
-                                    inputfile_2=infile_2, kma_mrs=0.75, kma_gapopen=-5,
-                                    kma_gapextend=-1, kma_penalty=-3, kma_reward=1,
-                                    kma_add_args=extra_args)
+        # Call KMA. Every scheme has its own index (IMG)
+        for species in schemes:
+            db_path = "{}/{}/".format(database, species)
+            # The index may be in the cache of mlst_reads (IMG)
+            if input_mlstyper.kma_dirs and species in input_mlstyper.kma_dirs:
+                db_path = "{}/".format(input_mlstyper.kma_dirs[species])
+            # KMA writes in the folder of this call, not in outdir, which
+            # other calls may share (IMG)
+            method_obj = CGEFinder.kma(infile_1, tmp_dir, [species], db_path, min_cov=min_cov,
+                                        threshold=threshold, kma_path=method_path, sample_name=sample_name,
+                                        inputfile_2=infile_2, kma_mrs=0.75, kma_gapopen=-5,
+                                        kma_gapextend=-1, kma_penalty=-3, kma_reward=1,
+                                        kma_add_args=extra_args)
+            results[species] = method_obj.results[species]
+            query_aligns[species] = method_obj.gene_align_query.get(species, {})
+            homol_aligns[species] = method_obj.gene_align_homo.get(species, {})
+            sbjct_aligns[species] = method_obj.gene_align_sbjct.get(species, {})
 
     elif file_format == "fasta":
         if not method_path:
             method_path = "blastn"
             if shutil.which(method_path) == None:
-                sys.exit("No valid path to a blastn program was provided. Use the -mp flag to provide the path.")
+                raise MlstError("No valid path to a blastn program was provided. Use the -mp flag to provide the path.") # <- IMG
         # Assert that only one fasta file is inputted
         assert len(infile) == 1, "Only one input file accepted for assembled data"
         infile = infile[0]
         method = "blast"
 
-        # Call BLASTn
-        method_obj = Blaster(infile, [species], db_path, tmp_dir,
-                            min_cov, threshold, method_path, cut_off=False)
+        # Search only the windows around the loci, if asked and if all the
+        # loci were located (IMG)
+        search_file, windows = infile, None
+        if input_mlstyper.two_stage:
+            located = write_locus_windows(infile, schemes, loci_lists,
+                                          database, tmp_dir, method_path)
+            if located is not None:
+                search_file, windows = located
+
+        # Call BLASTn. The prebuilt BLAST databases are used if all the
+        # schemes have one; otherwise the alleles are given as a subject
+        # file, which also works for schemes without `<scheme>.fsa` (IMG)
+        if all(has_blast_database(database, species) for species in schemes):
+            method_obj = DbBlaster(search_file, schemes, database, tmp_dir,
+                                   min_cov, threshold, method_path)
+        else:
+            make_schemes_subject(database, schemes, tmp_dir, "schemes")
+            method_obj = SchemesBlaster(search_file, ["schemes"], tmp_dir, tmp_dir,
+                                        min_cov, threshold, method_path, cut_off=False)
+        if windows is not None: # <- IMG
+            remap_window_hits(method_obj, windows)
+        results = split_scheme_hits(method_obj.results["schemes"], schemes)
+        for species in schemes:
+            query_aligns[species] = method_obj.gene_align_query["schemes"]
+            homol_aligns[species] = method_obj.gene_align_homo["schemes"]
+            sbjct_aligns[species] = method_obj.gene_align_sbjct["schemes"]
     else:
-        sys.exit("Input file must be fastq or fasta format, not " + file_format)
+        raise MlstError("Input file must be fastq or fasta format, not " + file_format) # <- IMG
 
     if not input_mlstyper.save_tmp: # <- IMG
         shutil.rmtree(tmp_dir)
 
-    results      = method_obj.results
-    query_aligns = method_obj.gene_align_query
-    homol_aligns = method_obj.gene_align_homo
-    sbjct_aligns = method_obj.gene_align_sbjct
-
-    # Check that the results dict is not empty
-    warning = ""
-    if results[species] == "No hit found":
-        results[species] = {}
-        warning = ("No MLST loci was found in the input data, "
-                "make sure that the correct MLST scheme was chosen.")
-
-
-    allele_matches = {}
-
-    # Get the found allele profile contained in the results dict
-    for hit, locus_hit in results[species].items():
-
-        # Get allele number for locus
-        allele_name = locus_hit["sbjct_header"]
-        allele_obj  = re.search("(\w+)[_|-](\d+$)", allele_name)
-
-        # Get variable to later storage in the results dict
-        locus     = allele_obj.group(1)
-        allele    = allele_obj.group(2)
-        coverage  = float(locus_hit["perc_coverage"])
-        identity  = float(locus_hit["perc_ident"])
-        score     = float(locus_hit["cal_score"])
-        gaps      = int(locus_hit["gaps"])
-        align_len = locus_hit["HSP_length"]
-        sbj_len   = int(locus_hit["sbjct_length"])
-        sbjct_seq = locus_hit["sbjct_string"]
-        query_seq = locus_hit["query_string"]
-        homol_seq = locus_hit["homo_string"]
-        cigar     = extended_cigar(sbjct_aligns[species][hit], query_aligns[species][hit])
-
-        if file_format == "fastq":
-            depth = float(locus_hit["depth"])
-        else:
-            depth = input_mlstyper.depth # <- IMG
-
-        # Check for required depth
-        if input_mlstyper.depth > depth: # <- IMG
-            continue
-
-        # Check for perfect hits
-        if coverage == 100 and identity == 100:
-            # If a perfect hit was already found the list more_perfect hits will exist this new hit is appended to this list
-            try:
-                allele_matches[locus]["alternative_hit"][allele_name] = {"allele":allele+"!", "align_len":align_len, "sbj_len":sbj_len,
-                                                                    "coverage":coverage, "identity":identity, "hit_name":hit}
-                if allele_matches[locus]["allele"][-1] != "!":
-                    allele_matches[locus]["allele"] += "!"
-            except KeyError:
-                # Overwrite alleles already saved, save the perfect match and break to go to next locus
-                allele_matches[locus] = {"score":score, "allele":allele, "coverage":coverage,
-                                        "identity":identity, "match_priority": 1, "align_len":align_len,
-                                        "gaps":gaps, "sbj_len":sbj_len, "allele_name":allele_name,
-                                        "sbjct_seq":sbjct_seq, "query_seq":query_seq, "homol_seq":homol_seq,
-                                        "hit_name":hit, "cigar":cigar, "alternative_hit":{}}
-        else:
-            # If no hit has yet been stored initialize dict variables that are looked up below
-            if locus not in allele_matches:
-                allele_matches[locus] = {"score":0, "match_priority": 4}
-
-            # We weight full coverage higher than perfect identity match
-            if coverage == 100 and identity != 100:
-                # Check that better (higher prioritized) 100% coverage hit has not been stored yet
-                if allele_matches[locus]["match_priority"] > 2 or (allele_matches[locus]["match_priority"] == 2 and score > allele_matches[locus]["score"]):
-                    allele_matches[locus] = {"score":score, "allele":allele+"*", "coverage":coverage,
-                                            "identity":identity, "match_priority": 2, "align_len":align_len,
-                                            "gaps":gaps, "sbj_len":sbj_len, "allele_name":allele_name,
-                                            "sbjct_seq":sbjct_seq, "query_seq":query_seq, "homol_seq":homol_seq,
-                                            "hit_name":hit, "cigar":cigar}
-            elif coverage != 100 and identity == 100:
-                # Check that higher prioritized hit was not already stored
-                if allele_matches[locus]["match_priority"] > 3 or (allele_matches[locus]["match_priority"] == 3 and score > allele_matches[locus]["score"]):
-                    allele_matches[locus] = {"score":score, "allele":allele + "?", "coverage":coverage,
-                                            "identity":identity, "match_priority": 3, "align_len":align_len,
-                                            "gaps":gaps, "sbj_len":sbj_len, "allele_name":allele_name,
-                                            "sbjct_seq":sbjct_seq, "query_seq":query_seq, "homol_seq":homol_seq,
-                                            "hit_name":hit, "cigar":cigar}
-            else: # coverage != 100 and identity != 100:
-                if allele_matches[locus]["match_priority"] == 4 and score > allele_matches[locus]["score"]:
-                    allele_matches[locus] = {"score":score, "allele":allele + "?*", "coverage":coverage,
-                                            "identity":identity, "match_priority": 4, "align_len":align_len,
-                                            "gaps":gaps, "sbj_len":sbj_len, "allele_name":allele_name,
-                                            "sbjct_seq":sbjct_seq, "query_seq":query_seq, "homol_seq":homol_seq,
-                                            "hit_name":hit, "cigar":cigar}
-    for locus in loci_list:
-        if locus not in allele_matches:
-            allele_matches[locus] = {"identity":"", "coverage":"", "allele":"", "allele_name":"No hit found", "align_len":"", "gaps":"", "sbj_len":""}
-
-    # Import all possible st profiles into dict
-    st_profiles = import_profile(database, species, loci_list)
-
-    # Find st or neatest sts
-    st, note, nearest_sts = st_typing(st_profiles, allele_matches, loci_list)
-
-    # Give warning of mlst schene if no loci were found
-    if note == "" and warning != "":
-        note = warning
-
     # Get run info for JSON file
     service = os.path.basename(__file__).replace(".py", "")
     date = time.strftime("%d.%m.%Y")
     time_ = time.strftime("%H:%M:%S") # changed the name of variable time to time_ to avoid shadowing - Ivan Munoz Gutierrez
 
-    # TODO find a system to show the database and service version using git
+    # Novel alleles are named from the registry, if one is used (IMG)
+    registry = None
+    if input_mlstyper.novel_registry:
+        registry = NovelAlleleRegistry(input_mlstyper.novel_registry)
+
+    # Type every scheme with its own hits (IMG)
+    schemes_results = {}
+    for species in schemes:
+        loci_list = loci_lists[species]
+
+        # Check that the results dict is not empty
+        warning = ""
+        if results[species] == "No hit found":
+            results[species] = {}
+            warning = ("No MLST loci was found in the input data, "
+                    "make sure that the correct MLST scheme was chosen.")
+
+        allele_matches = select_alleles(species, results, query_aligns, sbjct_aligns,
+                                        file_format, input_mlstyper.depth) # <- IMG
+        if registry is not None: # <- IMG
+            name_novel_alleles(registry, species, allele_matches)
+        for locus in loci_list:
+            if locus not in allele_matches:
+                allele_matches[locus] = {"identity":"", "coverage":"", "allele":"", "allele_name":"No hit found", "align_len":"", "gaps":"", "sbj_len":""}
+
+        # Import all possible st profiles into dict
+        st_profiles = load_profile(database, species, loci_list) # <- IMG
+
+        # Find st or neatest sts
+        st, note, nearest_sts = st_typing(st_profiles, allele_matches, loci_list)
+
+        # Give warning of mlst schene if no loci were found
+        if note == "" and warning != "":
+            note = warning
+
+        # TODO find a system to show the database and service version using git
+
+        # Make JSON output file
+        allele_results = {}
+        for locus, locus_info in allele_matches.items():
+            allele_results[locus] = {"identity":0, "coverage":0, "allele":[], "allele_name":[], "align_len":[], "gaps":0, "sbj_len":[]}
+            for (key, value) in locus_info.items():
+                if key in allele_results[locus] or (key == "alternative_hit" and value != {}) \
+                        or (key == "novel_allele" and value is not None): # <- IMG
+                    allele_results[locus][key] = value
+
+        schemes_results[species] = {"sequence_type":st, "allele_profile": allele_results,
+                                    "nearest_sts":nearest_sts, "notes":note}
+
+        if extented_output:
+            # Files of each scheme are prefixed with its name (IMG)
+            prefix = "" if len(schemes) == 1 else species + "_"
+            write_extended_output(outdir, prefix, service, species, organisms[species], st,
+                                  nearest_sts, note, allele_matches, query_aligns,
+                                  homol_aligns, sbjct_aligns)
+
+    if registry is not None: # <- IMG
+        registry.close()
+
+    # A single scheme keeps the original layout of the results (IMG)
+    if len(schemes) == 1:
+        organism = organisms[schemes[0]]
+        server_results = schemes_results[schemes[0]]
+    else:
+        organism = [organisms[species] for species in schemes]
+        server_results = schemes_results
 
-    # Make JSON output file
     data = {service:{}}
-    allele_results = {}
-    for locus, locus_info in allele_matches.items():
-        allele_results[locus] = {"identity":0, "coverage":0, "allele":[], "allele_name":[], "align_len":[], "gaps":0, "sbj_len":[]}
-        for (key, value) in locus_info.items():
-            if key in allele_results[locus] or (key == "alternative_hit" and value != {}):
-                allele_results[locus][key] = value
-
     userinput = {"filename":input_mlstyper.infile, "species":input_mlstyper.species, "organism":organism,"file_format":file_format} # <- IMG
     run_info = {"date":date, "time":time_}#, "database":{"remote_db":remote_db, "last_commit_hash":head_hash}}
-    server_results = {"sequence_type":st, "allele_profile": allele_results,
-                                "nearest_sts":nearest_sts, "notes":note}
 
     data[service]["user_input"] = userinput
     data[service]["run_info"] = run_info
@@ -664,124 +1334,7 @@ def mlstyper(input_mlstyper: InputMlstyper) -> None:
     with open(result_file, "w") as outfile:
         json.dump(data, outfile)
 
-    if extented_output:
-        # Define extented output
-        table_filename  = "{}/results_tab.tsv".format(outdir)
-        query_filename  = "{}/Hit_in_genome_seq.fsa".format(outdir)
-        sbjct_filename  = "{}/MLST_allele_seq.fsa".format(outdir)
-        result_filename = "{}/results.txt".format(outdir)
-        table_file  = open(table_filename, "w")
-        query_file  = open(query_filename, "w")
-        sbjct_file  = open(sbjct_filename, "w")
-        result_file = open(result_filename, "w")
-
-        # Make results file
-        result_file.write("{0} Results\n\n{0} Profile: {1}\n\n".format(service, species))
-        result_file.write("Organism: {}\n\nSequence Type: {}\n".format(organism, st))
-        # If ST is unknown report nearest ST
-        if st == "Unknown" and nearest_sts != "":
-            if len(nearest_sts.split(",")) == 1:
-                result_file.write("Nearest ST: {}\n".format(nearest_sts))
-            else:
-                result_file.write("Nearest STs: {}\n".format(nearest_sts))
-
-        # Write tsv table header
-        table_header = ["Locus", "Identity", "Coverage", "Alignment Length", "Allele Length", "Gaps", "Allele"]
-        table_file.write("\t".join(table_header) + "\n")
-        rows = []
-        for locus, allele_info in allele_matches.items():
-
-            identity = str(allele_info["identity"])
-            coverage = str(allele_info["coverage"])
-            allele = allele_info["allele"]
-            allele_name = allele_info["allele_name"]
-            align_len = str(allele_info["align_len"])
-            sbj_len = str(allele_info["sbj_len"])
-            gaps = str(allele_info["gaps"])
-
-
-            # Write alleles names with indications of imperfect hits
-            if allele_name != "No hit found":
-                allele_name_w_mark = locus + "_" + allele
-            else:
-                allele_name_w_mark = allele_name
-
-            # Write allele results to tsv table
-            row = [locus, identity, coverage, align_len, sbj_len, gaps, allele_name_w_mark]
-            rows.append(row)
-            if "alternative_hit" in allele_info:
-                for allele_name, dic in allele_info["alternative_hit"].items():
-                    row = [locus, identity, coverage, str(dic["align_len"]), str(dic["sbj_len"]), "0", allele_name + "!"]
-                    rows.append(row)
-            #
-
-            if allele_name == "No hit found":
-                continue
-
-            # Write query fasta output
-            hit_name = allele_info["hit_name"]
-            query_seq = query_aligns[species][hit_name]
-            sbjct_seq = sbjct_aligns[species][hit_name]
-            homol_seq = homol_aligns[species][hit_name]
-
-            if allele_info["match_priority"] == 1:
-                match = "PERFECT MATCH"
-            else:
-                match = "WARNING"
-            header = ">{}:{} ID:{}% COV:{}% Best_match:{}\n".format(locus, match, allele_info["identity"],
-                                                    allele_info["coverage"], allele_info["allele_name"])
-            query_file.write(header)
-            for i in range(0,len(query_seq),60):
-                query_file.write(query_seq[i:i+60] + "\n")
-
-            # Write template fasta output
-            header = ">{}\n".format(allele_info["allele_name"])
-            sbjct_file.write(header)
-            for i in range(0,len(sbjct_seq),60):
-                sbjct_file.write(sbjct_seq[i:i+60] + "\n")
-
-            if "alternative_hit" in allele_info:
-                for allele_name in allele_info["alternative_hit"]:
-                    header = ">{}:{} ID:{}% COV:{}% Best_match:{}\n".format(locus, "PERFECT MATCH", 100,
-                                                                            100, allele_name)
-                    hit_name = allele_info["alternative_hit"][allele_name]["hit_name"]
-                    query_seq = query_aligns[species][hit_name]
-                    sbjct_seq = sbjct_aligns[species][hit_name]
-                    homol_seq = homol_aligns[species][hit_name]
-                    query_file.write(header)
-                    for i in range(0,len(query_seq),60):
-                        query_file.write(query_seq[i:i+60] + "\n")
-
-                    # Write template fasta output
-                    header = ">{}\n".format(allele_name)
-                    sbjct_file.write(header)
-                    for i in range(0,len(sbjct_seq),60):
-                        sbjct_file.write(sbjct_seq[i:i+60] + "\n")
-
-
-        # Write Allele profile results tables in results file and table file
-        rows.sort(key=lambda x: x[0])
-        result_file.write(text_table(table_header, rows))
-        for row in rows:
-            table_file.write("\t".join(row) + "\n")
-        # Write any notes
-        if note != "":
-            result_file.write("\nNotes: {}\n\n".format(note))
-
-        # Write allignment output
-        result_file.write("\n\nExtended Output:\n\n")
-        make_aln(species, result_file, allele_matches, query_aligns, homol_aligns, sbjct_aligns)
-
-        # Close all files
-        query_file.close()
-        sbjct_file.close()
-        table_file.close()
-        result_file.close()
-
-    if input_mlstyper.quiet: # <- IMG
-        f.close()
-        # redirect stdout to sys.__stdout__
-        sys.stdout = sys.__stdout__
+    return data # <- IMG
 
 # -- Modified by IMG ----------------------------------------------------------
 # Main function.
@@ -0,0 +1,292 @@
+"""Cluster typed genomes by the allele distance of their profiles.
+
+The input is a profile file written by `mlst run --profiles`. The distance
+between two genomes is the number of loci with different alleles (Hamming
+distance); loci without a trusted allele in either genome are not counted.
+Alleles marked `*` or `?` are not trusted unless they have a provisional
+number from the registry of novel alleles.
+
+The genomes are joined in a minimum spanning tree with Prim's algorithm.
+The distances from each new node of the tree are computed with vector
+operations, one locus at a time, so the memory used grows with the number
+of genomes and not with its square. Cutting the edges of the tree longer
+than a threshold gives the single-linkage clusters.
+"""
+from pathlib import Path
+from typing import Iterator, Union
+import csv
+
+import numpy as np
+
+from labscripts.mlst.mlst_novel import PROVISIONAL_PREFIX
+from labscripts.mlst.mlst_profiles import ALLELE_MARKS, import_pyarrow
+
+# Genomes per block of the distance matrix.
+CHUNK_SIZE = 1000
+# Code of the loci without a trusted allele.
+MISSING = -1
+
+
+class AlleleProfiles:
+    """Class to store the allele profiles of the typed genomes.
+
+    Alleles are stored as integer codes, one column per locus, with MISSING
+    for loci without a trusted allele.
+    """
+    def __init__(
+            self,
+            ids: list[str],
+            sequence_types: list[str],
+            loci: list[str],
+            codes: np.ndarray
+    ):
+        self.ids = ids
+        self.sequence_types = sequence_types
+        self.loci = loci
+        # Column order, so that the alleles of a locus are contiguous.
+        self.codes = np.asfortranarray(codes)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+
+def read_profile_columns(infile: Path) -> dict[str, list]:
+    """Read a TSV, Parquet or Arrow profile file as lists by column."""
+    suffix = Path(infile).suffix
+    if suffix in ('.parquet', '.arrow'):
+        pa = import_pyarrow()
+        if suffix == '.parquet':
+            table = pa.parquet.read_table(infile)
+        else:
+            with pa.ipc.open_file(infile) as reader:
+                table = reader.read_all()
+        return table.to_pydict()
+    with open(infile, newline='') as f:
+        reader = csv.reader(f, delimiter='\t')
+        header = next(reader)
+        columns = list(zip(*reader)) or [[] for _ in header]
+    return {column: list(values) for column, values in zip(header, columns)}
+
+def trusted_allele(allele: Union[str, None], mark: Union[str, None]) -> str:
+    """Get the allele to compare, or '' if it can't be trusted."""
+    if not allele:
+        return ''
+    if mark and ('*' in mark or '?' in mark):
+        # The allele number is only the nearest known allele.
+        return allele if allele.startswith(PROVISIONAL_PREFIX) else ''
+    return allele
+
+def read_allele_profiles(infile: Path) -> AlleleProfiles:
+    """Read a profile file written by `mlst run --profiles`."""
+    columns = read_profile_columns(infile)
+    # Every locus has a `<locus>_mark` column.
+    loci = [
+        column[:-len('_mark')] for column in columns
+        if column.endswith('_mark') and column[:-len('_mark')] in columns
+    ]
+    if not loci:
+        raise ValueError(f'{infile} has no allele columns.')
+    ids = [str(value) for value in columns['id']]
+    codes = np.empty((len(ids), len(loci)), dtype=np.int32)
+    for i, locus in enumerate(loci):
+        alleles = [
+            trusted_allele(allele, mark)
+            for allele, mark in zip(columns[locus], columns[f'{locus}_mark'])
+        ]
+        values, inverse = np.unique(np.array(alleles), return_inverse=True)
+        codes[:, i] = inverse
+        if len(values) and values[0] == '':
+            codes[inverse == 0, i] = MISSING
+    sequence_types = [
+        str(value or '') for value in columns.get('sequence_type', [''] * len(ids))
+    ]
+    return AlleleProfiles(ids, sequence_types, loci, codes)
+
+def allele_distances(block: np.ndarray, codes: np.ndarray) -> np.ndarray:
+    """Get the distances from the genomes in block to the genomes in codes."""
+    distances = np.zeros((len(block), len(codes)), dtype=np.int32)
+    for locus in range(codes.shape[1]):
+        alleles = codes[:, locus]
+        block_alleles = block[:, locus, None]
+        distances += (
+            (block_alleles != alleles) &
+            (block_alleles != MISSING) &
+            (alleles != MISSING)
+        )
+    return distances
+
+def iter_distance_blocks(
+        codes: np.ndarray, chunk_size: int = CHUNK_SIZE
+) -> Iterator[tuple[int, np.ndarray]]:
+    """Yield the distance matrix as (first row, block of rows)."""
+    for start in range(0, len(codes), chunk_size):
+        yield start, allele_distances(codes[start:start + chunk_size], codes)
+
+def prim_edges(codes: np.ndarray) -> list[tuple[int, int, int]]:
+    """Join the genomes with Prim's algorithm.
+
+    It returns the edges (parent, child, distance) in the order they were
+    added. Ties are broken by the order of the genomes.
+    """
+    n_genomes = len(codes)
+    no_edge = np.iinfo(np.int32).max
+    valid = np.asfortranarray(codes != MISSING)
+    # Distance of every genome to the tree and the node of the tree it is
+    # closest to.
+    best = np.full(n_genomes, no_edge, dtype=np.int32)
+    parent = np.zeros(n_genomes, dtype=np.int64)
+    in_tree = np.zeros(n_genomes, dtype=bool)
+    different = np.empty(n_genomes, dtype=bool)
+    distances = np.empty(n_genomes, dtype=np.int32)
+    edges = []
+    node = 0
+    for _ in range(n_genomes - 1):
+        in_tree[node] = True
+        best[node] = no_edge
+        distances.fill(0)
+        for locus, allele in enumerate(codes[node]):
+            if allele == MISSING:
+                continue
+            np.not_equal(codes[:, locus], allele, out=different)
+            different &= valid[:, locus]
+            distances += different
+        closer = (distances < best) & ~in_tree
+        best[closer] = distances[closer]
+        parent[closer] = node
+        node = int(np.argmin(best))
+        edges.append((int(parent[node]), node, int(best[node])))
+    return edges
+
+def minimum_spanning_tree(codes: np.ndarray) -> list[tuple[int, int, int]]:
+    """Get the edges (parent, child, distance) of a minimum spanning tree.
+
+    Genomes with the same profile are common in MLST, so the tree is built
+    with one genome per profile and the others are joined to it with
+    distance 0. The tree is the same every time.
+    """
+    if len(codes) < 2:
+        return []
+    _, first, inverse = np.unique(
+        codes, axis=0, return_index=True, return_inverse=True
+    )
+    # Keep the profiles in the order of the genomes.
+    order = np.argsort(first)
+    representatives = first[order]
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    profile_of = rank[inverse.ravel()]
+    edges = [
+        (int(representatives[parent]), int(representatives[child]), distance)
+        for parent, child, distance in prim_edges(
+            np.asfortranarray(codes[representatives])
+        )
+    ]
+    for genome, profile in enumerate(profile_of):
+        if representatives[profile] != genome:
+            edges.append((int(representatives[profile]), genome, 0))
+    return edges
+
+def single_linkage_clusters(
+        n_genomes: int, edges: list[tuple[int, int, int]], threshold: int
+) -> list[int]:
+    """Cut the tree at threshold and number the clusters from 1.
+
+    Clusters are numbered by the first genome they have.
+    """
+    roots = list(range(n_genomes))
+
+    def find(node: int) -> int:
+        while roots[node] != node:
+            roots[node] = roots[roots[node]]
+            node = roots[node]
+        return node
+
+    for parent, child, distance in edges:
+        if distance <= threshold:
+            roots[find(child)] = find(parent)
+    numbers = {}
+    clusters = []
+    for node in range(n_genomes):
+        root = find(node)
+        if root not in numbers:
+            numbers[root] = len(numbers) + 1
+        clusters.append(numbers[root])
+    return clusters
+
+def read_clonal_complexes(database: Path, scheme: str) -> dict[str, str]:
+    """Get the clonal complex of every ST of scheme, if it has any."""
+    profile_file = Path(database) / scheme / f'{scheme}.tsv'
+    clonal_complexes = {}
+    with open(profile_file, newline='') as f:
+        reader = csv.reader(f, delimiter='\t')
+        header = next(reader)
+        if 'clonal_complex' not in header:
+            return {}
+        column = header.index('clonal_complex')
+        for row in reader:
+            if len(row) > column and row[column].strip():
+                clonal_complexes[row[0]] = row[column].strip()
+    return clonal_complexes
+
+def clonal_complex(
+        sequence_type: str, clonal_complexes: dict[str, str]
+) -> str:
+    """Get the clonal complex(es) of a reported sequence type.
+
+    Marks are removed, and a genome with several STs gets the clonal
+    complexes of all of them.
+    """
+    complexes = []
+    for st in sequence_type.split(','):
+        complex_ = clonal_complexes.get(st.strip().rstrip(ALLELE_MARKS))
+        if complex_ and complex_ not in complexes:
+            complexes.append(complex_)
+    return ','.join(complexes)
+
+def write_distance_matrix(
+        profiles: AlleleProfiles, outfile: Path, chunk_size: int = CHUNK_SIZE
+) -> None:
+    """Write the distance matrix as a TSV file, one block at a time."""
+    with open(outfile, 'w') as f:
+        f.write('\t'.join([''] + profiles.ids) + '\n')
+        for start, block in iter_distance_blocks(profiles.codes, chunk_size):
+            for genome_id, distances in zip(profiles.ids[start:], block):
+                f.write(genome_id + '\t' + '\t'.join(map(str, distances)))
+                f.write('\n')
+
+def cluster_profiles(
+        infile: Path,
+        outdir: Path,
+        threshold: int,
+        clonal_complexes: Union[dict[str, str], None] = None,
+        matrix: bool = False,
+        chunk_size: int = CHUNK_SIZE
+) -> int:
+    """Cluster the genomes of a profile file and save the results.
+
+    It writes `clusters.tsv` (one row per genome), `mst.tsv` (the edges of
+    the tree) and, if matrix is True, `distances.tsv`. It returns the number
+    of clusters.
+    """
+    outdir = Path(outdir)
+    profiles = read_allele_profiles(infile)
+    edges = minimum_spanning_tree(profiles.codes)
+    clusters = single_linkage_clusters(len(profiles), edges, threshold)
+    with open(outdir / 'clusters.tsv', 'w', newline='') as f:
+        writer = csv.writer(f, delimiter='\t')
+        writer.writerow(['id', 'sequence_type', 'clonal_complex', 'cluster'])
+        for genome_id, st, cluster in zip(
+            profiles.ids, profiles.sequence_types, clusters
+        ):
+            writer.writerow([
+                genome_id, st, clonal_complex(st, clonal_complexes or {}),
+                cluster
+            ])
+    with open(outdir / 'mst.tsv', 'w', newline='') as f:
+        writer = csv.writer(f, delimiter='\t')
+        writer.writerow(['source', 'target', 'distance'])
+        for parent, child, distance in edges:
+            writer.writerow([profiles.ids[parent], profiles.ids[child], distance])
+    if matrix:
+        write_distance_matrix(profiles, outdir / 'distances.tsv', chunk_size)
+    return max(clusters, default=0)
@@ -0,0 +1,442 @@
+"""Build and update the KMA and BLAST indexes of the MLST database.
+
+Every scheme of `mlst_db/config` is indexed from its allele files, i.e.
+`<scheme>/<scheme>.fsa` or the per-locus files in `alleles/<scheme>/`. The
+alleles are gathered once per scheme and both indexes are made from the same
+FASTA file. The profiles in `<scheme>/<scheme>.tsv` are parsed once and saved
+as a table that the processes of the typer map and share. A content hash of
+the inputs of every scheme is kept in `mlst_db/manifest.json`, so that only
+the schemes whose inputs changed are processed again. Schemes are processed
+concurrently.
+
+When the database is a git checkout, updates read the changed schemes from
+the git diff of the pull instead of hashing every scheme.
+"""
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import ExitStack
+from datetime import datetime, timezone
+from pathlib import Path, PurePosixPath
+from typing import Iterator, Union
+import subprocess
+import tempfile
+import hashlib
+import shutil
+import json
+import sys
+import os
+
+from labscripts.mlst.mlst_cge import (
+    SCHEME_SEPARATOR, BLAST_ALLELES_SUFFIX, BLAST_DB_SUFFIXES,
+    KMA_INDEX_SUFFIXES, scheme_allele_files, profile_cache_file,
+    write_profile_cache
+)
+
+MANIFEST_NAME = 'manifest.json'
+INDEX_SUFFIXES = {'kma': KMA_INDEX_SUFFIXES, 'blast': BLAST_DB_SUFFIXES}
+# Bump it when the content of the indexes changes, e.g. the BLAST headers;
+# it is part of the scheme hash, so every index is rebuilt.
+INDEX_LAYOUT_VERSION = 2
+INDEX_TYPES = ['kma', 'blast']
+
+
+def parse_config(lines: Iterator[str]) -> dict[str, list[str]]:
+    """Get the loci of every scheme from the lines of a config file."""
+    config = {}
+    for line in lines:
+        if line.startswith('#') or not line.strip():
+            continue
+        fields = line.rstrip('\n').split('\t')
+        loci = fields[2].strip().split(',') if len(fields) > 2 else []
+        config[fields[0].strip()] = loci
+    return config
+
+def read_config(database: Path) -> dict[str, list[str]]:
+    """Get the schemes of the config file of database and their loci."""
+    with open(Path(database) / 'config', 'r') as config:
+        return parse_config(config)
+
+def hash_scheme_files(database: Path, files: list[Path]) -> str:
+    """Get the sha256 of the names and contents of the allele files."""
+    digest = hashlib.sha256(f'{INDEX_LAYOUT_VERSION}\n'.encode())
+    for path in files:
+        name = Path(path).relative_to(database).as_posix()
+        digest.update(f'{name}\n'.encode())
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+def hash_profile_file(profile_file: Path, loci_list: list[str]) -> str:
+    """Get the sha256 of the profiles and the loci they are read with."""
+    digest = hashlib.sha256(','.join(loci_list).encode() + b'\n')
+    with open(profile_file, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def load_manifest(database: Path) -> dict:
+    """Load the manifest of database; it is empty if it doesn't exist."""
+    manifest_file = Path(database) / MANIFEST_NAME
+    if not manifest_file.exists():
+        return {}
+    try:
+        with open(manifest_file, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        # A broken manifest only means that every scheme is indexed again.
+        return {}
+
+def save_manifest(database: Path, manifest: dict) -> None:
+    """Save the manifest of database without leaving half-written files."""
+    manifest_file = Path(database) / MANIFEST_NAME
+    tmp_file = manifest_file.with_suffix(f'.{os.getpid()}.tmp')
+    with open(tmp_file, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+        f.write('\n')
+    os.replace(tmp_file, manifest_file)
+
+def index_files_exist(database: Path, scheme: str, index_type: str) -> bool:
+    """Check that all the files of an index of scheme exist."""
+    prefix = Path(database) / scheme / scheme
+    return all(
+        prefix.with_name(scheme + suffix).exists()
+        for suffix in INDEX_SUFFIXES[index_type]
+    )
+
+def is_scheme_up_to_date(
+        database: Path,
+        scheme: str,
+        scheme_hash: str,
+        indexes: list[str],
+        entry: dict
+) -> bool:
+    """Check if the indexes of scheme were built from the current alleles.
+
+    entry is the record of scheme in the manifest.
+    """
+    if entry.get('hash') != scheme_hash:
+        return False
+    return all(
+        index_type in entry.get('indexes', []) and
+        index_files_exist(database, scheme, index_type)
+        for index_type in indexes
+    )
+
+def write_scheme_fastas(
+        scheme: str, files: list[Path], outfiles: dict[str, Path]
+) -> None:
+    """Write the alleles of scheme for every index in one pass over files.
+
+    outfiles has the FASTA file of every index type. KMA gets the alleles as
+    they are. The BLAST headers are prefixed with the scheme name and
+    SCHEME_SEPARATOR, as the typer splits the hits of `-db` searches by
+    scheme.
+    """
+    blast_prefix = f'>{scheme}{SCHEME_SEPARATOR}'.encode()
+    with ExitStack() as stack:
+        outs = {
+            index_type: stack.enter_context(open(path, 'wb'))
+            for index_type, path in outfiles.items()
+        }
+        for path in files:
+            with open(path, 'rb') as f:
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        line += b'\n'
+                    if 'kma' in outs:
+                        outs['kma'].write(line)
+                    if 'blast' in outs:
+                        if line.startswith(b'>'):
+                            line = blast_prefix + line[1:].lstrip()
+                        outs['blast'].write(line)
+
+def index_commands(
+        index_type: str, tools: dict[str, str], fasta: Path, prefix: Path
+) -> list[str]:
+    """Make the command that indexes fasta as prefix."""
+    if index_type == 'kma':
+        return [tools['kma'], '-i', str(fasta), '-o', str(prefix)]
+    return [
+        tools['blast'], '-in', str(fasta), '-dbtype', 'nucl',
+        '-out', str(prefix)
+    ]
+
+def build_scheme_indexes(
+        database: Path,
+        scheme: str,
+        files: list[Path],
+        indexes: list[str],
+        tools: dict[str, str],
+        scheme_dir: Union[Path, None] = None
+) -> Union[str, None]:
+    """Build the indexes of scheme and return an error message if any.
+
+    The indexes are written in a temporary folder and then moved to
+    scheme_dir, by default next to the scheme files, so that a failed build
+    never replaces a good index.
+    """
+    scheme_dir = Path(scheme_dir or Path(database) / scheme)
+    scheme_dir.mkdir(parents=True, exist_ok=True)
+    with tempfile.TemporaryDirectory(
+        prefix=f'.{scheme}_build_', dir=scheme_dir
+    ) as build_dir:
+        build_dir = Path(build_dir)
+        # The alleles are read once for all the indexes. The BLAST alleles
+        # are kept with the database for the typer (BLAST_ALLELES_SUFFIX).
+        fastas = {
+            index_type: build_dir / f'alleles_{index_type}.fsa'
+            for index_type in indexes
+        }
+        if 'blast' in fastas:
+            fastas['blast'] = build_dir / f'{scheme}{BLAST_ALLELES_SUFFIX}'
+        write_scheme_fastas(scheme, files, fastas)
+        prefix = build_dir / scheme
+        for index_type in indexes:
+            command = index_commands(
+                index_type, tools, fastas[index_type], prefix
+            )
+            process = subprocess.run(command, capture_output=True, text=True)
+            if process.returncode != 0:
+                return f'{command[0]} failed:\n{process.stderr.strip()}'
+        for index_file in build_dir.glob(f'{scheme}.*'):
+            os.replace(index_file, scheme_dir / index_file.name)
+    return None
+
+def process_scheme(
+        database: Path,
+        scheme: str,
+        loci_list: Union[list[str], None],
+        indexes: list[str],
+        tools: dict[str, str],
+        entry: dict,
+        force: bool
+) -> tuple[str, dict, Union[str, None]]:
+    """Hash the inputs of scheme and process the ones that changed.
+
+    entry is the record of scheme in the manifest. It returns the status
+    (`built`, `up to date` or `failed`), the updated record and the error
+    message of failed builds.
+    """
+    if loci_list is None:
+        return 'failed', entry, f'{scheme} is not in the config file.'
+    files = scheme_allele_files(database, scheme)
+    if not files:
+        return 'failed', entry, f'no allele files were found for {scheme}.'
+    entry = dict(entry)
+    status = 'up to date'
+    scheme_hash = hash_scheme_files(database, files)
+    if force or not is_scheme_up_to_date(
+        database, scheme, scheme_hash, indexes, entry
+    ):
+        error = build_scheme_indexes(database, scheme, files, indexes, tools)
+        if error:
+            return 'failed', entry, error
+        # Keep the indexes that were not rebuilt if alleles are equal.
+        kept = []
+        if entry.get('hash') == scheme_hash:
+            kept = entry.get('indexes', [])
+        entry['hash'] = scheme_hash
+        entry['indexes'] = sorted(set(kept) | set(indexes))
+        status = 'built'
+    profile_file = Path(database) / scheme / f'{scheme}.tsv'
+    if profile_file.exists():
+        profile_hash = hash_profile_file(profile_file, loci_list)
+        if (
+            force or entry.get('profile_hash') != profile_hash or
+            not profile_cache_file(database, scheme).exists()
+        ):
+            write_profile_cache(database, scheme, loci_list)
+            entry['profile_hash'] = profile_hash
+            status = 'built'
+    if status == 'built':
+        entry['built'] = datetime.now(timezone.utc).isoformat(
+            timespec='seconds'
+        )
+    return status, entry, None
+
+def check_index_tools(indexes: list[str], tools: dict[str, str]) -> None:
+    """Exit if the programs needed to build the indexes are missing."""
+    flags = {'kma': '--kma_index', 'blast': '--makeblastdb'}
+    for index_type in indexes:
+        if shutil.which(tools[index_type]) is None:
+            sys.exit(
+                f'Error: {tools[index_type]} does not exist or is not ' +
+                f'executable. Use the {flags[index_type]} flag to provide ' +
+                'its path.'
+            )
+
+def build_database(
+        database: Path,
+        schemes: Union[list[str], None] = None,
+        indexes: Union[list[str], None] = None,
+        jobs: int = 1,
+        force: bool = False,
+        kma_index: str = 'kma_index',
+        makeblastdb: str = 'makeblastdb'
+) -> dict[str, str]:
+    """Index the schemes of database whose inputs changed.
+
+    All the schemes in the config file are checked if schemes is None. It
+    returns the status of every scheme; the manifest is updated as soon as a
+    scheme is processed.
+    """
+    database = Path(database)
+    indexes = indexes or INDEX_TYPES
+    tools = {'kma': kma_index, 'blast': makeblastdb}
+    check_index_tools(indexes, tools)
+    config = read_config(database)
+    if schemes is None:
+        schemes = list(config)
+    manifest = load_manifest(database)
+    statuses = {}
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {
+            executor.submit(
+                process_scheme, database, scheme, config.get(scheme),
+                indexes, tools, manifest.get(scheme, {}), force
+            ): scheme
+            for scheme in schemes
+        }
+        for future in as_completed(futures):
+            scheme = futures[future]
+            status, entry, error = future.result()
+            statuses[scheme] = status
+            if status == 'failed':
+                print(f'{scheme}: failed, {error}', file=sys.stderr)
+                continue
+            print(f'{scheme}: {status}')
+            if status == 'built':
+                manifest[scheme] = entry
+                save_manifest(database, manifest)
+    return statuses
+
+def git_revision(database: Path, revision: str = 'HEAD') -> Union[str, None]:
+    """Get the commit of revision in the git checkout of database.
+
+    It returns None if database is not in a git checkout or revision does
+    not exist.
+    """
+    process = subprocess.run(
+        [
+            'git', '-C', str(database), 'rev-parse', '--verify', '--quiet',
+            f'{revision}^{{commit}}'
+        ],
+        capture_output=True, text=True
+    )
+    if process.returncode != 0:
+        return None
+    return process.stdout.strip()
+
+def git_pull(database: Path) -> None:
+    """Get the newest commits of the database from its remote."""
+    process = subprocess.run(
+        ['git', '-C', str(database), 'pull', '--ff-only'],
+        capture_output=True, text=True
+    )
+    if process.returncode != 0:
+        sys.exit(f'Error: git pull failed in {database}.\n{process.stderr}')
+
+def git_changed_files(database: Path, old: str, new: str) -> list[str]:
+    """Get the files of database that changed between two commits.
+
+    Paths are relative to database, which doesn't need to be the top folder
+    of the git checkout.
+    """
+    process = subprocess.run(
+        [
+            'git', '-C', str(database), 'diff', '--name-only', '--relative',
+            '--no-renames', old, new
+        ],
+        capture_output=True, text=True
+    )
+    if process.returncode != 0:
+        sys.exit(f'Error: git diff failed in {database}.\n{process.stderr}')
+    return process.stdout.splitlines()
+
+def git_config(database: Path, revision: str) -> dict[str, list[str]]:
+    """Get the schemes of the config file of database at revision."""
+    process = subprocess.run(
+        ['git', '-C', str(database), 'show', f'{revision}:./config'],
+        capture_output=True, text=True
+    )
+    if process.returncode != 0:
+        return {}
+    return parse_config(process.stdout.splitlines())
+
+def schemes_in_paths(
+        paths: list[str], config: dict[str, list[str]]
+) -> set[str]:
+    """Get the schemes with files in paths, relative to the database.
+
+    Scheme files are in `<scheme>/` and `alleles/<scheme>/`.
+    """
+    schemes = set()
+    for path in paths:
+        parts = PurePosixPath(path).parts
+        if len(parts) > 2 and parts[0] == 'alleles':
+            scheme = parts[1]
+        elif len(parts) > 1:
+            scheme = parts[0]
+        else:
+            continue
+        if scheme in config:
+            schemes.add(scheme)
+    return schemes
+
+def git_changed_schemes(database: Path, old: str, new: str) -> list[str]:
+    """Get the schemes of database that changed between two commits.
+
+    Schemes whose line in the config file changed are included too.
+    """
+    config = read_config(database)
+    paths = git_changed_files(database, old, new)
+    changed = schemes_in_paths(paths, config)
+    if 'config' in paths:
+        old_config = git_config(database, old)
+        changed.update(
+            scheme for scheme, loci in config.items()
+            if old_config.get(scheme) != loci
+        )
+    return [scheme for scheme in config if scheme in changed]
+
+def update_database(
+        database: Path,
+        pull: bool = True,
+        since: Union[str, None] = None,
+        indexes: Union[list[str], None] = None,
+        jobs: int = 1,
+        force: bool = False,
+        kma_index: str = 'kma_index',
+        makeblastdb: str = 'makeblastdb'
+) -> dict[str, str]:
+    """Update database and process only the schemes that changed.
+
+    In a git checkout, the changed schemes are the ones touched between since
+    (default: the commit before the pull) and the new HEAD, plus the schemes
+    missing from the manifest. Otherwise, every scheme is checked against the
+    hashes of the manifest. It returns the status of the processed schemes.
+    """
+    database = Path(database)
+    head = git_revision(database)
+    if head is None:
+        return build_database(
+            database, None, indexes, jobs, force, kma_index, makeblastdb
+        )
+    old = head
+    if since:
+        old = git_revision(database, since)
+        if old is None:
+            sys.exit(f'Error: {since} is not a commit of {database}.')
+    if pull:
+        git_pull(database)
+        head = git_revision(database)
+    schemes = git_changed_schemes(database, old, head)
+    # Schemes never processed, e.g. in the first update after a clone.
+    manifest = load_manifest(database)
+    schemes += [
+        scheme for scheme in read_config(database)
+        if scheme not in manifest and scheme not in schemes
+    ]
+    return build_database(
+        database, schemes, indexes, jobs, force, kma_index, makeblastdb
+    )
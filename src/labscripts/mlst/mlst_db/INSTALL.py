@@ -38,20 +38,17 @@ while shutil.which(kma_index) is None:
 
 
 # Index databases
-dirname = os.path.dirname(sys.argv[0])
+dirname = os.path.dirname(os.path.abspath(sys.argv[0]))
 
-# Use config_file to go through database dirs
-config_file = open(os.path.join(dirname, "config"), "r")
-for line in config_file:
-    if line.startswith("#"):
-        continue
-    else:
-        line = line.rstrip().split("\t")
-        species_dir = line[0]
-        # for each dir index the fasta files
-        os.system("{0} -i {1}/*.fsa -o {1}/{2}".format(kma_index, os.path.join(dirname, species_dir), species_dir))
+# The schemes in config are indexed in parallel. Schemes whose alleles did not
+# change since the last install are skipped (see manifest.json).
+# `mlst db build` also builds the BLAST databases.
+from labscripts.mlst.mlst_database import build_database
 
-config_file.close() 
+statuses = build_database(
+    dirname, indexes=["kma"], jobs=os.cpu_count() or 1, kma_index=kma_index
+)
+if "failed" in statuses.values():
+    sys.exit("Indexing failed for some schemes")
 
 print("Done")
-
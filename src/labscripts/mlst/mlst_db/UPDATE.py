@@ -33,31 +33,15 @@ if sys.argv[-1] != "not_interactive":
 elif shutil.which(kma_index) == None:
     sys.exit("KMA indexing program, {}, is not executable".format(kma_index))
 
-# Get newest changes from remote repository (git pull)
-git_pull_cmd = "git pull"
-process = subprocess.Popen(git_pull_cmd, shell=True,
-                           stdout=subprocess.PIPE,
-                           stderr=subprocess.PIPE)
-result, err = process.communicate()
-result = result.decode('UTF-8')
-error = err.decode('UTF-8')
+# Get newest changes from remote repository (git pull) and index again only
+# the schemes that changed in the pull (see `mlst db update`)
+from labscripts.mlst.mlst_database import update_database
 
-if error != "":
-    sys.exit(error)
-
-# Index databases again
-# Use config_file to go through database dirs
-if "Already up-to-date." not in result:
-    config_file = open("config", "r")
-    for line in config_file:
-        if line.startswith("#"):
-            continue
-        else:
-            line = line.rstrip().split("\t")
-            species_dir = line[0] 
-            # for each dir index the fasta files
-            kma_index_cmd = "{0} -i {1}/{1}.fsa -o {1}/{1}".format(kma_index, species_dir)
-            os.system(kma_index_cmd)
-    config_file.close() 
-else: 
+dirname = os.path.dirname(os.path.abspath(sys.argv[0]))
+statuses = update_database(
+    dirname, indexes=["kma"], jobs=os.cpu_count() or 1, kma_index=kma_index
+)
+if "failed" in statuses.values():
+    sys.exit("Indexing failed for some schemes")
+if not statuses:
     sys.stdout.write("Already up-to-date.")
@@ -0,0 +1,162 @@
+"""Registry of novel alleles.
+
+Novel alleles are the hits with full coverage but less than 100% identity
+(marked with `*`). Their sequence is stored in a SQLite file, keyed by its
+sha256, with a provisional allele number (`n1`, `n2`, ...) per locus and the
+nearest known allele. A genome with a novel allele that is already in the
+registry gets the same provisional number, found by a hash lookup, so the
+same new allele is reported with the same name in every genome of a batch
+or an outbreak. The registry can be exported as a FASTA file.
+
+Several processes can use the same registry at the same time. Looking up
+a registered allele is a plain read; the file is only locked to register a
+new one.
+"""
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Iterator, Union
+import hashlib
+import sqlite3
+import os
+
+# Prefix of the provisional allele numbers.
+PROVISIONAL_PREFIX = 'n'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS novel_alleles (
+    hash TEXT NOT NULL,
+    scheme TEXT NOT NULL,
+    locus TEXT NOT NULL,
+    number INTEGER NOT NULL,
+    sequence TEXT NOT NULL,
+    nearest_allele TEXT NOT NULL,
+    identity REAL NOT NULL,
+    created TEXT NOT NULL,
+    PRIMARY KEY (scheme, locus, hash),
+    UNIQUE (scheme, locus, number)
+)
+"""
+
+
+def default_registry_path() -> Path:
+    """Default registry, `$XDG_DATA_HOME/labscripts/novel_alleles.sqlite`."""
+    data_home = os.environ.get('XDG_DATA_HOME') or (
+        Path.home() / '.local' / 'share'
+    )
+    return Path(data_home) / 'labscripts' / 'novel_alleles.sqlite'
+
+def sequence_hash(sequence: str) -> str:
+    """Hash an allele sequence; gaps and case don't matter."""
+    sequence = sequence.replace('-', '').upper()
+    return hashlib.sha256(sequence.encode()).hexdigest()
+
+
+class NovelAlleleRegistry:
+    """Class to register and look up novel alleles in a SQLite file."""
+    def __init__(self, path: Union[Path, str]):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # Writers wait for each other instead of failing.
+        self.connection = sqlite3.connect(self.path, timeout=60)
+        self.connection.execute(SCHEMA)
+        self.connection.commit()
+
+    def resolve(
+            self,
+            scheme: str,
+            locus: str,
+            sequence: str,
+            nearest_allele: str,
+            identity: float
+    ) -> str:
+        """Get the provisional number of a novel allele, registering it if
+        it is new.
+        """
+        key = sequence_hash(sequence)
+        number = self.lookup(scheme, locus, key)
+        if number is not None:
+            return f'{PROVISIONAL_PREFIX}{number}'
+        # BEGIN IMMEDIATE locks the file, so two processes never give the
+        # same number to different alleles. The allele is looked up again,
+        # as another process may have registered it in the meantime.
+        with self.connection:
+            self.connection.execute('BEGIN IMMEDIATE')
+            number = self.lookup(scheme, locus, key)
+            if number is None:
+                number = self.connection.execute(
+                    'SELECT COALESCE(MAX(number), 0) + 1 FROM novel_alleles '
+                    'WHERE scheme = ? AND locus = ?',
+                    (scheme, locus)
+                ).fetchone()[0]
+                self.connection.execute(
+                    'INSERT INTO novel_alleles (hash, scheme, locus, number, '
+                    'sequence, nearest_allele, identity, created) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    (
+                        key, scheme, locus, number,
+                        sequence.replace('-', '').upper(), nearest_allele,
+                        identity,
+                        datetime.now(timezone.utc).isoformat(
+                            timespec='seconds'
+                        )
+                    )
+                )
+        return f'{PROVISIONAL_PREFIX}{number}'
+
+    def lookup(self, scheme: str, locus: str, key: str) -> Union[int, None]:
+        """Get the number of the allele with hash key, or None."""
+        row = self.connection.execute(
+            'SELECT number FROM novel_alleles '
+            'WHERE scheme = ? AND locus = ? AND hash = ?',
+            (scheme, locus, key)
+        ).fetchone()
+        return row[0] if row else None
+
+    def iter_alleles(
+            self, scheme: Union[str, None] = None
+    ) -> Iterator[tuple]:
+        """Yield (scheme, locus, number, sequence, nearest allele, identity)
+        of the registered alleles, sorted by scheme and locus.
+        """
+        query = (
+            'SELECT scheme, locus, number, sequence, nearest_allele, '
+            'identity FROM novel_alleles'
+        )
+        parameters = ()
+        if scheme:
+            query += ' WHERE scheme = ?'
+            parameters = (scheme,)
+        query += ' ORDER BY scheme, locus, number'
+        yield from self.connection.execute(query, parameters)
+
+    def export_fasta(
+            self, outfile: Path, scheme: Union[str, None] = None
+    ) -> int:
+        """Write the registered alleles in a FASTA file.
+
+        Headers are `<scheme>:<locus>_n<number>` followed by the nearest
+        allele and the identity to it. It returns the number of alleles
+        written.
+        """
+        counter = 0
+        with open(outfile, 'w') as f:
+            for (
+                scheme_name, locus, number, sequence, nearest, identity
+            ) in self.iter_alleles(scheme):
+                f.write(
+                    f'>{scheme_name}:{locus}_{PROVISIONAL_PREFIX}{number} ' +
+                    f'nearest={nearest} identity={identity:.2f}\n'
+                )
+                for i in range(0, len(sequence), 60):
+                    f.write(sequence[i:i + 60] + '\n')
+                counter += 1
+        return counter
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def __enter__(self) -> 'NovelAlleleRegistry':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
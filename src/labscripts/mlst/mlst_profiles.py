@@ -0,0 +1,210 @@
+"""Write the allele profiles of typed genomes.
+
+`results.csv` only keeps the sequence types. The profile files keep one row
+per genome and, for every locus of the scheme, the allele number, its mark
+(`*` novel, `?` partial, `?*` both, `!` several perfect hits), the identity
+and the coverage. There is one file per scheme and format:
+`profiles_<scheme>.tsv`, `.parquet` or `.arrow` (Arrow IPC).
+
+Rows are written as they come. Parquet and Arrow files are written in row
+groups (record batches), so the memory used doesn't grow with the number of
+genomes. Parquet and Arrow need pyarrow.
+"""
+from contextlib import ExitStack
+from pathlib import Path
+from typing import Union
+import csv
+import sys
+
+from labscripts.mlst.mlst_database import read_config
+
+PROFILE_FORMATS = ['tsv', 'parquet', 'arrow']
+# Genomes per row group (Parquet) or record batch (Arrow).
+ROW_GROUP_SIZE = 10000
+# Columns of every scheme before the loci columns.
+GENOME_COLUMNS = ['id', 'sequence_type', 'nearest_sts']
+# Columns of every locus; the first one is named after the locus.
+LOCUS_FIELDS = ['', '_mark', '_identity', '_coverage']
+# Marks of the alleles, see st_typing in mlst_cge.
+ALLELE_MARKS = '*?!'
+
+
+def import_pyarrow():
+    """Import pyarrow, which is only needed for Parquet and Arrow files."""
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        sys.exit(
+            'Error: pyarrow is needed to write Parquet and Arrow files.\n' +
+            'Install it with `pip install pyarrow` or use `--profiles tsv`.'
+        )
+    return pyarrow
+
+def profile_columns(loci: list[str]) -> list[str]:
+    """Get the columns of the profiles of a scheme with loci."""
+    return GENOME_COLUMNS + [
+        locus + field for locus in loci for field in LOCUS_FIELDS
+    ]
+
+def as_float(value) -> Union[float, None]:
+    """Identity and coverage are empty strings for loci without hits."""
+    return None if value in ('', None) else float(value)
+
+def profile_row(
+        record_id: str, scheme_results: dict, loci: list[str]
+) -> dict:
+    """Make the profile row of a genome from the mlstyper results."""
+    row = {
+        'id': record_id,
+        'sequence_type': scheme_results['sequence_type'],
+        'nearest_sts': scheme_results['nearest_sts'],
+    }
+    allele_profile = scheme_results['allele_profile']
+    for locus in loci:
+        allele_info = allele_profile.get(locus, {})
+        allele = allele_info.get('allele', '')
+        number = allele.rstrip(ALLELE_MARKS)
+        # Novel alleles in a registry have a provisional number.
+        row[locus] = allele_info.get('novel_allele') or number
+        row[f'{locus}_mark'] = allele[len(number):]
+        row[f'{locus}_identity'] = as_float(allele_info.get('identity'))
+        row[f'{locus}_coverage'] = as_float(allele_info.get('coverage'))
+    return row
+
+
+class TsvTableWriter:
+    """Class to write profile rows in a TSV file."""
+    def __init__(self, path: Path, columns: list[str]):
+        self.file = open(path, 'w', newline='')
+        self.writer = csv.DictWriter(
+            self.file, fieldnames=columns, delimiter='\t'
+        )
+        self.writer.writeheader()
+
+    def write(self, row: dict) -> None:
+        self.writer.writerow(row)
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class ArrowTableWriter:
+    """Class to write profile rows in a Parquet or Arrow IPC file.
+
+    Rows are kept by column until row_group_size rows are ready, and then
+    written as one row group.
+    """
+    def __init__(
+            self,
+            path: Path,
+            columns: list[str],
+            file_format: str,
+            row_group_size: int = ROW_GROUP_SIZE
+    ):
+        self.pa = import_pyarrow()
+        self.columns = columns
+        self.row_group_size = row_group_size
+        # Identity and coverage are numbers; everything else is text.
+        self.schema = self.pa.schema([
+            (column, self.pa.float64())
+            if column.endswith(('_identity', '_coverage'))
+            else (column, self.pa.string())
+            for column in columns
+        ])
+        if file_format == 'parquet':
+            self.writer = self.pa.parquet.ParquetWriter(path, self.schema)
+        else:
+            self.writer = self.pa.ipc.new_file(path, self.schema)
+        self.buffer = {column: [] for column in columns}
+        self.n_rows = 0
+
+    def write(self, row: dict) -> None:
+        for column in self.columns:
+            self.buffer[column].append(row.get(column))
+        self.n_rows += 1
+        if self.n_rows >= self.row_group_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """Write the rows in the buffer as one row group."""
+        if not self.n_rows:
+            return
+        batch = self.pa.RecordBatch.from_pydict(
+            self.buffer, schema=self.schema
+        )
+        if isinstance(self.writer, self.pa.parquet.ParquetWriter):
+            self.writer.write_batch(batch, row_group_size=self.n_rows)
+        else:
+            self.writer.write_batch(batch)
+        self.buffer = {column: [] for column in self.columns}
+        self.n_rows = 0
+
+    def close(self) -> None:
+        self.flush()
+        self.writer.close()
+
+
+class ProfileWriter:
+    """Class to write the allele profiles of every typed scheme.
+
+    The files of a scheme are opened the first time a genome is typed with
+    it. Use it as a context manager so that the last row groups are written.
+    """
+    def __init__(
+            self,
+            outdir: Path,
+            formats: list[str],
+            database: Path,
+            row_group_size: int = ROW_GROUP_SIZE,
+            suffix: str = ''
+    ):
+        self.outdir = Path(outdir)
+        self.formats = formats
+        self.row_group_size = row_group_size
+        # Added to the file names, e.g. the suffix of a shard (mlst_shard).
+        self.suffix = suffix
+        # Loci of every scheme, in the order of the config file.
+        self.loci = read_config(database)
+        # Writers of the schemes found so far.
+        self.writers = {}
+        self.exit_stack = ExitStack()
+        if any(file_format != 'tsv' for file_format in formats):
+            import_pyarrow()
+
+    def open_scheme(self, scheme: str) -> list:
+        """Open the files of scheme, one per format."""
+        writers = []
+        columns = profile_columns(self.loci[scheme])
+        for file_format in self.formats:
+            path = self.outdir / (
+                f'profiles_{scheme}{self.suffix}.{file_format}'
+            )
+            if file_format == 'tsv':
+                writer = TsvTableWriter(path, columns)
+            else:
+                writer = ArrowTableWriter(
+                    path, columns, file_format, self.row_group_size
+                )
+            self.exit_stack.callback(writer.close)
+            writers.append(writer)
+        return writers
+
+    def write(self, record_id: str, results: dict[str, dict]) -> None:
+        """Write the profiles of a genome; results are keyed by scheme."""
+        for scheme, scheme_results in results.items():
+            if scheme not in self.writers:
+                self.writers[scheme] = self.open_scheme(scheme)
+            row = profile_row(record_id, scheme_results, self.loci[scheme])
+            for writer in self.writers[scheme]:
+                writer.write(row)
+
+    def close(self) -> None:
+        self.exit_stack.close()
+
+    def __enter__(self) -> 'ProfileWriter':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
@@ -0,0 +1,333 @@
+"""Type raw reads with KMA.
+
+Samples are given as one or two FASTQ files, a folder with FASTQ files, or a
+samplesheet. They are mapped against the KMA index of `mlst_db/<species>/`,
+which is loaded once in shared memory so that many samples can be typed at
+the same time. Schemes without a complete index in the database are indexed
+with kma_index the first time, in the user cache folder, so installs that
+can't be written work too.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack, contextmanager
+from pathlib import Path
+from typing import Iterator, Union
+import subprocess
+import shutil
+import csv
+import os
+import re
+
+from labscripts.mlst.mlst_utils import (
+    InputMlstyper, MlstError, iter_sequence_paths, iter_fasta_paths,
+    results_by_scheme, sequence_types
+)
+from labscripts.mlst.mlst_cge import (
+    KMA_INDEX_SUFFIXES, mlstyper, get_read_filename, scheme_allele_files
+)
+from labscripts.mlst.mlst_database import (
+    build_scheme_indexes, hash_scheme_files
+)
+from labscripts.mlst.mlst_scratch import clear_dir
+from labscripts.mlst.mlst_screen import default_cache_dir
+# Shared memory level used to share the index between KMA processes.
+KMA_SHM_LEVEL = '1'
+# Find the sample name and the mate of paired files, e.g. s1_R1_001.fq.gz.
+PAIRED_READS_REGEX = re.compile(
+    r'^(?P<sample>.+?)[._-]R?(?P<mate>[12])(?:_001)?$'
+)
+
+
+class ReadSample:
+    """Class to store the FASTQ file(s) of one sample."""
+    def __init__(
+            self,
+            name: str,
+            fastq_1: Path,
+            fastq_2: Union[Path, None] = None
+    ):
+        self.name = name
+        self.fastq_1 = fastq_1
+        # None for single-end reads.
+        self.fastq_2 = fastq_2
+
+    @property
+    def files(self) -> list[str]:
+        """FASTQ files as a list of strings, as used by mlstyper."""
+        files = [str(self.fastq_1)]
+        if self.fastq_2:
+            files.append(str(self.fastq_2))
+        return files
+
+
+def has_fastq_extension(file_name: str) -> bool:
+    """Check if file has FASTQ extension (it can be gzipped)."""
+    if file_name.endswith('.gz'):
+        file_name = file_name[:-3]
+    extension = file_name.split('.')[-1]
+    return extension == 'fastq' or extension == 'fq'
+
+def has_samplesheet_extension(file_name: str) -> bool:
+    """Check if file has the extension of a samplesheet."""
+    extension = file_name.split('.')[-1]
+    return extension == 'csv' or extension == 'tsv'
+
+def strip_fastq_extension(file_name: str) -> str:
+    """Remove the FASTQ (and gz) extension of a file name."""
+    return re.sub(r'\.(fastq|fq)(\.gz)?$', '', file_name)
+
+def pair_fastq_files(fastqs: list[Path]) -> list[ReadSample]:
+    """Group FASTQ files into samples.
+
+    Files named like `<sample>_R1.fastq.gz`/`<sample>_R2.fastq.gz` (also `_1`,
+    `_2`, `.R1` and the Illumina `_R1_001` suffix) are paired. Any other file
+    is a single-end sample named after the file.
+    """
+    mates = {}
+    for fastq in sorted(fastqs):
+        name = strip_fastq_extension(fastq.name)
+        match = PAIRED_READS_REGEX.match(name)
+        if match:
+            mates.setdefault(match.group('sample'), {})[
+                match.group('mate')
+            ] = fastq
+        else:
+            mates.setdefault(name, {})['1'] = fastq
+    samples = []
+    for name, files in mates.items():
+        # A lonely mate 2 is typed as single-end data.
+        fastq_1 = files.get('1', files.get('2'))
+        fastq_2 = files.get('2') if '1' in files else None
+        samples.append(ReadSample(name, fastq_1, fastq_2))
+    return samples
+
+def read_samplesheet(samplesheet: Path) -> list[ReadSample]:
+    """Get samples from a samplesheet.
+
+    The samplesheet is a CSV (or TSV) file with the columns `sample`,
+    `fastq_1` and `fastq_2`. `fastq_2` is empty for single-end samples.
+    Relative paths are resolved from the folder of the samplesheet.
+    """
+    delimiter = '\t' if samplesheet.name.endswith('.tsv') else ','
+    samples = []
+    with open(samplesheet, 'r', newline='') as f:
+        reader = csv.DictReader(f, delimiter=delimiter)
+        missing = {'sample', 'fastq_1'} - set(reader.fieldnames or [])
+        if missing:
+            raise MlstError(
+                f'{samplesheet} misses the column(s): ' +
+                ', '.join(sorted(missing))
+            )
+        for row in reader:
+            files = []
+            for column in ['fastq_1', 'fastq_2']:
+                value = (row.get(column) or '').strip()
+                if not value:
+                    files.append(None)
+                    continue
+                path = Path(value)
+                if not path.is_absolute():
+                    path = samplesheet.parent / path
+                if not path.is_file():
+                    raise MlstError(f'{path} does not exist.')
+                files.append(path)
+            if files[0] is None:
+                raise MlstError(
+                    f"sample {row['sample']} in {samplesheet} has " +
+                    "no `fastq_1` file."
+                )
+            samples.append(ReadSample(row['sample'].strip(), *files))
+    return samples
+
+def iter_fastq_paths(
+        directory: Path,
+        recursive: bool = False,
+        patterns: Union[list[str], None] = None
+) -> Iterator[Path]:
+    """Lazily yield the paths to the FASTQ files found in directory."""
+    yield from iter_sequence_paths(
+        directory, has_fastq_extension, recursive, patterns
+    )
+
+def is_reads_input(
+        paths: list[Path],
+        recursive: bool = False,
+        patterns: Union[list[str], None] = None
+) -> bool:
+    """Check if the input of `mlst run` is made of reads.
+
+    Folders are typed as reads only if they don't have FASTA files.
+    """
+    path = paths[0]
+    if path.is_dir():
+        if next(iter_fasta_paths(path, recursive, patterns), None):
+            return False
+        fastqs = iter_fastq_paths(path, recursive, patterns)
+        return next(fastqs, None) is not None
+    return (
+        has_fastq_extension(path.name) or has_samplesheet_extension(path.name)
+    )
+
+def collect_read_samples(
+        paths: list[Path],
+        recursive: bool = False,
+        patterns: Union[list[str], None] = None
+) -> list[ReadSample]:
+    """Make the list of samples to type from the input of `mlst run`."""
+    if paths[0].is_dir():
+        return pair_fastq_files(
+            list(iter_fastq_paths(paths[0], recursive, patterns))
+        )
+    if has_samplesheet_extension(paths[0].name):
+        return read_samplesheet(paths[0])
+    if len(paths) == 1:
+        return [ReadSample(strip_fastq_extension(paths[0].name), paths[0])]
+    # Paired files given in the command line are one sample, even if their
+    # names don't follow the R1/R2 convention.
+    samples = pair_fastq_files(paths)
+    if len(samples) == 1:
+        return samples
+    name = get_read_filename([str(path) for path in paths])
+    return [ReadSample(name, paths[0], paths[1])]
+
+def has_kma_index(index_dir: Path, species: str) -> bool:
+    """Check that index_dir has all the files of the KMA index of species."""
+    return all(
+        (Path(index_dir) / (species + suffix)).exists()
+        for suffix in KMA_INDEX_SUFFIXES
+    )
+
+def find_kma_index_tool(kma_path: str) -> Union[str, None]:
+    """Find kma_index next to kma, or in the PATH."""
+    kma = shutil.which(kma_path)
+    if kma is not None:
+        kma_index = Path(kma).with_name('kma_index')
+        if os.access(kma_index, os.X_OK):
+            return str(kma_index)
+    return shutil.which('kma_index')
+
+def kma_index_dir(
+        database: Path,
+        species: str,
+        kma_path: str = 'kma',
+        cache_dir: Union[Path, None] = None
+) -> Path:
+    """Get the folder with the KMA index of species, building it if needed.
+
+    The index of the database is used if it is complete. Otherwise, the
+    index is built with kma_index in `<cache_dir>/kma/`, once for every
+    version of the allele files. It raises MlstError if it can't be built.
+    """
+    database = Path(database)
+    if has_kma_index(database / species, species):
+        return database / species
+    files = scheme_allele_files(database, species)
+    if not files:
+        raise MlstError(f'{species} has no allele files in {database}.')
+    scheme_hash = hash_scheme_files(database, files)
+    index_dir = Path(cache_dir or default_cache_dir()) / 'kma' / (
+        f'{species}_{scheme_hash[:16]}'
+    )
+    if has_kma_index(index_dir, species):
+        return index_dir
+    kma_index = find_kma_index_tool(kma_path)
+    if kma_index is None:
+        raise MlstError(
+            f'the KMA index of {species} is incomplete and kma_index was ' +
+            'not found to build it. Install kma_index, or index the ' +
+            f'database with `mlst db build --indexes kma -s {species}`.'
+        )
+    print(f'Indexing {species} with kma_index in {index_dir}')
+    error = build_scheme_indexes(
+        database, species, files, ['kma'], {'kma': kma_index}, index_dir
+    )
+    if error:
+        raise MlstError(
+            f'the KMA index of {species} could not be built. {error}'
+        )
+    return index_dir
+
+@contextmanager
+def shared_kma_index(kma_path: str, template_db: Path) -> Iterator[None]:
+    """Load a KMA index in shared memory for as long as the context lasts."""
+    load = subprocess.run(
+        [kma_path, 'shm', '-t_db', str(template_db), '-shmLvl', KMA_SHM_LEVEL],
+        capture_output=True, text=True
+    )
+    if load.returncode != 0:
+        raise MlstError(
+            f'KMA could not load {template_db} in shared memory.\n' +
+            load.stderr
+        )
+    try:
+        yield
+    finally:
+        subprocess.run(
+            [
+                kma_path, 'shm', '-t_db', str(template_db),
+                '-shmLvl', KMA_SHM_LEVEL, '-destroy'
+            ],
+            capture_output=True
+        )
+
+def type_read_sample(input_mlstyper: InputMlstyper) -> dict[str, dict]:
+    """Run mlst with the reads of one sample and return its results.
+
+    It runs in a worker process; every worker process reuses its own
+    scratch folder, which is on disk if the one in RAM is full.
+    """
+    scratch = input_mlstyper.scratch.worker_dir()
+    try:
+        return results_by_scheme(mlstyper(
+            input_mlstyper.replace(tmp_dir=scratch, outdir_mlstyper=scratch)
+        ))
+    finally:
+        clear_dir(scratch)
+
+def run_mlstyper_reads(
+        input_mlstyper: InputMlstyper, samples: list[ReadSample]
+) -> None:
+    """Run mlst with the reads of one or more samples.
+
+    Samples are mapped by `jobs` KMA processes at a time, which share one
+    copy of the index in memory.
+    """
+    kma_path = input_mlstyper.method_path or 'kma'
+    if shutil.which(kma_path) is None:
+        raise MlstError(
+            'no valid path to a kma program was provided. ' +
+            'Use the -mp flag to provide the path.'
+        )
+    kma_dirs = {
+        species: kma_index_dir(input_mlstyper.database, species, kma_path)
+        for species in input_mlstyper.species.split(',')
+    }
+    # Make an input per sample; the workers write in their scratch folder.
+    inputs = []
+    for sample in samples:
+        # Profiles are written by this process, not by the workers.
+        inputs.append(input_mlstyper.replace(
+            infile=sample.files, method_path=kma_path, kma_shm=True,
+            kma_dirs=kma_dirs, profile_writer=None
+        ))
+    # Open and close results file to remove any existing file with same name.
+    open(input_mlstyper.results_file, 'w').close()
+    with (
+        open(input_mlstyper.results_file, 'a') as output,
+        ExitStack() as shared_indexes,
+        ProcessPoolExecutor(max_workers=input_mlstyper.jobs) as executor
+    ):
+        writer = csv.DictWriter(
+            output, fieldnames=input_mlstyper.csv_fieldnames
+        )
+        writer.writeheader()
+        for species, index_dir in kma_dirs.items():
+            shared_indexes.enter_context(
+                shared_kma_index(kma_path, index_dir / species)
+            )
+        # Results come back in the order of the samples.
+        for sample, results in zip(
+            samples, executor.map(type_read_sample, inputs)
+        ):
+            writer.writerow({'id': sample.name, **sequence_types(results)})
+            if input_mlstyper.profile_writer is not None:
+                input_mlstyper.profile_writer.write(sample.name, results)
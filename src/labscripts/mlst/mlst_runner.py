@@ -1,12 +1,15 @@
 """Module to run mlst from cge.
 
 It can be run using a file with one or more FASTA sequences or a folder
-carrying one or more FASTA sequences.
+carrying one or more FASTA sequences. Raw reads can be typed with KMA from
+one or two FASTQ files, a folder with FASTQ files or a samplesheet.
 """
 import argparse
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from contextlib import ExitStack
 from importlib import resources
 from pathlib import Path
-import subprocess
 import json
 import csv
 import sys
@@ -15,8 +18,37 @@ import os
 from Bio import SeqIO
 
 from labscripts import mlst
-from labscripts.mlst.mlst_utils import SpeciesOptions, InputMlstyper
+from labscripts.mlst.mlst_utils import (
+    SpeciesOptions, InputMlstyper, MlstError, has_fasta_extension,
+    iter_fasta_paths, fasta_summary, file_genome_id, ignore_sigint,
+    results_by_scheme, sequence_types
+)
 from labscripts.mlst.mlst_cge import mlstyper
+from labscripts.mlst.mlst_database import build_database, update_database
+from labscripts.mlst.mlst_validate import validate_database
+from labscripts.mlst.mlst_profiles import (
+    PROFILE_FORMATS, ROW_GROUP_SIZE, ProfileWriter
+)
+from labscripts.mlst.mlst_cluster import (
+    CHUNK_SIZE, cluster_profiles, read_clonal_complexes
+)
+from labscripts.mlst.mlst_novel import (
+    NovelAlleleRegistry, default_registry_path
+)
+from labscripts.mlst.mlst_scratch import (
+    SCRATCH_MAX, SHM_MIN_FREE, ScratchSpace, clear_dir
+)
+from labscripts.mlst.mlst_watch import (
+    SETTLE_TIME, WATCH_INTERVAL, watch_fasta_files
+)
+from labscripts.mlst.mlst_screen import load_sketch_index, detect_schemes
+from labscripts.mlst.mlst_shard import (
+    find_shard_files, merge_results, parse_shard, sort_results
+)
+from labscripts.mlst.mlst_reads import (
+    has_fastq_extension, has_samplesheet_extension, iter_fastq_paths,
+    is_reads_input, collect_read_samples, run_mlstyper_reads
+)
 
 
 def parse_command_line():
@@ -24,8 +56,11 @@ def parse_command_line():
         add_help=False,
         prog="mlst",
         formatter_class=argparse.RawTextHelpFormatter,
-        description="Run mlst with one or more FASTA sequences.",
-        epilog="Note:\nCurrently, the script works only with FASTA sequences."
+        description="Run mlst with FASTA sequences or raw reads.",
+        epilog=(
+            "Note:\nFASTA sequences are typed with blastn and FASTQ reads\n" +
+            "with KMA."
+        )
     )
     helper = parser.add_argument_group("Help")
     helper.add_argument(
@@ -50,6 +85,95 @@ def parse_command_line():
         ),
         help='List species options'
     )
+    # Create subparser for the 'db' commands that maintain the database.
+    db = subparsers.add_parser(
+        'db', help='Maintain the MLST database', add_help=False,
+        description="Maintain the MLST database.",
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
+    db_helper = db.add_argument_group("Help")
+    db_helper.add_argument(
+        "-h", "--help", action="help", help="Show this help message and exit."
+    )
+    db_subparsers = db.add_subparsers(
+        dest='db_command', title='Positional arguments', help='Commands',
+        required=True
+    )
+    db_build = db_subparsers.add_parser(
+        'build', help='Build the KMA and BLAST indexes', add_help=False,
+        description=(
+            "Build the KMA and BLAST indexes of the MLST database.\n" +
+            "Only the schemes whose allele files changed since the last\n" +
+            "build are indexed."
+        ),
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
+    db_update = db_subparsers.add_parser(
+        'update', help='Update the database and its indexes', add_help=False,
+        description=(
+            "Update the MLST database with `git pull` and index only the\n" +
+            "schemes that changed. If the database is not a git checkout,\n" +
+            "the schemes are compared with the hashes of the last build."
+        ),
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
+
+    # Create subparser for the registry of novel alleles.
+    novel = subparsers.add_parser(
+        'novel', help='Manage the registry of novel alleles', add_help=False,
+        description="Manage the registry of novel alleles.",
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
+    novel_helper = novel.add_argument_group("Help")
+    novel_helper.add_argument(
+        "-h", "--help", action="help", help="Show this help message and exit."
+    )
+    novel_subparsers = novel.add_subparsers(
+        dest='novel_command', title='Positional arguments', help='Commands',
+        required=True
+    )
+    novel_export = novel_subparsers.add_parser(
+        'export', help='Save the novel alleles in a FASTA file',
+        add_help=False,
+        description=(
+            "Save the novel alleles of the registry in a FASTA file, one\n" +
+            "sequence per allele. Headers are `<scheme>:<locus>_n<number>`\n" +
+            "followed by the nearest known allele."
+        ),
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
+
+    # Create subparser to merge the results of shards.
+    merge = subparsers.add_parser(
+        'merge', help='Merge the results of `mlst run --shard`',
+        add_help=False,
+        description=(
+            "Merge the results files of the shards of a run into one\n" +
+            "results.csv sorted by id. The shards are read side by side,\n" +
+            "one row at a time, so any number of genomes can be merged.\n" +
+            "All the shards must be there."
+        ),
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
+
+    # Create subparser to cluster typed genomes.
+    cluster = subparsers.add_parser(
+        'cluster', help='Cluster typed genomes by allele distance',
+        add_help=False,
+        description=(
+            "Cluster the genomes of a profile file written by\n" +
+            "`mlst run --profiles` by the number of loci with different\n" +
+            "alleles. It saves `clusters.tsv`, with the single-linkage\n" +
+            "cluster and the clonal complex of every genome, and `mst.tsv`,\n" +
+            "the edges of a minimum spanning tree."
+        ),
+        epilog=(
+            "Note:\nLoci without an allele, or with an allele marked `*` or\n" +
+            "`?`, are not counted. Novel alleles with a provisional number\n" +
+            "(see `--novel_registry`) are counted."
+        ),
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
 
     # -- SUBPARSER run --------------------------------------------------------
     # Make arguments groups.
@@ -64,15 +188,33 @@ def parse_command_line():
     )
     # Required arguments.
     run_required.add_argument(
-        # Note: if planning to use reads, include `nargas=+` and do the
-        # corresponding changes in the run_mlstyper functions.
-        "-i", "--input", required=True,
-        help=("Path to file or folder with FASTA sequence(s).")
+        "-i", "--input", required=True, nargs="+",
+        help=(
+            "Path to file or folder with FASTA sequence(s).\n" +
+            "Reads can be given as one or two (paired) FASTQ files, a\n" +
+            "folder with FASTQ files, or a samplesheet (.csv or .tsv) with\n" +
+            "the columns `sample`, `fastq_1` and `fastq_2`."
+        )
     )
-    run_required.add_argument(
+    run_schemes = run_required.add_mutually_exclusive_group(required=True)
+    run_schemes.add_argument(
         "-s", "--species",
-        required=True,
-        help=("Species database used from MLST prediction.")
+        help=(
+            "Species database used from MLST prediction.\n" +
+            "Several schemes can be separated by commas, e.g.\n" +
+            "`ecoli,ecoli_2`. They are typed with a single search per\n" +
+            "genome and reported in one column per scheme.\n" +
+            "Use `auto` to detect the scheme(s) of every FASTA genome with\n" +
+            "a k-mer screen; results then have one row per genome and\n" +
+            "scheme."
+        )
+    )
+    run_schemes.add_argument(
+        "-as", "--all_schemes_for",
+        help=(
+            "Type all the schemes of an organism, e.g. \"Escherichia coli\".\n" +
+            "Use `mlst list_sp` to see the organisms."
+        )
     )
     # Optional arguments.
     run_optional.add_argument(
@@ -85,54 +227,448 @@ def parse_command_line():
     run_optional.add_argument(
         "-mp", "--method_path",
         help=(
-            "Path to blastn.\n" +
-            "If you don't have blastn in the environmental path, use this\n" +
-            "flag to enter the path of blastn."
+            "Path to blastn, or to kma when typing reads.\n" +
+            "If you don't have blastn (kma) in the environmental path, use\n" +
+            "this flag to enter its path."
+        )
+    )
+    run_optional.add_argument(
+        "-j", "--jobs", type=int, default=1,
+        help=(
+            "Number of read samples typed at the same time. The KMA index\n" +
+            "is loaded once in shared memory for all of them.\n" +
+            "Default: 1."
+        )
+    )
+    run_optional.add_argument(
+        "-a", "--assemblies", action="store_true",
+        help=(
+            "Treat every FASTA file as one genome assembly.\n" +
+            "All the contigs of a file are typed together and one ST is\n" +
+            "reported per file, named after its path in the input folder\n" +
+            "without the extension.\n" +
+            "By default, files with many sequences are skipped in folders\n" +
+            "and every sequence is typed independently in single files."
+        )
+    )
+    run_optional.add_argument(
+        "-p", "--profiles", nargs="+", choices=PROFILE_FORMATS,
+        help=(
+            "Also save the allele profiles, one row per genome and one\n" +
+            "column per locus with the allele, its mark, the identity\n" +
+            "and the coverage. One file per scheme and format is written,\n" +
+            "e.g. `profiles_ecoli.parquet`. Parquet and Arrow need pyarrow."
+        )
+    )
+    run_optional.add_argument(
+        "--row_group_size", type=int, default=ROW_GROUP_SIZE,
+        help=(
+            "Genomes per row group of the Parquet and Arrow profiles.\n" +
+            f"Default: {ROW_GROUP_SIZE}."
+        )
+    )
+    run_optional.add_argument(
+        "--novel_registry", nargs="?", const=default_registry_path(),
+        help=(
+            "Give the novel alleles (`*`) a provisional number, e.g. `n1`,\n" +
+            "kept in a registry so that the same new allele gets the same\n" +
+            "number in every genome. The number is reported in the JSON\n" +
+            "results and the profiles. Export the alleles with\n" +
+            "`mlst novel export`.\n" +
+            f"Default registry: {default_registry_path()}"
+        )
+    )
+    run_optional.add_argument(
+        "-r", "--recursive", action="store_true",
+        help="Search for FASTA files in the subfolders of the input folder."
+    )
+    run_optional.add_argument(
+        "-g", "--glob", nargs="+",
+        help=(
+            "Glob pattern(s) to select the FASTA files of the input folder,\n" +
+            "e.g. `-g 'sample_*.fasta' '*.fna'`.\n" +
+            "Default: all the files with a FASTA extension."
         )
     )
 
+    run_optional.add_argument(
+        "--two_stage", action="store_true",
+        help=(
+            "Search FASTA genomes in two stages: a few alleles per locus\n" +
+            "locate the loci, and all the alleles are then searched only\n" +
+            "around them. Faster for big genomes and schemes with many\n" +
+            "alleles; the whole genome is searched if a locus is not found."
+        )
+    )
+    run_optional.add_argument(
+        "--scratch_dir",
+        help=(
+            "Folder for the temporary files; a folder of its own is made\n" +
+            "in it for every run and removed at the end.\n" +
+            "Default: $TMPDIR if set, else /dev/shm if it has\n" +
+            "--shm_min_free free, else the system temporary folder."
+        )
+    )
+    run_optional.add_argument(
+        "--shm_min_free", type=int, default=SHM_MIN_FREE,
+        help=(
+            "Free space (MiB) /dev/shm (RAM) must have to hold the\n" +
+            "temporary files. It is checked when the run starts and, with\n" +
+            "--jobs workers, before every genome.\n" +
+            f"Default: {SHM_MIN_FREE}."
+        )
+    )
+    run_optional.add_argument(
+        "--scratch_max", type=int, default=SCRATCH_MAX,
+        help=(
+            "Space (MiB) the temporary files may use in /dev/shm. Once it\n" +
+            "is reached, the --jobs workers type their next genomes in the\n" +
+            "system temporary folder on disk.\n" +
+            f"Default: {SCRATCH_MAX}."
+        )
+    )
+    run_optional.add_argument(
+        "--shard",
+        help=(
+            "Type only shard i of N of the genomes, e.g. `--shard 3/10`,\n" +
+            "with i from 1 to N. Genomes are split by a hash of their file\n" +
+            "path, record id or sample name, so N runs with the same input\n" +
+            "type every genome once. Results go to\n" +
+            "`results.shard_<i>_of_<N>.csv`, sorted by id; join them with\n" +
+            "`mlst merge`. Profile files get the same suffix."
+        )
+    )
+
+    # -- SUBPARSER watch ------------------------------------------------------
+    # watch takes the arguments of run, which must be defined by now.
+    watch = subparsers.add_parser(
+        'watch', parents=[run], help='Type FASTA files as they land in a folder',
+        add_help=False,
+        description=(
+            "Watch a folder and type every FASTA file once it is complete,\n" +
+            "i.e. once its size did not change for --settle seconds.\n" +
+            "Every file is typed as one assembly, named after its path in\n" +
+            "the folder without the extension, by --jobs workers, and\n" +
+            "results.csv is appended as they finish.\n" +
+            "Files already in results.csv are skipped, so a stopped watch\n" +
+            "can be started again."
+        ),
+        epilog=(
+            "Note:\nNew files are found with inotify where available, or by\n" +
+            "listing the folder every --interval seconds. Stop it with\n" +
+            "Ctrl-C. Profile files only have the files typed since the\n" +
+            "watch was started."
+        ),
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
+    watch_options = watch.add_argument_group("Watch")
+    watch_options.add_argument(
+        "--interval", type=float, default=WATCH_INTERVAL,
+        help=(
+            "Seconds between checks of the folder.\n" +
+            f"Default: {WATCH_INTERVAL}."
+        )
+    )
+    watch_options.add_argument(
+        "--settle", type=float, default=SETTLE_TIME,
+        help=(
+            "Seconds a file must stay unchanged before it is typed.\n" +
+            f"Default: {SETTLE_TIME}."
+        )
+    )
+    watch_options.add_argument(
+        "--idle_exit", type=float,
+        help=(
+            "Stop after this many seconds without new files.\n" +
+            "Default: watch until stopped."
+        )
+    )
+    watch_options.add_argument(
+        "--polling", action="store_true",
+        help="List the folder every --interval seconds instead of inotify."
+    )
+
+    db_validate = db_subparsers.add_parser(
+        'validate', help='Check the consistency of the database',
+        add_help=False,
+        description=(
+            "Check that the config file, the allele files, the profiles and\n" +
+            "the indexes of the MLST database agree."
+        ),
+        epilog=(
+            "Note:\nThe exit status is 1 if any error is found. The findings\n" +
+            "of unchanged schemes are read from a cache."
+        ),
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
+    # -- SUBPARSERS db build and db update ------------------------------------
+    for db_parser in [db_build, db_update]:
+        db_helper = db_parser.add_argument_group("Help")
+        db_optional = db_parser.add_argument_group("Optional")
+        db_helper.add_argument(
+            "-h", "--help", action="help",
+            help="Show this help message and exit."
+        )
+        db_optional.add_argument(
+            "-d", "--database",
+            help=(
+                "Path to the MLST database.\n" +
+                "Default: the database installed with labscripts."
+            )
+        )
+        db_optional.add_argument(
+            "-j", "--jobs", type=int, default=1,
+            help="Number of schemes indexed at the same time.\nDefault: 1."
+        )
+        db_optional.add_argument(
+            "-f", "--force", action="store_true",
+            help="Index the schemes even if their inputs did not change."
+        )
+        db_optional.add_argument(
+            "--indexes", nargs="+", choices=['kma', 'blast'],
+            default=['kma', 'blast'],
+            help="Indexes to build.\nDefault: kma blast."
+        )
+        db_optional.add_argument(
+            "--kma_index", default="kma_index",
+            help="Path to kma_index.\nDefault: kma_index."
+        )
+        db_optional.add_argument(
+            "--makeblastdb", default="makeblastdb",
+            help="Path to makeblastdb.\nDefault: makeblastdb."
+        )
+        if db_parser is db_build:
+            db_optional.add_argument(
+                "-s", "--species", nargs="+",
+                help=(
+                    "Scheme(s) to index.\n" +
+                    "Default: all the schemes in the config file."
+                )
+            )
+    db_update_optional = db_update.add_argument_group("Update")
+    db_update_optional.add_argument(
+        "--since",
+        help=(
+            "Index the schemes changed since this git commit, e.g. the\n" +
+            "commit of the last deploy.\n" +
+            "Default: the commit before the pull."
+        )
+    )
+    db_update_optional.add_argument(
+        "--no_pull", action="store_true",
+        help="Don't run `git pull`; useful together with --since."
+    )
+
+    # -- SUBPARSER db validate ------------------------------------------------
+    db_validate_helper = db_validate.add_argument_group("Help")
+    db_validate_optional = db_validate.add_argument_group("Optional")
+    db_validate_helper.add_argument(
+        "-h", "--help", action="help", help="Show this help message and exit."
+    )
+    db_validate_optional.add_argument(
+        "-d", "--database",
+        help=(
+            "Path to the MLST database.\n" +
+            "Default: the database installed with labscripts."
+        )
+    )
+    db_validate_optional.add_argument(
+        "-s", "--species", nargs="+",
+        help=(
+            "Scheme(s) to check.\n" +
+            "Default: all the schemes in the config file."
+        )
+    )
+    db_validate_optional.add_argument(
+        "-j", "--jobs", type=int, default=1,
+        help="Number of schemes checked at the same time.\nDefault: 1."
+    )
+    db_validate_optional.add_argument(
+        "--format", choices=['text', 'json'], default='text',
+        help=(
+            "Format of the findings. `json` writes one JSON object per\n" +
+            "line with the keys level, scheme, check, message and path.\n" +
+            "Default: text."
+        )
+    )
+    db_validate_optional.add_argument(
+        "--no_cache", action="store_true",
+        help="Check every scheme again, ignoring the cached findings."
+    )
+
+    # -- SUBPARSER cluster ----------------------------------------------------
+    cluster_helper = cluster.add_argument_group("Help")
+    cluster_required = cluster.add_argument_group("Required")
+    cluster_optional = cluster.add_argument_group("Optional")
+    cluster_helper.add_argument(
+        "-h", "--help", action="help", help="Show this help message and exit."
+    )
+    cluster_required.add_argument(
+        "-i", "--input", required=True,
+        help="Profile file (.tsv, .parquet or .arrow)."
+    )
+    cluster_optional.add_argument(
+        "-o", "--outdir", default=Path.cwd(),
+        help="Output directory.\nDefault: current working directory."
+    )
+    cluster_optional.add_argument(
+        "-t", "--threshold", type=int, default=0,
+        help=(
+            "Largest number of different loci between two genomes of the\n" +
+            "same cluster.\nDefault: 0."
+        )
+    )
+    cluster_optional.add_argument(
+        "-s", "--species",
+        help=(
+            "Scheme of the profiles, to get the clonal complexes.\n" +
+            "Default: taken from the file name, e.g. `profiles_ecoli.tsv`."
+        )
+    )
+    cluster_optional.add_argument(
+        "-d", "--database",
+        help=(
+            "Path to the MLST database.\n" +
+            "Default: the database installed with labscripts."
+        )
+    )
+    cluster_optional.add_argument(
+        "--matrix", action="store_true",
+        help=(
+            "Also save the distance matrix in `distances.tsv`. Its size\n" +
+            "grows with the square of the number of genomes."
+        )
+    )
+    cluster_optional.add_argument(
+        "--chunk_size", type=int, default=CHUNK_SIZE,
+        help=(
+            "Rows of the distance matrix computed at a time.\n" +
+            f"Default: {CHUNK_SIZE}."
+        )
+    )
+
+    # -- SUBPARSER merge ------------------------------------------------------
+    merge_helper = merge.add_argument_group("Help")
+    merge_required = merge.add_argument_group("Required")
+    merge_optional = merge.add_argument_group("Optional")
+    merge_helper.add_argument(
+        "-h", "--help", action="help", help="Show this help message and exit."
+    )
+    merge_required.add_argument(
+        "-i", "--input", required=True, nargs="+",
+        help=(
+            "Folder(s) with the `results.shard_<i>_of_<N>.csv` files, or\n" +
+            "the files themselves."
+        )
+    )
+    merge_optional.add_argument(
+        "-o", "--output",
+        help=(
+            "Path to the merged file.\n" +
+            "Default: results.csv in the folder of the first shard."
+        )
+    )
+
+    # -- SUBPARSER novel export -----------------------------------------------
+    novel_export_helper = novel_export.add_argument_group("Help")
+    novel_export_required = novel_export.add_argument_group("Required")
+    novel_export_optional = novel_export.add_argument_group("Optional")
+    novel_export_helper.add_argument(
+        "-h", "--help", action="help", help="Show this help message and exit."
+    )
+    novel_export_required.add_argument(
+        "-o", "--output", required=True, help="Path to the FASTA file."
+    )
+    novel_export_optional.add_argument(
+        "--registry", default=default_registry_path(),
+        help=f"Path to the registry.\nDefault: {default_registry_path()}"
+    )
+    novel_export_optional.add_argument(
+        "-s", "--species",
+        help="Save only the alleles of this scheme.\nDefault: all schemes."
+    )
+
     args = parser.parse_args()
     check_command_line_arguments(args)
     return args
 
 
-def has_fasta_extension(file_name: str) -> bool:
-    """Check if file has FASTA extension."""
-    extension = file_name.split('.')[-1]
-    if (
-        extension == 'fasta' or extension == 'fna' or extension == 'ffn' or
-        extension == 'faa' or extension == 'frn' or extension == 'fa'
-    ):
-        return True
-    return False
-
-def mk_list_fasta_files(directory: Path) -> list[Path]:
-    """Make a list of FASTA files from directory."""
-    docs = os.listdir(directory)
-    fastas = [directory / doc for doc in docs if has_fasta_extension(doc)]
-    return fastas
-
-def list_has_fasta_files(files_list: list[Path]) -> bool:
-    """Check if a list of file paths has a FASTA file."""
-    for doc in files_list:
-        if has_fasta_extension(str(doc)):
-            return True
-    return False
-
 def check_command_line_arguments(args) -> None:
     species_options = SpeciesOptions()
     if args.command == 'list_sp':
         species_options.print_species_options()
         sys.exit(0)
-    if not Path(args.input).exists():
-        sys.exit(f'Error: {args.input} does not exist.')
-    if Path(args.input).is_file() and not has_fasta_extension(args.input):
-        sys.exit(f'Error: {args.input} is not FASTA file.')
-    if Path(args.input).is_dir():
-        # check if folder has fasta files.
-        ls_fasta = mk_list_fasta_files(Path(args.input))
-        if not list_has_fasta_files(ls_fasta):
-            sys.exit(f'Error: {args.input} does not have any FASTA file.')
+    if args.command == 'db':
+        check_db_arguments(args, species_options)
+        return
+    if args.command == 'cluster':
+        if not Path(args.input).is_file():
+            sys.exit(f'Error: {args.input} does not exist.')
+        if not Path(args.outdir).is_dir():
+            sys.exit(f'Error: {args.outdir} is not a directory.')
+        if args.threshold < 0:
+            sys.exit('Error: --threshold must be at least 0.')
+        if args.chunk_size < 1:
+            sys.exit('Error: --chunk_size must be at least 1.')
+        if args.database and not Path(args.database, 'config').is_file():
+            sys.exit(f'Error: {args.database} is not an MLST database.')
+        return
+    if args.command == 'novel':
+        if not Path(args.registry).is_file():
+            sys.exit(f'Error: {args.registry} does not exist.')
+        return
+    if args.command == 'merge':
+        for path in args.input:
+            if not Path(path).exists():
+                sys.exit(f'Error: {path} does not exist.')
+        if args.output and not Path(args.output).parent.is_dir():
+            sys.exit(f'Error: the folder of {args.output} does not exist.')
+        return
+    if args.command == 'watch':
+        if len(args.input) != 1 or not Path(args.input[0]).is_dir():
+            sys.exit('Error: `mlst watch` needs the path to one folder.')
+        if args.interval <= 0 or args.settle < 0:
+            sys.exit('Error: --interval must be positive and --settle >= 0.')
+        if args.shard:
+            sys.exit('Error: --shard can only be used with `mlst run`.')
+    for infile in args.input:
+        if not Path(infile).exists():
+            sys.exit(f'Error: {infile} does not exist.')
+    if len(args.input) > 2:
+        sys.exit('Error: provide only one path or two paired FASTQ files.')
+    if len(args.input) == 2 and not all(
+        Path(infile).is_file() and has_fastq_extension(infile)
+        for infile in args.input
+    ):
+        sys.exit('Error: only paired FASTQ files can be given together.')
+    infile = args.input[0]
+    if Path(infile).is_file() and not (
+        has_fasta_extension(infile) or has_fastq_extension(infile) or
+        has_samplesheet_extension(infile)
+    ):
+        sys.exit(f'Error: {infile} is not FASTA, FASTQ or samplesheet file.')
+    if Path(infile).is_dir() and args.command == 'run':
+        # Check if folder has fasta (or fastq) files. Only the file names are
+        # checked; the walk stops at the first file found.
+        fastas = iter_fasta_paths(Path(infile), args.recursive, args.glob)
+        fastqs = iter_fastq_paths(Path(infile), args.recursive, args.glob)
+        if next(fastas, None) is None and next(fastqs, None) is None:
+            sys.exit(f'Error: {infile} does not have any FASTA or FASTQ file.')
+    if args.jobs < 1:
+        sys.exit('Error: --jobs must be at least 1.')
+    if args.row_group_size < 1:
+        sys.exit('Error: --row_group_size must be at least 1.')
+    if args.scratch_dir and not Path(args.scratch_dir).is_dir():
+        sys.exit(f'Error: {args.scratch_dir} is not a directory.')
+    if args.shm_min_free < 0:
+        sys.exit('Error: --shm_min_free must be at least 0.')
+    if args.scratch_max < 0:
+        sys.exit('Error: --scratch_max must be at least 0.')
+    if args.shard:
+        try:
+            args.shard = parse_shard(args.shard)
+        except ValueError as error:
+            sys.exit(f'Error: {error}')
     if not Path(args.outdir).exists():
         sys.exit(f'Error: {args.outdir} does not exist.')
     if not Path(args.outdir).is_dir():
@@ -141,60 +677,195 @@ def check_command_line_arguments(args) -> None:
         sys.exit(f'Error: {args.method_path} does not exist.')
     if args.method_path and not Path(args.method_path).is_file():
         sys.exit(f'Error: {args.method_path} is not a file.')
-    if not species_options.is_species_valid(args.species):
-        sys.exit(f'Error: {args.species} is not a valid species option.')
-
-def is_single_fasta_file(infile: Path) -> bool:
-    """Check if fasta file has only one fasta sequence."""
-    with open(infile, 'r') as f:
-        counter = 0
-        for line in f:
-            if '>' in line:
-                counter += 1
-            if counter == 2:
-                return False
-    return True
-
-def extract_sequence_type_from_json(infile: Path) -> str:
-    """Get the sequence type from the json file generated by mlst.py"""
-    with open(infile, 'r') as f:
-        data = json.load(f)
-    st = data["mlst_cge"]["results"]["sequence_type"]
-    return st
-
-def run_mlstyper_single_fasta(input_mlstyper: InputMlstyper) -> None:
+    if args.all_schemes_for:
+        schemes = species_options.get_schemes(args.all_schemes_for)
+        if not schemes:
+            sys.exit(f'Error: {args.all_schemes_for} is not a valid organism.')
+        args.species = ','.join(schemes)
+    if args.species == 'auto':
+        if is_reads_input(
+            [Path(path) for path in args.input], args.recursive, args.glob
+        ):
+            sys.exit('Error: `--species auto` works only with FASTA files.')
+        return
+    for species in args.species.split(','):
+        if not species_options.is_species_valid(species):
+            sys.exit(f'Error: {species} is not a valid species option.')
+
+def check_db_arguments(args, species_options: SpeciesOptions) -> None:
+    if args.database and not Path(args.database, 'config').is_file():
+        sys.exit(f'Error: {args.database} is not an MLST database.')
+    if args.jobs < 1:
+        sys.exit('Error: --jobs must be at least 1.')
+    # Schemes of a custom database are checked against its own config file.
+    for species in getattr(args, 'species', None) or []:
+        if not args.database and not species_options.is_species_valid(species):
+            sys.exit(f'Error: {species} is not a valid species option.')
+
+def run_db_validate(args, database: Path) -> None:
+    findings = validate_database(
+        database, schemes=args.species, jobs=args.jobs,
+        use_cache=not args.no_cache
+    )
+    for finding in findings:
+        if args.format == 'json':
+            print(json.dumps(finding.to_dict()))
+        else:
+            print(finding)
+    errors = sum(finding.level == 'error' for finding in findings)
+    if args.format == 'text':
+        print(
+            f'{errors} error(s) and {len(findings) - errors} warning(s).',
+            file=sys.stderr
+        )
+    if errors:
+        sys.exit(1)
+
+def run_db_command(args, mlst_db: Path) -> None:
+    database = Path(args.database) if args.database else mlst_db
+    if args.db_command == 'validate':
+        run_db_validate(args, database)
+        return
+    options = dict(
+        indexes=args.indexes,
+        jobs=args.jobs,
+        force=args.force,
+        kma_index=args.kma_index,
+        makeblastdb=args.makeblastdb
+    )
+    if args.db_command == 'build':
+        statuses = build_database(database, schemes=args.species, **options)
+    else:
+        statuses = update_database(
+            database, pull=not args.no_pull, since=args.since, **options
+        )
+    failed = [
+        scheme for scheme, status in statuses.items() if status == 'failed'
+    ]
+    built = sum(status == 'built' for status in statuses.values())
+    print(
+        f'Done! {built} scheme(s) indexed, ' +
+        f'{len(statuses) - built - len(failed)} up to date.'
+    )
+    if failed:
+        sys.exit(f'Error: indexing failed for: {", ".join(sorted(failed))}')
+
+def run_cluster(args, mlst_db: Path) -> None:
+    database = Path(args.database) if args.database else mlst_db
+    scheme = args.species
+    if scheme is None:
+        name = Path(args.input).stem
+        if name.startswith('profiles_'):
+            scheme = name[len('profiles_'):]
+    # Clonal complexes are optional; not every scheme has them.
+    clonal_complexes = {}
+    if scheme and (database / scheme / f'{scheme}.tsv').is_file():
+        clonal_complexes = read_clonal_complexes(database, scheme)
+    try:
+        n_clusters = cluster_profiles(
+            Path(args.input), Path(args.outdir), args.threshold,
+            clonal_complexes, args.matrix, args.chunk_size
+        )
+    except (KeyError, ValueError) as error:
+        sys.exit(f'Error: {args.input} is not a profile file ({error}).')
+    print(f'Done! {n_clusters} cluster(s).\nYour results are in: {args.outdir}')
+
+def run_merge(args) -> None:
+    try:
+        shard_files = find_shard_files([Path(path) for path in args.input])
+        output = Path(args.output) if args.output else None
+        counter = merge_results(shard_files, output)
+    except ValueError as error:
+        sys.exit(f'Error: {error}')
+    output = output or shard_files[0].parent / 'results.csv'
+    print(
+        f'Done! {counter} row(s) from {len(shard_files)} shard(s).\n' +
+        f'Your results are in: {output}'
+    )
+
+def run_novel_export(args) -> None:
+    with NovelAlleleRegistry(args.registry) as registry:
+        counter = registry.export_fasta(Path(args.output), args.species)
+    print(f'Done! {counter} novel allele(s) saved in: {args.output}')
+
+def type_genome(input_mlstyper: InputMlstyper) -> dict[str, dict]:
+    """Run mlst with input_mlstyper.infile and return the results by scheme.
+
+    If a sketch index is set in input_mlstyper, the schemes of the genome are
+    detected first; the results are empty if no scheme was found.
+    """
+    if input_mlstyper.sketch_index is not None:
+        schemes = detect_schemes(
+            input_mlstyper.sketch_index, Path(input_mlstyper.infile[0])
+        )
+        if not schemes:
+            return {}
+        input_mlstyper = input_mlstyper.replace(species=','.join(schemes))
+    return results_by_scheme(mlstyper(input_mlstyper))
+
+def result_rows(
+        input_mlstyper: InputMlstyper, record_id: str, results: dict[str, dict]
+) -> list[dict]:
+    """Make the rows of results.csv of a genome.
+
+    With a sketch index there is one row per detected scheme.
+    """
+    if input_mlstyper.sketch_index is None:
+        return [{'id': record_id, **sequence_types(results)}]
+    if not results:
+        return [{
+            'id': record_id, 'scheme': '', 'sequence_type': 'No scheme found'
+        }]
+    return [
+        {
+            'id': record_id, 'scheme': scheme,
+            'sequence_type': scheme_results['sequence_type']
+        }
+        for scheme, scheme_results in results.items()
+    ]
+
+def type_fasta(input_mlstyper: InputMlstyper, record_id: str) -> list[dict]:
+    """Run mlst with input_mlstyper.infile and return the rows of results.csv.
+
+    The allele profiles are saved if a profile writer is set.
+    """
+    results = type_genome(input_mlstyper)
+    if input_mlstyper.profile_writer is not None and results:
+        input_mlstyper.profile_writer.write(record_id, results)
+    return result_rows(input_mlstyper, record_id, results)
+
+def run_mlstyper_single_fasta(
+        input_mlstyper: InputMlstyper, record_id: str
+) -> None:
     """Run mlst with single fasta sequence."""
-    # Get record id.
-    record = SeqIO.read(input_mlstyper.infile, 'fasta')
-    record_id = record.id
-    # Change the path to infile in the input_mlstyper class. The path is
-    # provided as a list because this is how the mlst script from cge works
-    input_mlstyper.infile = [str(input_mlstyper.infile)]
-    # Run mlst.
-    mlstyper(input_mlstyper)
-    # Get st from data.json.
-    st = extract_sequence_type_from_json(input_mlstyper.tmp_dir / "data.json")
+    # Run mlst. The path is provided as a list because this is how the mlst
+    # script from cge works. Other shards only write the headers.
+    rows = []
+    if input_mlstyper.in_shard(record_id):
+        rows = type_fasta(
+            input_mlstyper.replace(infile=[str(input_mlstyper.infile)]),
+            record_id
+        )
     # Headers for results.csv
-    fieldnames = ['id', 'sequence_type']
+    fieldnames = input_mlstyper.csv_fieldnames
     # Open and close results file to remove any existing file with same name.
-    open(input_mlstyper.outdir_mlst_runner / 'results.csv', 'w').close()
+    open(input_mlstyper.results_file, 'w').close()
     # Make csv file with results.
-    with open(input_mlstyper.outdir_mlst_runner / 'results.csv', 'w') as f:
+    with open(input_mlstyper.results_file, 'w') as f:
         writer = csv.DictWriter(f, fieldnames=fieldnames)
         writer.writeheader()
-        writer.writerow({'id': record_id, 'sequence_type': st})
-    # Delete everything in the tmp folder.
-    folder_path = input_mlstyper.tmp_dir / '*'
-    subprocess.run(f'rm -rf {folder_path}', shell=True)
+        writer.writerows(rows)
+    # Delete everything in the scratch folder.
+    clear_dir(input_mlstyper.tmp_dir)
 
 def run_mlstyper_multiple_fasta(input_mlstyper: InputMlstyper) -> None:
     """Run mlst with a file with multiple fasta sequences."""
     # Save path to infile.
     path_infile = input_mlstyper.infile
     # Open and close results file to remove any existing file with same name.
-    open(input_mlstyper.outdir_mlst_runner / 'results.csv', 'w').close()
+    open(input_mlstyper.results_file, 'w').close()
     # open results.csv to save results.
-    output = open(input_mlstyper.outdir_mlst_runner / 'results.csv', 'a')
+    output = open(input_mlstyper.results_file, 'a')
     # Make a DictWriter object to facilitate saving results.
     writer = csv.DictWriter(output, fieldnames=input_mlstyper.csv_fieldnames)
     writer.writeheader()
@@ -202,92 +873,268 @@ def run_mlstyper_multiple_fasta(input_mlstyper: InputMlstyper) -> None:
     for sequence in SeqIO.parse(path_infile, 'fasta'):
         # Get record id.
         record_id = sequence.id
+        if not input_mlstyper.in_shard(record_id):
+            continue
         # Path to save the sequence to analyze
         path_sequence = input_mlstyper.tmp_dir / 'sequence.fasta'
         # Write sequence.fasta to analyze
         SeqIO.write(sequence, path_sequence, 'fasta')
-        # Change the path to infile in the input_mlstyper class. The path is
-        # provided as a list because this is how the mlst script from cge works
-        input_mlstyper.infile = [str(path_sequence)]
-        # Run mlst.
-        mlstyper(input_mlstyper)
-        # Get st from data.json
-        st = extract_sequence_type_from_json(
-            input_mlstyper.tmp_dir / 'data.json'
-        )
-        writer.writerow({'id': record_id, 'sequence_type': st})
-        # Emtpy the tmp folder for the next analysis.
-        folder_path = input_mlstyper.tmp_dir / '*'
-        subprocess.run(f'rm {folder_path}', shell=True)
+        # Run mlst. The path is provided as a list because this is how the
+        # mlst script from cge works
+        writer.writerows(type_fasta(
+            input_mlstyper.replace(infile=[str(path_sequence)]), record_id
+        ))
+        # Emtpy the scratch folder for the next analysis.
+        clear_dir(input_mlstyper.tmp_dir)
     # Close results.csv
     output.close()
 
 def run_mlstyper_list_fasta(input_mlstyper: InputMlstyper) -> None:
     """Run mlst with a list of FASTA files.
 
-    FASTA files with more than one sequence are ignored.
+    FASTA files with more than one sequence are ignored, unless assemblies is
+    set in input_mlstyper. In that case, all the contigs of a file are typed
+    together as one genome and the path of the file in the folder, without
+    the extension, is used as id, so files with the same name in different
+    subfolders don't get the same id.
     """
     # Save path to directory with FASTA files.
     path_dir = input_mlstyper.infile
     # Open and close results file to remove any existing file with same name.
-    open(input_mlstyper.outdir_mlst_runner / 'results.csv', 'w').close()
+    open(input_mlstyper.results_file, 'w').close()
     # Open file to save results.
-    output = open(input_mlstyper.outdir_mlst_runner / 'results.csv', 'a')
+    output = open(input_mlstyper.results_file, 'a')
     # Make a DictWriter object to facilitate saving results.
     writer = csv.DictWriter(output, fieldnames=input_mlstyper.csv_fieldnames)
     writer.writeheader()
-    # Iterate over fasta file paths to perform mlst.
-    for fasta in mk_list_fasta_files(path_dir):
-        if not is_single_fasta_file(fasta):
+    # Iterate over fasta files as they are found to perform mlst. Files are
+    # split in shards by their path, so the files of other shards are not
+    # read.
+    for fasta in iter_fasta_paths(
+        path_dir, input_mlstyper.recursive, input_mlstyper.patterns
+    ):
+        if not input_mlstyper.in_shard(
+            fasta.relative_to(path_dir).as_posix()
+        ):
             continue
-        # Get record id.
-        record_id = SeqIO.read(fasta, 'fasta').id
-        # Change the path to infile in the input_mlstyper class. The path is
-        # provided as a list because this is how the mlst script from cge works
-        input_mlstyper.infile = [str(fasta)]
-        # Run mlst.
-        mlstyper(input_mlstyper)
-        # Get st from data.json
-        st = extract_sequence_type_from_json(
-            input_mlstyper.tmp_dir / 'data.json'
-        )
-        writer.writerow({'id': record_id, 'sequence_type': st})
-        # Empty the tmp folder for the next analysis.
-        folder_path = input_mlstyper.tmp_dir / '*'
-        subprocess.run(f'rm {folder_path}', shell=True)
+        record_id, counter = fasta_summary(fasta)
+        if input_mlstyper.assemblies and counter > 0:
+            record_id = file_genome_id(fasta, path_dir)
+        elif counter != 1:
+            continue
+        # Run mlst. The path is provided as a list because this is how the
+        # mlst script from cge works
+        writer.writerows(type_fasta(
+            input_mlstyper.replace(infile=[str(fasta)]), record_id
+        ))
+        # Empty the scratch folder for the next analysis.
+        clear_dir(input_mlstyper.tmp_dir)
     # Close output file.
     output.close()
 
+def type_watched_fasta(input_mlstyper: InputMlstyper) -> dict[str, dict]:
+    """Type one FASTA file in a worker process and return its results.
+
+    Every worker process reuses its own scratch folder, which is on disk if
+    the one in RAM is full.
+    """
+    scratch = input_mlstyper.scratch.worker_dir()
+    try:
+        return type_genome(
+            input_mlstyper.replace(tmp_dir=scratch, outdir_mlstyper=scratch)
+        )
+    finally:
+        clear_dir(scratch)
+
+def read_typed_ids(results_file: Path) -> set[str]:
+    """Get the ids already in results.csv, to resume a watch."""
+    if not results_file.is_file():
+        return set()
+    with open(results_file, newline='') as f:
+        return {row['id'] for row in csv.DictReader(f) if row.get('id')}
+
+def run_mlstyper_watch(input_mlstyper: InputMlstyper, args) -> None:
+    """Type the FASTA files of a folder as they are written.
+
+    Files are typed by `jobs` worker processes. At most two files per worker
+    are queued in the pool, so stable files wait as paths and the results
+    are written as soon as each file is typed. The workers ignore Ctrl-C:
+    it stops the watch, and the files being typed are finished first.
+    """
+    results_file = input_mlstyper.results_file
+    typed_ids = read_typed_ids(results_file)
+    queue_size = 2 * input_mlstyper.jobs
+    waiting = deque()
+    running = {}
+    new_file = not results_file.is_file() or results_file.stat().st_size == 0
+    with (
+        open(results_file, 'a', newline='') as output,
+        ProcessPoolExecutor(
+            max_workers=input_mlstyper.jobs, initializer=ignore_sigint
+        ) as executor
+    ):
+        writer = csv.DictWriter(
+            output, fieldnames=input_mlstyper.csv_fieldnames
+        )
+        if new_file:
+            writer.writeheader()
+
+        def write_finished(block: bool) -> None:
+            if not running:
+                return
+            done, _ = wait(
+                running, timeout=None if block else 0,
+                return_when=FIRST_COMPLETED
+            )
+            for future in done:
+                record_id = running.pop(future)
+                try:
+                    results = future.result()
+                except BaseException as error:
+                    # A bad file must not stop the watch, or drop the other
+                    # files that are done; it is retried when the watch is
+                    # started again.
+                    print(
+                        f'Error typing {record_id}: {error!r}',
+                        file=sys.stderr
+                    )
+                    continue
+                writer.writerows(
+                    result_rows(input_mlstyper, record_id, results)
+                )
+                if input_mlstyper.profile_writer is not None and results:
+                    input_mlstyper.profile_writer.write(record_id, results)
+                typed_ids.add(record_id)
+                print(f'Typed {record_id}')
+            output.flush()
+
+        def submit_waiting() -> None:
+            while waiting and len(running) < queue_size:
+                fasta = waiting.popleft()
+                file_input = input_mlstyper.replace(
+                    infile=[str(fasta)], profile_writer=None
+                )
+                running[executor.submit(type_watched_fasta, file_input)] = (
+                    file_genome_id(fasta, input_mlstyper.infile)
+                )
+
+        try:
+            for stable in watch_fasta_files(
+                input_mlstyper.infile, args.recursive, args.glob,
+                args.interval, args.settle, args.idle_exit, args.polling
+            ):
+                for fasta in stable:
+                    record_id = file_genome_id(fasta, input_mlstyper.infile)
+                    if record_id not in typed_ids:
+                        waiting.append(fasta)
+                write_finished(block=False)
+                submit_waiting()
+        except KeyboardInterrupt:
+            waiting.clear()
+            print('Stopping.')
+        # Type what is left.
+        while running or waiting:
+            submit_waiting()
+            write_finished(block=True)
+
 
 def get_sequence_types() -> None:
     # Get path to mlst database
     mlst_package = resources.files(mlst)
     mlst_db = mlst_package / 'mlst_db'
-    # Get path to tmp directory
-    path_tmp_dir = mlst_package / 'tmp'
     # Get user input
     args = parse_command_line()
+    if args.command == 'db':
+        run_db_command(args, mlst_db)
+        return
+    if args.command == 'cluster':
+        run_cluster(args, mlst_db)
+        return
+    if args.command == 'novel':
+        run_novel_export(args)
+        return
+    if args.command == 'merge':
+        run_merge(args)
+        return
     # Path to fasta file
-    infile = Path(args.input)
+    infile = Path(args.input[0])
+    # Scratch folder of this run; it is made and removed below.
+    scratch = ScratchSpace(
+        args.scratch_dir, args.shm_min_free, handle_sigterm=True,
+        max_size=args.scratch_max
+    )
     # Initialize InputMlstyper
     input_mlstyper = InputMlstyper(
-        infile=Path(args.input),
+        infile=infile,
         species=args.species,
         database=mlst_db,
-        tmp_dir=path_tmp_dir,
+        tmp_dir=scratch.path,
         method_path=args.method_path,
-        outdir_mlstyper=path_tmp_dir,
+        outdir_mlstyper=scratch.path,
         outdir_mlst_runner=Path(args.outdir),
         extented_output=False,
-        quiet=True
+        quiet=True,
+        recursive=args.recursive,
+        patterns=args.glob,
+        assemblies=args.assemblies,
+        jobs=args.jobs,
+        novel_registry=args.novel_registry,
+        two_stage=args.two_stage,
+        shard=args.shard,
+        scratch=scratch
     )
+    # Report one column per scheme when typing several schemes.
+    schemes = args.species.split(',')
+    if args.species == 'auto':
+        # The sketch index is built the first time and then read from cache.
+        input_mlstyper.sketch_index = load_sketch_index(mlst_db)
+        input_mlstyper.csv_fieldnames = ['id', 'scheme', 'sequence_type']
+    elif len(schemes) > 1:
+        input_mlstyper.csv_fieldnames = ['id'] + schemes
 
-    if input_mlstyper.infile.is_file() and is_single_fasta_file(infile):
-        run_mlstyper_single_fasta(input_mlstyper)
-    elif input_mlstyper.infile.is_file() and not is_single_fasta_file(infile):
-        run_mlstyper_multiple_fasta(input_mlstyper)
-    elif input_mlstyper.infile.is_dir():
-        run_mlstyper_list_fasta(input_mlstyper)
+    # The profile files are closed, and their last row groups written, when
+    # all the genomes were typed. The scratch folder is removed even if the
+    # run fails; typing errors end the run with their message.
+    try:
+        with ExitStack() as stack:
+            stack.enter_context(scratch)
+            if args.profiles:
+                input_mlstyper.profile_writer = stack.enter_context(
+                    ProfileWriter(
+                        args.outdir, args.profiles, mlst_db,
+                        args.row_group_size,
+                        args.shard.suffix if args.shard else ''
+                    )
+                )
+            paths = [Path(path) for path in args.input]
+            if args.command == 'watch':
+                run_mlstyper_watch(input_mlstyper, args)
+            elif is_reads_input(paths, args.recursive, args.glob):
+                samples = [
+                    sample for sample in collect_read_samples(
+                        paths, args.recursive, args.glob
+                    )
+                    if input_mlstyper.in_shard(sample.name)
+                ]
+                run_mlstyper_reads(input_mlstyper, samples)
+            elif input_mlstyper.infile.is_dir():
+                run_mlstyper_list_fasta(input_mlstyper)
+            elif input_mlstyper.assemblies:
+                # All the contigs go to blastn at once; one ST for the whole
+                # file.
+                run_mlstyper_single_fasta(input_mlstyper, infile.stem)
+            else:
+                # Get record id and number of records in one pass.
+                record_id, counter = fasta_summary(infile)
+                if counter == 1:
+                    run_mlstyper_single_fasta(input_mlstyper, record_id)
+                else:
+                    run_mlstyper_multiple_fasta(input_mlstyper)
+    except MlstError as error:
+        sys.exit(f'Error: {error}')
+    # Shards are sorted by id for `mlst merge`.
+    if args.shard:
+        sort_results(input_mlstyper.results_file)
     print(f'Done!\nYour results are in: {args.outdir}')
 
 if __name__ == "__main__":
@@ -0,0 +1,178 @@
+"""Scratch space of a run of mlst.
+
+Every run gets a folder of its own, so runs at the same time never share
+temporary files and read-only installs work. The folder is in `$TMPDIR` if
+it is set; otherwise in `/dev/shm`, i.e. in RAM, if it has at least
+SHM_MIN_FREE MiB free, and in the system temporary folder if it hasn't.
+Worker processes reuse one subfolder each, which is emptied after every
+genome, and the whole folder is removed when the run ends.
+
+A folder in RAM is capped: before every genome, the worker processes of
+reads and `mlst watch` check the space the folder uses and the free space
+of `/dev/shm`. If the folder has reached
+SCRATCH_MAX MiB, or `/dev/shm` has less than SHM_MIN_FREE MiB free, the
+genome is typed in a second folder on disk instead. The workers check at
+the same time, so the folder can pass the cap by the files of one genome
+per worker.
+"""
+from pathlib import Path
+from typing import Union
+import secrets
+import shutil
+import signal
+import tempfile
+import threading
+import os
+
+SCRATCH_PREFIX = 'labscripts_mlst_'
+# Free space (MiB) /dev/shm must have to be used.
+SHM_MIN_FREE = 1024
+# Space (MiB) the scratch folder may use in /dev/shm.
+SCRATCH_MAX = 4096
+RAM_DIR = Path('/dev/shm')
+# Folder on disk used if the system temporary folder is in RAM.
+DISK_DIR = Path('/var/tmp')
+
+
+def free_space(directory: Path) -> int:
+    """Get the free space of the file system of directory in MiB."""
+    return shutil.disk_usage(directory).free // 2**20
+
+def folder_size(directory: Path) -> int:
+    """Get the space used by the files of directory in MiB."""
+    size = 0
+    folders = [directory]
+    while folders:
+        try:
+            entries = list(os.scandir(folders.pop()))
+        except FileNotFoundError:
+            continue
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    folders.append(entry.path)
+                else:
+                    size += entry.stat(follow_symlinks=False).st_size
+            except FileNotFoundError:
+                # Removed by a worker in the meantime.
+                pass
+    return size // 2**20
+
+def is_in_ram(directory: Path) -> bool:
+    """Check if directory is in /dev/shm."""
+    directory = Path(directory).resolve()
+    ram_dir = RAM_DIR.resolve()
+    return directory == ram_dir or ram_dir in directory.parents
+
+def disk_scratch_root() -> Path:
+    """Pick the folder on disk for the genomes that don't fit in RAM."""
+    root = Path(tempfile.gettempdir())
+    if is_in_ram(root):
+        return DISK_DIR
+    return root
+
+def default_scratch_root(shm_min_free: int = SHM_MIN_FREE) -> Path:
+    """Pick the folder to make the scratch folder of a run in."""
+    if os.environ.get('TMPDIR'):
+        return Path(tempfile.gettempdir())
+    if (
+        RAM_DIR.is_dir() and os.access(RAM_DIR, os.W_OK | os.X_OK) and
+        free_space(RAM_DIR) >= shm_min_free
+    ):
+        return RAM_DIR
+    return Path(tempfile.gettempdir())
+
+def clear_dir(directory: Path) -> None:
+    """Remove everything in directory, but not directory itself."""
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                shutil.rmtree(entry.path, ignore_errors=True)
+            else:
+                os.unlink(entry.path)
+
+def worker_dir(scratch: Path) -> Path:
+    """Get the subfolder of scratch of the current worker process."""
+    directory = Path(scratch) / f'worker_{os.getpid()}'
+    directory.mkdir(exist_ok=True)
+    return directory
+
+
+class ScratchSpace:
+    """Class to make the scratch folder of a run and remove it at the end.
+
+    The path is known when the object is made, but the folder is only made
+    when the context is entered. If path is in RAM, max_size (MiB) caps it
+    and spill is the folder on disk used once it is reached; spill is made
+    when first used. Objects are sent to the workers, which get their
+    subfolder with worker_dir. With handle_sigterm, a SIGTERM also removes
+    the folder: it is turned into SystemExit while the context lasts. Only
+    the command line sets it; a library must leave signals to its caller.
+    """
+    def __init__(
+            self,
+            root: Union[Path, str, None] = None,
+            shm_min_free: int = SHM_MIN_FREE,
+            handle_sigterm: bool = False,
+            max_size: int = SCRATCH_MAX
+    ):
+        root = Path(root) if root else default_scratch_root(shm_min_free)
+        name = f'{SCRATCH_PREFIX}{os.getpid()}_{secrets.token_hex(4)}'
+        self.path = root / name
+        self.shm_min_free = shm_min_free
+        self.max_size = max_size
+        self.spill = None
+        if is_in_ram(root):
+            self.spill = disk_scratch_root() / name
+        self.handle_sigterm = handle_sigterm
+        self.previous_handler = None
+
+    def __getstate__(self) -> dict:
+        # Signal handlers are not sent to the workers.
+        state = self.__dict__.copy()
+        state['previous_handler'] = None
+        return state
+
+    def is_full(self) -> bool:
+        """Check if the next genome must be typed in spill."""
+        if self.spill is None:
+            return False
+        return (
+            folder_size(self.path) >= self.max_size or
+            free_space(RAM_DIR) < self.shm_min_free
+        )
+
+    def worker_dir(self) -> Path:
+        """Get the subfolder of the current worker for its next genome.
+
+        It is in spill if path is full. The subfolder must be emptied after
+        the genome, as with the module function worker_dir.
+        """
+        if self.is_full():
+            self.spill.mkdir(mode=0o700, parents=True, exist_ok=True)
+            return worker_dir(self.spill)
+        return worker_dir(self.path)
+
+    def __enter__(self) -> Path:
+        self.path.mkdir(mode=0o700, parents=True)
+        # Signal handlers can only be set from the main thread.
+        if (
+            self.handle_sigterm and
+            threading.current_thread() is threading.main_thread()
+        ):
+            self.previous_handler = signal.signal(
+                signal.SIGTERM, raise_system_exit
+            )
+        return self.path
+
+    def __exit__(self, *exc_info) -> None:
+        if self.previous_handler is not None:
+            signal.signal(signal.SIGTERM, self.previous_handler)
+        shutil.rmtree(self.path, ignore_errors=True)
+        if self.spill is not None:
+            shutil.rmtree(self.spill, ignore_errors=True)
+
+
+def raise_system_exit(signum, frame) -> None:
+    """Turn SIGTERM into SystemExit so that `finally` blocks are run."""
+    raise SystemExit(128 + signum)
@@ -0,0 +1,282 @@
+"""Detect the MLST scheme(s) of a genome with a k-mer screen.
+
+The alleles in `mlst_db/alleles` of every scheme of the config file are
+reduced to a sketch: the canonical k-mers whose hash falls below
+`2**64 / scaled` (FracMinHash). A genome is sketched in the same way and
+scored against every scheme at once with vectorized set lookups. The index
+is built once and cached on disk.
+"""
+from pathlib import Path
+from typing import Iterator, Union
+import hashlib
+import os
+
+import numpy as np
+
+from labscripts.mlst.mlst_database import read_config
+from labscripts.mlst.mlst_utils import SpeciesOptions
+
+# Default k-mer size and sampling fraction (1 / scaled) of the sketches.
+KMER_SIZE = 21
+SCALED = 20
+# Minimum fraction of the expected scheme k-mers found in a genome.
+MIN_SCORE = 0.5
+# Bump it when the layout of the cached index changes.
+SKETCH_VERSION = 1
+
+# Two-bit codes of the nucleotides; anything else is 4 and breaks k-mers.
+_ENCODE = np.full(256, 4, dtype=np.uint64)
+for _code, _bases in enumerate([b'Aa', b'Cc', b'Gg', b'Tt']):
+    for _base in _bases:
+        _ENCODE[_base] = _code
+
+
+class SketchIndex:
+    """Class to store the k-mer sketches of all the MLST schemes."""
+    def __init__(
+            self,
+            schemes: np.ndarray,
+            hashes: np.ndarray,
+            sizes: np.ndarray,
+            expected: np.ndarray,
+            kmer_size: int = KMER_SIZE,
+            scaled: int = SCALED,
+            fingerprint: str = ''
+    ):
+        self.schemes = schemes
+        # Sorted hashes of every scheme, one scheme after the other.
+        self.hashes = hashes
+        # Number of hashes per scheme.
+        self.sizes = sizes
+        # Number of k-mers expected in a genome carrying all the loci of a
+        # scheme, i.e. the sum of the median allele length of each locus.
+        self.expected = expected
+        self.kmer_size = kmer_size
+        self.scaled = scaled
+        # Fingerprint of the allele files used to build the index.
+        self.fingerprint = fingerprint
+        # Scheme index of every hash, to count shared hashes per scheme.
+        self.owners = np.repeat(np.arange(len(sizes)), sizes)
+
+    @property
+    def max_hash(self) -> np.uint64:
+        return np.uint64((2**64 - 1) // self.scaled)
+
+    def save(self, path: Path) -> None:
+        """Save the index as a `.npz` file."""
+        with open(path, 'wb') as f:
+            np.savez(
+                f, schemes=self.schemes, hashes=self.hashes,
+                sizes=self.sizes, expected=self.expected,
+                params=np.array([self.kmer_size, self.scaled, SKETCH_VERSION]),
+                fingerprint=np.array(self.fingerprint)
+            )
+
+    @classmethod
+    def load(cls, path: Path) -> 'SketchIndex':
+        """Load an index saved with `save`."""
+        with np.load(path) as data:
+            kmer_size, scaled, version = data['params'].tolist()
+            if version != SKETCH_VERSION:
+                raise ValueError(f'{path} has an old sketch layout.')
+            return cls(
+                schemes=data['schemes'], hashes=data['hashes'],
+                sizes=data['sizes'], expected=data['expected'],
+                kmer_size=kmer_size, scaled=scaled,
+                fingerprint=str(data['fingerprint'])
+            )
+
+
+def read_fasta_sequences(infile: Path) -> Iterator[bytes]:
+    """Yield the sequences of a FASTA file as bytes, without parsing them."""
+    chunks = []
+    with open(infile, 'rb') as f:
+        for line in f:
+            if line.startswith(b'>'):
+                if chunks:
+                    yield b''.join(chunks)
+                chunks = []
+            else:
+                chunks.append(line.strip())
+    if chunks:
+        yield b''.join(chunks)
+
+def mix_hash(kmers: np.ndarray) -> np.ndarray:
+    """Hash 64-bit k-mer codes with the splitmix64 finalizer."""
+    kmers = kmers ^ (kmers >> np.uint64(30))
+    kmers = kmers * np.uint64(0xbf58476d1ce4e5b9)
+    kmers = kmers ^ (kmers >> np.uint64(27))
+    kmers = kmers * np.uint64(0x94d049bb133111eb)
+    return kmers ^ (kmers >> np.uint64(31))
+
+def sequence_hashes(
+        sequence: bytes, kmer_size: int, max_hash: np.uint64
+) -> np.ndarray:
+    """Get the hashes of the canonical k-mers of sequence below max_hash.
+
+    K-mers are built with one vector operation per position of the k-mer, so
+    the cost does not depend on Python loops over the sequence.
+    """
+    codes = _ENCODE[np.frombuffer(sequence, dtype=np.uint8)]
+    n_kmers = len(codes) - kmer_size + 1
+    if n_kmers <= 0:
+        return np.empty(0, dtype=np.uint64)
+    forward = np.zeros(n_kmers, dtype=np.uint64)
+    reverse = np.zeros(n_kmers, dtype=np.uint64)
+    for i in range(kmer_size):
+        window = codes[i:i + n_kmers]
+        forward = (forward << np.uint64(2)) | (window & np.uint64(3))
+        reverse |= (np.uint64(3) - (window & np.uint64(3))) << np.uint64(2 * i)
+    # Drop the k-mers with ambiguous bases.
+    ambiguous = np.concatenate(([0], np.cumsum(codes == 4)))
+    valid = (ambiguous[kmer_size:] - ambiguous[:n_kmers]) == 0
+    hashes = mix_hash(np.minimum(forward, reverse))
+    return hashes[valid & (hashes <= max_hash)]
+
+def fasta_hashes(
+        infile: Path, kmer_size: int, max_hash: np.uint64
+) -> np.ndarray:
+    """Get the unique sketch hashes of all the sequences of a FASTA file."""
+    hashes = [
+        sequence_hashes(sequence, kmer_size, max_hash)
+        for sequence in read_fasta_sequences(infile)
+    ]
+    if not hashes:
+        return np.empty(0, dtype=np.uint64)
+    return np.unique(np.concatenate(hashes))
+
+def database_fingerprint(database: Path) -> str:
+    """Fingerprint the config file and the allele files of database.
+
+    Allele files are fingerprinted from their names, sizes and times.
+    """
+    alleles_dir = Path(database) / 'alleles'
+    digest = hashlib.sha1((Path(database) / 'config').read_bytes())
+    for allele_file in sorted(alleles_dir.glob('*/*.tfa')):
+        stat = allele_file.stat()
+        name = allele_file.relative_to(alleles_dir)
+        digest.update(f'{name}:{stat.st_size}:{stat.st_mtime_ns}\n'.encode())
+    return digest.hexdigest()
+
+def build_sketch_index(
+        database: Path, kmer_size: int = KMER_SIZE, scaled: int = SCALED
+) -> SketchIndex:
+    """Sketch the alleles of every scheme in `<database>/alleles`.
+
+    Only the schemes of the config file are sketched, as the others can't
+    be typed.
+    """
+    alleles_dir = Path(database) / 'alleles'
+    config_schemes = read_config(database)
+    max_hash = np.uint64((2**64 - 1) // scaled)
+    schemes = []
+    scheme_hashes = []
+    expected = []
+    for scheme_dir in sorted(alleles_dir.iterdir()):
+        if not scheme_dir.is_dir() or scheme_dir.name not in config_schemes:
+            continue
+        hashes = []
+        n_kmers = 0
+        for allele_file in sorted(scheme_dir.glob('*.tfa')):
+            sequences = list(read_fasta_sequences(allele_file))
+            if not sequences:
+                continue
+            # A genome carries one allele per locus.
+            lengths = [len(sequence) for sequence in sequences]
+            n_kmers += max(int(np.median(lengths)) - kmer_size + 1, 0)
+            hashes.extend(
+                sequence_hashes(sequence, kmer_size, max_hash)
+                for sequence in sequences
+            )
+        if not hashes:
+            continue
+        schemes.append(scheme_dir.name)
+        scheme_hashes.append(np.unique(np.concatenate(hashes)))
+        expected.append(n_kmers)
+    return SketchIndex(
+        schemes=np.array(schemes),
+        hashes=np.concatenate(scheme_hashes),
+        sizes=np.array([len(hashes) for hashes in scheme_hashes]),
+        expected=np.array(expected, dtype=float),
+        kmer_size=kmer_size,
+        scaled=scaled,
+        fingerprint=database_fingerprint(database)
+    )
+
+def default_cache_dir() -> Path:
+    """Folder to cache the sketch index, `$XDG_CACHE_HOME/labscripts`."""
+    cache_home = os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache'
+    return Path(cache_home) / 'labscripts'
+
+def load_sketch_index(
+        database: Path,
+        cache_dir: Union[Path, None] = None,
+        kmer_size: int = KMER_SIZE,
+        scaled: int = SCALED
+) -> SketchIndex:
+    """Load the cached sketch index of database, building it if needed.
+
+    The cache is rebuilt when the config file or the allele files change.
+    """
+    cache_dir = Path(cache_dir or default_cache_dir())
+    database_key = hashlib.sha1(
+        str(Path(database).resolve()).encode()
+    ).hexdigest()[:12]
+    cache_file = cache_dir / (
+        f'mlst_sketch_{database_key}_k{kmer_size}_s{scaled}.npz'
+    )
+    fingerprint = database_fingerprint(database)
+    if cache_file.exists():
+        try:
+            index = SketchIndex.load(cache_file)
+            if index.fingerprint == fingerprint:
+                return index
+        except (OSError, ValueError, KeyError):
+            pass
+    index = build_sketch_index(database, kmer_size, scaled)
+    # Write to a temporary name first so that readers never see half a file.
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    tmp_file = cache_file.with_suffix(f'.{os.getpid()}.tmp')
+    index.save(tmp_file)
+    os.replace(tmp_file, cache_file)
+    return index
+
+def screen_genome(index: SketchIndex, infile: Path) -> list[tuple[str, float]]:
+    """Score every scheme against a FASTA genome, best scheme first.
+
+    The score is the number of shared hashes divided by the number of hashes
+    expected if all the loci of the scheme were present.
+    """
+    genome = fasta_hashes(infile, index.kmer_size, index.max_hash)
+    shared = np.isin(index.hashes, genome)
+    counts = np.bincount(index.owners[shared], minlength=len(index.sizes))
+    expected = np.maximum(index.expected / index.scaled, 1)
+    scores = np.minimum(counts / expected, 1.0)
+    order = np.argsort(-scores, kind='stable')
+    return [(str(index.schemes[i]), float(scores[i])) for i in order]
+
+def detect_schemes(
+        index: SketchIndex, infile: Path, min_score: float = MIN_SCORE
+) -> list[str]:
+    """Pick the scheme(s) to type a FASTA genome with.
+
+    The best scheme is chosen together with the other schemes of the same
+    organism (e.g. `ecoli` and `ecoli_2`) that also pass min_score. An empty
+    list means that no scheme passed min_score.
+    """
+    scores = screen_genome(index, infile)
+    best_scheme, best_score = scores[0]
+    if best_score < min_score:
+        return []
+    scores = dict(scores)
+    species_options = SpeciesOptions()
+    organism_schemes = [best_scheme]
+    for value in species_options.species_options.values():
+        schemes = value.split(', ')
+        if best_scheme in schemes:
+            organism_schemes = schemes
+            break
+    return [
+        scheme for scheme in organism_schemes
+        if scores.get(scheme, 0) >= min_score
+    ]
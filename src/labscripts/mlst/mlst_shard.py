@@ -0,0 +1,159 @@
+"""Split the genomes of `mlst run` into shards and merge their results.
+
+With `--shard i/N`, a run types only the genomes of shard i of N, e.g. one
+task of a SLURM job array, and writes `results.shard_<i>_of_<N>.csv`. A
+genome belongs to the shard given by a hash of its key: the path of the file
+in the input folder, the record id in a multi-FASTA file or the sample name
+of reads. The hash doesn't depend on the machine, the Python version or the
+order in which files are listed, so every task splits the input the same way.
+
+Shard files are sorted by id when the shard is done. `mlst merge` merges
+them into `results.csv`, reading one row per shard at a time.
+"""
+from pathlib import Path
+from typing import Iterator, Union
+import hashlib
+import heapq
+import csv
+import re
+import os
+
+SHARD_REGEX = re.compile(r'^(\d+)/(\d+)$')
+SHARD_FILE_REGEX = re.compile(r'^results\.shard_(\d+)_of_(\d+)\.csv$')
+RESULTS_NAME = 'results.csv'
+
+
+class Shard:
+    """Class to store shard index of count; index goes from 1 to count."""
+    def __init__(self, index: int, count: int):
+        if count < 1 or not 1 <= index <= count:
+            raise ValueError(
+                f'shard must be i/N with 1 <= i <= N, not {index}/{count}.'
+            )
+        self.index = index
+        self.count = count
+
+    def __str__(self) -> str:
+        return f'{self.index}/{self.count}'
+
+    @property
+    def suffix(self) -> str:
+        """Suffix of the output files, e.g. `.shard_03_of_10`."""
+        width = len(str(self.count))
+        return f'.shard_{self.index:0{width}d}_of_{self.count}'
+
+    @property
+    def results_name(self) -> str:
+        return f'results{self.suffix}.csv'
+
+    def contains(self, key: str) -> bool:
+        """Check if the genome with key belongs to this shard."""
+        return shard_of(key, self.count) == self.index
+
+
+def parse_shard(text: str) -> Shard:
+    """Get the shard of a `i/N` string; it raises ValueError if invalid."""
+    match = SHARD_REGEX.match(text.strip())
+    if match is None:
+        raise ValueError(f'shard must be i/N, e.g. 1/10, not {text}.')
+    return Shard(int(match.group(1)), int(match.group(2)))
+
+def shard_of(key: str, count: int) -> int:
+    """Get the shard, from 1 to count, of the genome with key."""
+    digest = hashlib.blake2b(key.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % count + 1
+
+def sort_results(results_file: Path) -> None:
+    """Sort the rows of a results file by id.
+
+    The sort is stable, so the rows of a genome typed with `--species auto`
+    keep their order. Only one shard is held in memory.
+    """
+    results_file = Path(results_file)
+    with open(results_file, 'r', newline='') as f:
+        reader = csv.DictReader(f)
+        fieldnames = reader.fieldnames
+        rows = sorted(reader, key=lambda row: row['id'])
+    tmp_file = results_file.with_name(
+        f'{results_file.name}.{os.getpid()}.tmp'
+    )
+    with open(tmp_file, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(rows)
+    os.replace(tmp_file, results_file)
+
+def find_shard_files(paths: list[Path]) -> list[Path]:
+    """Get the shard files of paths, i.e. shard files or folders with them.
+
+    It raises ValueError if the files are not all the shards of one run.
+    """
+    files = []
+    for path in paths:
+        if path.is_dir():
+            files.extend(sorted(
+                child for child in path.iterdir()
+                if SHARD_FILE_REGEX.match(child.name)
+            ))
+        else:
+            files.append(path)
+    shards = {}
+    for path in files:
+        match = SHARD_FILE_REGEX.match(path.name)
+        if match is None:
+            raise ValueError(f'{path} is not a shard file.')
+        shard = Shard(int(match.group(1)), int(match.group(2)))
+        if shard.index in shards:
+            raise ValueError(f'shard {shard} was given more than once.')
+        shards[shard.index] = (shard, path)
+    if not shards:
+        raise ValueError('no shard files were found.')
+    counts = {shard.count for shard, _ in shards.values()}
+    if len(counts) > 1:
+        raise ValueError('the shard files come from runs with different N.')
+    count = counts.pop()
+    missing = [str(i) for i in range(1, count + 1) if i not in shards]
+    if missing:
+        raise ValueError(
+            f'shard(s) {", ".join(missing)} of {count} are missing.'
+        )
+    return [shards[i][1] for i in range(1, count + 1)]
+
+def read_rows(results_file: Path) -> Iterator[dict]:
+    """Lazily yield the rows of a results file."""
+    with open(results_file, 'r', newline='') as f:
+        yield from csv.DictReader(f)
+
+def read_fieldnames(results_file: Path) -> list[str]:
+    with open(results_file, 'r', newline='') as f:
+        return next(csv.reader(f), [])
+
+def merge_results(
+        shard_files: list[Path], output: Union[Path, None] = None
+) -> int:
+    """Merge the sorted shard files into one results file sorted by id.
+
+    It is a k-way merge: one row per shard is in memory. output defaults to
+    results.csv in the folder of the first shard. It returns the number of
+    rows and raises ValueError if the shards have different columns.
+    """
+    fieldnames = read_fieldnames(shard_files[0])
+    for shard_file in shard_files[1:]:
+        if read_fieldnames(shard_file) != fieldnames:
+            raise ValueError(
+                f'{shard_file} has other columns than {shard_files[0]}.'
+            )
+    output = Path(output or shard_files[0].parent / RESULTS_NAME)
+    tmp_file = output.with_name(f'{output.name}.{os.getpid()}.tmp')
+    counter = 0
+    with open(tmp_file, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        for row in heapq.merge(
+            *(read_rows(shard_file) for shard_file in shard_files),
+            key=lambda row: row['id']
+        ):
+            writer.writerow(row)
+            counter += 1
+    os.replace(tmp_file, output)
+    return counter
@@ -0,0 +1,169 @@
+"""Profile tables of the MLST schemes, shared by processes through mmap.
+
+`mlst db build` saves the profiles of every scheme as a few `.npy` files in
+`<scheme>/<scheme>.profiles/`. The typer maps them read-only, so the workers
+of a run read the same pages of the page cache and memory use stays flat as
+the number of workers grows. Nothing is parsed when a table is loaded.
+
+The alleles of every locus are sorted, so an allele is found with a binary
+search, and the STs with each allele are kept in file order, as in the dicts
+of `import_profile`:
+
+    loci_offsets  alleles of locus i are alleles[loci_offsets[i]:...[i+1]]
+    alleles       allele names, sorted within every locus
+    st_offsets    STs of allele j are st_index[st_offsets[j]:...[j+1]]
+    st_index      position of those STs in sts
+    sts           ST names
+"""
+from pathlib import Path
+from typing import Union
+import shutil
+import json
+import os
+
+import numpy as np
+
+# Bump it when the layout of the tables changes.
+TABLE_VERSION = 1
+META_FILE = 'meta.json'
+ARRAY_NAMES = ['loci_offsets', 'alleles', 'st_offsets', 'st_index', 'sts']
+
+
+class LocusProfiles:
+    """Class to look up the STs with an allele of a locus.
+
+    It has the `get` of the dicts of `import_profile`, which is all that
+    st_typing uses.
+    """
+    def __init__(self, table: 'ProfileTable', start: int, stop: int):
+        self.table = table
+        self.start = start
+        self.stop = stop
+
+    def __len__(self) -> int:
+        return self.stop - self.start
+
+    def __contains__(self, allele: str) -> bool:
+        return self.position(allele) is not None
+
+    def position(self, allele: str) -> Union[int, None]:
+        """Get the position of allele in the table, or None."""
+        alleles = self.table.alleles[self.start:self.stop]
+        i = int(np.searchsorted(alleles, allele))
+        if i == len(alleles) or alleles[i] != allele:
+            return None
+        return self.start + i
+
+    def get(
+            self, allele: str, default: Union[list[str], None] = None
+    ) -> Union[list[str], None]:
+        """Get the STs with allele, in the order of the profile file."""
+        i = self.position(allele)
+        if i is None:
+            return default
+        offsets = self.table.st_offsets
+        st_index = self.table.st_index[offsets[i]:offsets[i + 1]]
+        return self.table.sts[st_index].tolist()
+
+
+class ProfileTable:
+    """Class to store the profiles of a scheme in flat numpy arrays.
+
+    stamp and loci tell which profile file and loci the table was made
+    from; see profile_stamp in mlst_cge.
+    """
+    def __init__(
+            self,
+            loci: list[str],
+            loci_offsets: np.ndarray,
+            alleles: np.ndarray,
+            st_offsets: np.ndarray,
+            st_index: np.ndarray,
+            sts: np.ndarray,
+            stamp: Union[list, None] = None
+    ):
+        self.loci = loci
+        self.loci_offsets = loci_offsets
+        self.alleles = alleles
+        self.st_offsets = st_offsets
+        self.st_index = st_index
+        self.sts = sts
+        self.stamp = stamp
+        self.positions = {locus: i for i, locus in enumerate(loci)}
+
+    def __getitem__(self, locus: str) -> LocusProfiles:
+        i = self.positions[locus]
+        return LocusProfiles(
+            self, int(self.loci_offsets[i]), int(self.loci_offsets[i + 1])
+        )
+
+    def __contains__(self, locus: str) -> bool:
+        return locus in self.positions
+
+    @classmethod
+    def from_profiles(
+            cls,
+            st_profiles: dict[str, dict[str, list[str]]],
+            stamp: Union[list, None] = None
+    ) -> 'ProfileTable':
+        """Make a table from the dicts of `import_profile`."""
+        sts = {}
+        loci_offsets = [0]
+        alleles = []
+        st_offsets = [0]
+        st_index = []
+        for allele_sts in st_profiles.values():
+            for allele in sorted(allele_sts):
+                alleles.append(allele)
+                for st in allele_sts[allele]:
+                    st_index.append(sts.setdefault(st, len(sts)))
+                st_offsets.append(len(st_index))
+            loci_offsets.append(len(alleles))
+        return cls(
+            loci=list(st_profiles),
+            loci_offsets=np.array(loci_offsets, dtype=np.int64),
+            alleles=np.array(alleles, dtype=str),
+            st_offsets=np.array(st_offsets, dtype=np.int64),
+            st_index=np.array(st_index, dtype=np.int64),
+            sts=np.array(list(sts), dtype=str),
+            stamp=stamp
+        )
+
+    def save(self, folder: Path) -> None:
+        """Save the table in folder, replacing any table in it.
+
+        The table is written to a temporary folder first, so readers see
+        the old table, the new one or none, which makes them parse the
+        profile file. Processes that mapped the old table keep using it.
+        """
+        folder = Path(folder)
+        tmp_folder = folder.with_name(f'{folder.name}.{os.getpid()}.tmp')
+        shutil.rmtree(tmp_folder, ignore_errors=True)
+        tmp_folder.mkdir()
+        for name in ARRAY_NAMES:
+            np.save(tmp_folder / f'{name}.npy', getattr(self, name))
+        with open(tmp_folder / META_FILE, 'w') as f:
+            json.dump({
+                'version': TABLE_VERSION,
+                'stamp': self.stamp,
+                'loci': self.loci,
+            }, f)
+        old_folder = folder.with_name(f'{folder.name}.{os.getpid()}.old')
+        if folder.exists():
+            os.replace(folder, old_folder)
+        os.replace(tmp_folder, folder)
+        shutil.rmtree(old_folder, ignore_errors=True)
+
+    @classmethod
+    def load(cls, folder: Path) -> 'ProfileTable':
+        """Map a table saved with `save` read-only."""
+        folder = Path(folder)
+        with open(folder / META_FILE, 'r') as f:
+            meta = json.load(f)
+        if meta.get('version') != TABLE_VERSION:
+            raise ValueError(f'{folder} has an old table layout.')
+        arrays = {
+            name: np.load(folder / f'{name}.npy', mmap_mode='r')
+            for name in ARRAY_NAMES
+        }
+        return cls(loci=meta['loci'], stamp=meta['stamp'], **arrays)
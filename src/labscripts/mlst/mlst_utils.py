@@ -1,7 +1,96 @@
 """Utilities for mlst."""
+from contextlib import contextmanager
+from fnmatch import fnmatch
 from pathlib import Path
-from typing import Union
+from typing import Callable, Iterator, Union
 from pprint import pformat
+import copy
+import signal
+import os
+import sys
+import threading
+
+
+class MlstError(Exception):
+    """Raised when a genome can't be typed, e.g. for a bad input or scheme."""
+
+
+class ThreadStdout:
+    """Class to replace sys.stdout so that each thread can drop its output.
+
+    Writes go to the stream of the calling thread if it set one, or to the
+    original stdout otherwise.
+    """
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def target(self):
+        return getattr(self.local, 'target', None) or self.stream
+
+    def write(self, text: str) -> int:
+        return self.target().write(text)
+
+    def flush(self) -> None:
+        self.target().flush()
+
+    def __getattr__(self, name: str):
+        return getattr(self.stream, name)
+
+
+class NullWriter:
+    """Class to drop whatever is written to it."""
+    def write(self, text: str) -> int:
+        return len(text)
+
+    def flush(self) -> None:
+        pass
+
+
+_stdout_lock = threading.Lock()
+# ThreadStdout in sys.stdout and number of quiet_stdout contexts using it.
+_thread_stdout = None
+_stdout_users = 0
+
+@contextmanager
+def quiet_stdout() -> Iterator[None]:
+    """Drop what the calling thread prints while the context lasts.
+
+    sys.stdout is replaced by a ThreadStdout while any thread is in the
+    context, so other threads keep printing, and the original stdout is put
+    back when the last one leaves. This can be used from threads.
+    """
+    global _thread_stdout, _stdout_users
+    with _stdout_lock:
+        if _stdout_users == 0:
+            _thread_stdout = ThreadStdout(sys.stdout)
+            sys.stdout = _thread_stdout
+        _stdout_users += 1
+        stdout = _thread_stdout
+    previous = getattr(stdout.local, 'target', None)
+    stdout.local.target = NullWriter()
+    try:
+        yield
+    finally:
+        stdout.local.target = previous
+        with _stdout_lock:
+            _stdout_users -= 1
+            if _stdout_users == 0:
+                # Leave sys.stdout alone if someone else replaced it since.
+                if sys.stdout is _thread_stdout:
+                    sys.stdout = _thread_stdout.stream
+                _thread_stdout = None
+
+def ignore_sigint() -> None:
+    """Make a worker process, and the programs it starts, ignore Ctrl-C.
+
+    Ctrl-C is sent to every process of the terminal, so the workers of a
+    pool would die with it; this leaves stopping them to the parent.
+    Ignored signals stay ignored in programs started with exec, e.g. the
+    blastn and KMA of cgecore.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
 
 class SpeciesOptions:
     _species_options = {
@@ -164,6 +253,13 @@ class SpeciesOptions:
                 return True
         return False
 
+    def get_schemes(self, organism: str) -> Union[list[str], None]:
+        """Get the schemes of an organism, e.g. `Escherichia coli`."""
+        for name, value in self.species_options.items():
+            if name.rstrip(',').lower() == organism.strip().lower():
+                return value.split(', ')
+        return None
+
     def print_species_options(self) -> None:
         options = pformat(self.species_options, indent=0)
         chars_to_remove = ["{", "}", "'", ","]
@@ -188,12 +284,25 @@ class InputMlstyper:
             kma_matrix: bool = False,
             save_tmp: bool = False,
             depth: float = 5.0,
-            csv_fieldnames: list[str] = ['id', 'sequence_type']
+            csv_fieldnames: list[str] = ['id', 'sequence_type'],
+            recursive: bool = False,
+            patterns: Union[list[str], None] = None,
+            assemblies: bool = False,
+            kma_shm: bool = False,
+            kma_dirs: Union[dict[str, Path], None] = None,
+            jobs: int = 1,
+            sketch_index=None,
+            profile_writer=None,
+            novel_registry: Union[Path, None] = None,
+            two_stage: bool = False,
+            shard=None,
+            scratch=None
     ):
         self.infile = infile
         self.species = species
         self.database = database
-        # The files in tmp_dir are deleted.
+        # Scratch folder of the run (see mlst_scratch); its files are
+        # deleted.
         self.tmp_dir = tmp_dir
         # Path to blastn.
         self.method_path = method_path
@@ -211,3 +320,153 @@ class InputMlstyper:
         # Fieldnames for the `results.csv` file that save the extracted
         # sequence type from the `results.json` created by mlstyper.
         self.csv_fieldnames = csv_fieldnames
+        # Options to search FASTA files when the infile is a directory.
+        self.recursive = recursive
+        self.patterns = patterns
+        # If True, every FASTA file is one genome, whatever its number of
+        # contigs.
+        self.assemblies = assemblies
+        # If True, KMA uses the index already loaded in shared memory.
+        self.kma_shm = kma_shm
+        # Folder of the KMA index of the schemes not indexed in the database
+        # (see mlst_reads).
+        self.kma_dirs = kma_dirs
+        # Number of samples typed at the same time.
+        self.jobs = jobs
+        # SketchIndex (see mlst_screen) used to detect the schemes of every
+        # genome when the species is `auto`.
+        self.sketch_index = sketch_index
+        # ProfileWriter (see mlst_profiles) to save the allele profiles.
+        self.profile_writer = profile_writer
+        # SQLite file of the novel alleles (see mlst_novel). The path, and
+        # not a connection, is stored so that it can be sent to workers.
+        self.novel_registry = novel_registry
+        # Locate the loci first and search the alleles only around them.
+        self.two_stage = two_stage
+        # Shard (see mlst_shard) of the genomes typed by this run, if any.
+        self.shard = shard
+        # ScratchSpace (see mlst_scratch) of tmp_dir; worker processes get
+        # their folder from it.
+        self.scratch = scratch
+
+    @property
+    def results_file(self) -> Path:
+        """Path to results.csv, or to the results file of the shard."""
+        name = self.shard.results_name if self.shard else 'results.csv'
+        return Path(self.outdir_mlst_runner) / name
+
+    def in_shard(self, key: str) -> bool:
+        """Check if the genome with key is typed by this run."""
+        return self.shard is None or self.shard.contains(key)
+
+    def replace(self, **changes) -> 'InputMlstyper':
+        """Get a copy with some attributes changed.
+
+        Inputs are shared by the genomes of a run, so they are copied
+        instead of modified.
+        """
+        input_mlstyper = copy.copy(self)
+        for name, value in changes.items():
+            if not hasattr(input_mlstyper, name):
+                raise AttributeError(f'InputMlstyper has no {name}')
+            setattr(input_mlstyper, name, value)
+        return input_mlstyper
+
+
+def has_fasta_extension(file_name: str) -> bool:
+    """Check if file has FASTA extension."""
+    extension = file_name.split('.')[-1]
+    if (
+        extension == 'fasta' or extension == 'fna' or extension == 'ffn' or
+        extension == 'faa' or extension == 'frn' or extension == 'fa'
+    ):
+        return True
+    return False
+
+def iter_sequence_paths(
+        directory: Path,
+        check_extension: Callable[[str], bool],
+        recursive: bool = False,
+        patterns: Union[list[str], None] = None
+) -> Iterator[Path]:
+    """Lazily yield the paths to the files of directory with a valid extension.
+
+    The directory is walked with `os.scandir`, so entries are produced as they
+    are read and big directories are never listed at once. If patterns is
+    provided, only the files whose name matches one of the glob patterns are
+    yielded.
+    """
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            # Walk subdirectories only if requested.
+            if entry.is_dir():
+                if recursive:
+                    yield from iter_sequence_paths(
+                        Path(entry.path), check_extension, recursive, patterns
+                    )
+                continue
+            if not entry.is_file() or not check_extension(entry.name):
+                continue
+            if patterns and not any(
+                fnmatch(entry.name, pattern) for pattern in patterns
+            ):
+                continue
+            yield Path(entry.path)
+
+def iter_fasta_paths(
+        directory: Path,
+        recursive: bool = False,
+        patterns: Union[list[str], None] = None
+) -> Iterator[Path]:
+    """Lazily yield the paths to the FASTA files found in directory."""
+    yield from iter_sequence_paths(
+        directory, has_fasta_extension, recursive, patterns
+    )
+
+def file_genome_id(path: Path, directory: Path) -> str:
+    """Get the id of the genome in path, a file found in directory.
+
+    It is the path relative to directory without the extension, e.g.
+    `sample_1` or `run_2/sample_1`, so files with the same name in
+    different subfolders get different ids.
+    """
+    return Path(path).relative_to(directory).with_suffix('').as_posix()
+
+def fasta_summary(infile: Path) -> tuple[str, int]:
+    """Get the first record id and the number of records of a FASTA file.
+
+    The file is read only once and the sequences are not parsed. The id is
+    the first word of the header, as in Biopython.
+    """
+    record_id = ''
+    counter = 0
+    with open(infile, 'rb') as f:
+        for line in f:
+            if line.startswith(b'>'):
+                if counter == 0:
+                    header = line[1:].split(maxsplit=1)
+                    record_id = header[0].decode() if header else ''
+                counter += 1
+    return record_id, counter
+
+def results_by_scheme(data: dict) -> dict[str, dict]:
+    """Get the results of every scheme from the data of mlstyper."""
+    results = data["mlst_cge"]["results"]
+    if "sequence_type" in results:
+        return {data["mlst_cge"]["user_input"]["species"]: results}
+    return results
+
+def sequence_types(results: dict[str, dict]) -> dict[str, str]:
+    """Get the sequence type(s) from the results of mlstyper.
+
+    The sequence type of a single scheme is returned under the
+    `sequence_type` key. When several schemes were typed, the keys are the
+    scheme names.
+    """
+    if len(results) == 1:
+        scheme_results = next(iter(results.values()))
+        return {"sequence_type": scheme_results["sequence_type"]}
+    return {
+        scheme: scheme_results["sequence_type"]
+        for scheme, scheme_results in results.items()
+    }
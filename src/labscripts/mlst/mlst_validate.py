@@ -0,0 +1,449 @@
+"""Check the consistency of the MLST database.
+
+Every scheme of `mlst_db/config` is checked in a worker process: the allele
+headers of `<scheme>/<scheme>.fsa` and `alleles/<scheme>/*.tfa`, the profiles
+of `<scheme>/<scheme>.tsv` and the KMA and BLAST indexes must agree with the
+loci of the config file and with each other. Files are read line by line.
+
+The findings of a scheme are cached together with the hash of the files they
+come from, so that only the schemes that changed are checked again.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Iterator, Union
+import hashlib
+import json
+import os
+import re
+
+from labscripts.mlst.mlst_database import (
+    INDEX_SUFFIXES, parse_config, load_manifest, hash_scheme_files
+)
+from labscripts.mlst.mlst_cge import scheme_allele_files
+from labscripts.mlst.mlst_screen import default_cache_dir
+
+# Allele names are `<locus>_<number>` (or `<locus>-<number>`).
+ALLELE_REGEX = re.compile(rb'^>(\S+)[-_](\d+)(?:\s|$)')
+# Bump it when the checks change, so that cached findings are not reused.
+VALIDATOR_VERSION = 1
+LEVELS = ['error', 'warning']
+
+
+class Finding:
+    """Class to store one problem found in the database."""
+    def __init__(
+            self,
+            level: str,
+            scheme: str,
+            check: str,
+            message: str,
+            path: Union[str, None] = None
+    ):
+        # `error` or `warning`.
+        self.level = level
+        # Empty for problems that don't belong to a scheme.
+        self.scheme = scheme
+        # Short name of the check, e.g. `allele_headers`.
+        self.check = check
+        self.message = message
+        # Path relative to the database.
+        self.path = path
+
+    def to_dict(self) -> dict:
+        return {
+            'level': self.level, 'scheme': self.scheme, 'check': self.check,
+            'message': self.message, 'path': self.path,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'Finding':
+        return cls(**data)
+
+    def __str__(self) -> str:
+        location = f'{self.scheme}: ' if self.scheme else ''
+        return f'[{self.level.upper()}] {location}{self.message}'
+
+
+def read_allele_names(infile: Path) -> Iterator[tuple[str, str]]:
+    """Yield (locus, allele number) of every header of a FASTA file.
+
+    Headers that are not allele names yield (header, '').
+    """
+    with open(infile, 'rb') as f:
+        for line in f:
+            if not line.startswith(b'>'):
+                continue
+            match = ALLELE_REGEX.match(line)
+            if match:
+                yield match.group(1).decode(), match.group(2).decode()
+            else:
+                yield line[1:].strip().decode(errors='replace'), ''
+
+def check_fasta_alleles(
+        database: Path,
+        scheme: str,
+        infile: Path,
+        loci: list[str],
+        findings: list[Finding]
+) -> dict[str, set[str]]:
+    """Check the allele headers of a FASTA file and return them by locus."""
+    path = infile.relative_to(database).as_posix()
+    alleles = {}
+    bad_headers = []
+    unknown_loci = set()
+    for locus, number in read_allele_names(infile):
+        if not number:
+            bad_headers.append(locus)
+        elif locus not in loci:
+            unknown_loci.add(locus)
+        else:
+            alleles.setdefault(locus, set()).add(number)
+    if bad_headers:
+        findings.append(Finding(
+            'error', scheme, 'allele_headers',
+            f'{len(bad_headers)} header(s) in {path} are not allele names, ' +
+            f'e.g. {bad_headers[0]}', path
+        ))
+    if unknown_loci:
+        findings.append(Finding(
+            'error', scheme, 'allele_headers',
+            f'locus/loci in {path} not in config: ' +
+            ', '.join(sorted(unknown_loci)), path
+        ))
+    return alleles
+
+def check_profiles(
+        database: Path,
+        scheme: str,
+        loci: list[str],
+        alleles: dict[str, set[str]],
+        findings: list[Finding]
+) -> None:
+    """Check the header and the allele numbers of the profiles of scheme."""
+    profile_file = database / scheme / f'{scheme}.tsv'
+    path = profile_file.relative_to(database).as_posix()
+    if not profile_file.exists():
+        findings.append(Finding(
+            'error', scheme, 'profiles', f'not found: {path}', path
+        ))
+        return
+    with open(profile_file, 'r') as f:
+        header = f.readline().rstrip('\n').split('\t')
+        missing = [locus for locus in loci if locus not in header]
+        if missing:
+            findings.append(Finding(
+                'error', scheme, 'profiles',
+                f'missing gene(s) in {path}: ' + ', '.join(missing), path
+            ))
+            return
+        if header[1:len(loci) + 1] != loci:
+            findings.append(Finding(
+                'warning', scheme, 'profiles',
+                f'order of genes in {path} different from config', path
+            ))
+        columns = [header.index(locus) for locus in loci]
+        short_rows = 0
+        unknown = {locus: set() for locus in loci}
+        for line in f:
+            row = line.rstrip('\n').split('\t')
+            if len(row) <= max(columns):
+                short_rows += 1
+                continue
+            for locus, column in zip(loci, columns):
+                allele = row[column]
+                # Missing alleles are written as 0, N or - in some schemes.
+                if allele.isdigit() and int(allele) > 0 and alleles and (
+                    allele not in alleles.get(locus, ())
+                ):
+                    unknown[locus].add(allele)
+    if short_rows:
+        findings.append(Finding(
+            'error', scheme, 'profiles',
+            f'{short_rows} row(s) in {path} have fewer columns than genes',
+            path
+        ))
+    for locus, numbers in unknown.items():
+        if numbers:
+            findings.append(Finding(
+                'warning', scheme, 'profiles',
+                f'{len(numbers)} allele(s) of {locus} in {path} are not in ' +
+                f'the allele files, e.g. {locus}_{min(numbers, key=int)}',
+                path
+            ))
+
+def check_indexes(
+        database: Path,
+        scheme: str,
+        n_alleles: int,
+        scheme_hash: str,
+        entry: dict,
+        findings: list[Finding]
+) -> None:
+    """Check that the indexes of scheme are complete and up to date."""
+    prefix = database / scheme / scheme
+    for index_type, suffixes in INDEX_SUFFIXES.items():
+        present = [
+            suffix for suffix in suffixes
+            if prefix.with_name(scheme + suffix).exists()
+        ]
+        if not present:
+            continue
+        if len(present) < len(suffixes):
+            missing = sorted(set(suffixes) - set(present))
+            findings.append(Finding(
+                'warning', scheme, 'indexes',
+                f'incomplete {index_type} index, missing: ' +
+                ', '.join(scheme + suffix for suffix in missing)
+            ))
+        if index_type in entry.get('indexes', []) and (
+            entry.get('hash') != scheme_hash
+        ):
+            findings.append(Finding(
+                'warning', scheme, 'indexes',
+                f'the {index_type} index is older than the alleles; run ' +
+                '`mlst db build`'
+            ))
+    # The .name file of KMA has one line per template.
+    name_file = prefix.with_name(f'{scheme}.name')
+    if name_file.exists():
+        with open(name_file, 'rb') as f:
+            n_templates = sum(1 for _ in f)
+        if n_alleles and n_templates != n_alleles:
+            path = name_file.relative_to(database).as_posix()
+            findings.append(Finding(
+                'error', scheme, 'indexes',
+                f'{path} has {n_templates} templates but the alleles are ' +
+                f'{n_alleles}; run `mlst db build`', path
+            ))
+
+def validate_scheme(
+        database: Path, scheme: str, loci: list[str], entry: dict
+) -> list[Finding]:
+    """Run all the checks of one scheme."""
+    findings = []
+    fsa_file = database / scheme / f'{scheme}.fsa'
+    alleles_dir = database / 'alleles' / scheme
+    tfa_files = sorted(alleles_dir.glob('*.tfa'))
+    fsa_alleles = {}
+    if fsa_file.exists():
+        fsa_alleles = check_fasta_alleles(
+            database, scheme, fsa_file, loci, findings
+        )
+    elif tfa_files:
+        findings.append(Finding(
+            'warning', scheme, 'files',
+            f'not found: {scheme}/{scheme}.fsa; the alleles in ' +
+            f'alleles/{scheme}/ are used'
+        ))
+    else:
+        findings.append(Finding(
+            'error', scheme, 'files',
+            f'no alleles: neither {scheme}/{scheme}.fsa nor ' +
+            f'alleles/{scheme}/*.tfa exist'
+        ))
+    tfa_alleles = {}
+    for tfa_file in tfa_files:
+        if tfa_file.stem not in loci:
+            findings.append(Finding(
+                'warning', scheme, 'files',
+                f'{tfa_file.name} in alleles/{scheme}/ is not a locus of ' +
+                'the config file'
+            ))
+            continue
+        alleles = check_fasta_alleles(
+            database, scheme, tfa_file, loci, findings
+        )
+        if set(alleles) - {tfa_file.stem}:
+            findings.append(Finding(
+                'error', scheme, 'allele_headers',
+                f'alleles/{scheme}/{tfa_file.name} has alleles of other loci'
+            ))
+        for locus, numbers in alleles.items():
+            tfa_alleles.setdefault(locus, set()).update(numbers)
+    if tfa_files:
+        missing = [locus for locus in loci if locus not in tfa_alleles]
+        if missing:
+            findings.append(Finding(
+                'error', scheme, 'files',
+                f'no alleles in alleles/{scheme}/ for: ' + ', '.join(missing)
+            ))
+    alleles = fsa_alleles or tfa_alleles
+    missing = [locus for locus in loci if locus not in alleles]
+    if alleles and missing:
+        findings.append(Finding(
+            'error', scheme, 'allele_headers',
+            'genes of the config file without alleles: ' + ', '.join(missing)
+        ))
+    if fsa_alleles and tfa_alleles:
+        differ = [
+            locus for locus in loci
+            if fsa_alleles.get(locus) != tfa_alleles.get(locus)
+        ]
+        if differ:
+            findings.append(Finding(
+                'warning', scheme, 'alleles',
+                f'{scheme}/{scheme}.fsa and alleles/{scheme}/ have different ' +
+                'alleles for: ' + ', '.join(differ)
+            ))
+    check_profiles(database, scheme, loci, alleles, findings)
+    files = scheme_allele_files(database, scheme)
+    if files:
+        n_alleles = sum(len(numbers) for numbers in alleles.values())
+        check_indexes(
+            database, scheme, n_alleles, hash_scheme_files(database, files),
+            entry, findings
+        )
+    return findings
+
+def scheme_cache_key(
+        database: Path, scheme: str, loci: list[str], entry: dict
+) -> str:
+    """Hash the files of scheme and everything else its findings rely on.
+
+    Index files are large, so only their sizes and times are used.
+    """
+    digest = hashlib.sha256(
+        f'{VALIDATOR_VERSION}\n{scheme}\n{",".join(loci)}\n'.encode()
+    )
+    digest.update(json.dumps(entry, sort_keys=True).encode())
+    inputs = [
+        database / scheme / f'{scheme}.fsa',
+        database / scheme / f'{scheme}.tsv',
+        *sorted((database / 'alleles' / scheme).glob('*.tfa')),
+    ]
+    for path in inputs:
+        if not path.exists():
+            continue
+        digest.update(f'{path.relative_to(database)}\n'.encode())
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+    for suffixes in INDEX_SUFFIXES.values():
+        for suffix in suffixes:
+            path = database / scheme / f'{scheme}{suffix}'
+            if path.exists():
+                stat = path.stat()
+                digest.update(
+                    f'{path.name}:{stat.st_size}:{stat.st_mtime_ns}\n'.encode()
+                )
+    return digest.hexdigest()
+
+def validate_scheme_cached(
+        database: Path,
+        scheme: str,
+        loci: list[str],
+        entry: dict,
+        cached: dict
+) -> tuple[str, list[dict]]:
+    """Check scheme unless cached holds findings for the same files.
+
+    It runs in a worker process and returns the cache key and the findings
+    as dictionaries.
+    """
+    key = scheme_cache_key(database, scheme, loci, entry)
+    if cached.get('key') == key:
+        return key, cached['findings']
+    findings = validate_scheme(database, scheme, loci, entry)
+    return key, [finding.to_dict() for finding in findings]
+
+def check_database_files(
+        database: Path, config: dict[str, list[str]], config_text: str
+) -> list[Finding]:
+    """Check the config file and the scheme files that are not in it."""
+    findings = []
+    for line in config_text.splitlines():
+        if line.startswith('#'):
+            # The header of the config file lists the files it needs.
+            if 'important files are:' in line.lower():
+                for name in line.split('are:')[-1].split(','):
+                    if name.strip() and not (database / name.strip()).exists():
+                        findings.append(Finding(
+                            'error', '', 'config', f'not found: {name.strip()}'
+                        ))
+            continue
+        if line.strip() and len(line.split('\t')) != 3:
+            findings.append(Finding(
+                'error', '', 'config',
+                'invalid line in config, 3 tab separated columns are ' +
+                f'required: {line}', 'config'
+            ))
+    if not config:
+        findings.append(Finding(
+            'error', '', 'config', 'no schemes were found in config', 'config'
+        ))
+    with os.scandir(database) as entries:
+        for entry in entries:
+            if not entry.is_dir() or entry.name in config:
+                continue
+            for suffix in ['.fsa', '.tsv']:
+                if (Path(entry.path) / f'{entry.name}{suffix}').exists():
+                    findings.append(Finding(
+                        'error', entry.name, 'config',
+                        f'not in config: {entry.name}'
+                    ))
+                    break
+    return findings
+
+def validation_cache_file(database: Path) -> Path:
+    """Path of the cached findings of database."""
+    database_key = hashlib.sha1(
+        str(Path(database).resolve()).encode()
+    ).hexdigest()[:12]
+    return default_cache_dir() / f'mlst_validation_{database_key}.json'
+
+def validate_database(
+        database: Path,
+        schemes: Union[list[str], None] = None,
+        jobs: int = 1,
+        use_cache: bool = True
+) -> list[Finding]:
+    """Check database and return the findings, errors first.
+
+    All the schemes in the config file are checked if schemes is None.
+    """
+    database = Path(database)
+    config_file = database / 'config'
+    if not config_file.exists():
+        return [Finding(
+            'error', '', 'config', 'the config file could not be found',
+            'config'
+        )]
+    config_text = config_file.read_text()
+    config = parse_config(config_text.splitlines())
+    findings = check_database_files(database, config, config_text)
+    if schemes is None:
+        schemes = list(config)
+    for scheme in schemes:
+        if scheme not in config:
+            findings.append(Finding(
+                'error', scheme, 'config', f'not in config: {scheme}'
+            ))
+    schemes = [scheme for scheme in schemes if scheme in config]
+    cache_file = validation_cache_file(database)
+    cache = {}
+    if use_cache and cache_file.exists():
+        try:
+            cache = json.loads(cache_file.read_text())
+        except (OSError, ValueError):
+            cache = {}
+    manifest = load_manifest(database)
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        results = executor.map(
+            validate_scheme_cached,
+            [database] * len(schemes),
+            schemes,
+            [config[scheme] for scheme in schemes],
+            [manifest.get(scheme, {}) for scheme in schemes],
+            [cache.get(scheme, {}) for scheme in schemes],
+        )
+        for scheme, (key, scheme_findings) in zip(schemes, results):
+            cache[scheme] = {'key': key, 'findings': scheme_findings}
+            findings.extend(Finding.from_dict(data) for data in scheme_findings)
+    if use_cache:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = cache_file.with_suffix(f'.{os.getpid()}.tmp')
+        tmp_file.write_text(json.dumps(cache))
+        os.replace(tmp_file, cache_file)
+    # Python sorts are stable: schemes keep the config order.
+    findings.sort(key=lambda finding: LEVELS.index(finding.level))
+    return findings
@@ -0,0 +1,240 @@
+"""Watch a folder for new FASTA files.
+
+New files are found with inotify on Linux, or by listing the folder every
+few seconds elsewhere. A file is only handed over once it is complete: its
+size and modification time must stay the same for a settle time, so files
+still being written by an assembler are never typed.
+"""
+from fnmatch import fnmatch
+from pathlib import Path
+from typing import Iterator, Union
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+
+from labscripts.mlst.mlst_utils import has_fasta_extension, iter_fasta_paths
+
+# Seconds between checks of the folder.
+WATCH_INTERVAL = 2.0
+# Seconds a file must stay unchanged before it is typed.
+SETTLE_TIME = 10.0
+
+# Flags and events of inotify, see `man inotify`.
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_ISDIR = 0x40000000
+# Files being written are followed with stat, so IN_MODIFY isn't needed.
+WATCH_EVENTS = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+EVENT_HEADER = struct.Struct('iIII')
+
+
+def is_watched_file(
+        path: Path, patterns: Union[list[str], None] = None
+) -> bool:
+    """Check if path has a FASTA extension and matches patterns."""
+    if not has_fasta_extension(path.name):
+        return False
+    return not patterns or any(
+        fnmatch(path.name, pattern) for pattern in patterns
+    )
+
+
+class InotifyWatcher:
+    """Class to get the files changed in a folder from inotify.
+
+    It raises OSError if inotify is not available.
+    """
+    def __init__(
+            self,
+            directory: Path,
+            recursive: bool = False,
+            patterns: Union[list[str], None] = None
+    ):
+        self.recursive = recursive
+        self.patterns = patterns
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        # Folder of every watch descriptor.
+        self.folders = {}
+        self.add_folder(Path(directory))
+
+    def add_folder(self, folder: Path) -> None:
+        wd = self.libc.inotify_add_watch(
+            self.fd, os.fsencode(folder), WATCH_EVENTS
+        )
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f'Cannot watch {folder}')
+        self.folders[wd] = folder
+        if self.recursive:
+            for entry in os.scandir(folder):
+                if entry.is_dir():
+                    self.add_folder(Path(entry.path))
+
+    def changed_files(self, timeout: float) -> list[Path]:
+        """Wait up to timeout seconds and get the files that changed."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        data = b''
+        while True:
+            try:
+                data += os.read(self.fd, 65536)
+            except BlockingIOError:
+                break
+        paths = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            if wd not in self.folders or not name:
+                continue
+            path = self.folders[wd] / os.fsdecode(name)
+            if mask & IN_ISDIR:
+                # New subfolders are watched too, with the files they have.
+                if self.recursive and mask & (IN_CREATE | IN_MOVED_TO):
+                    self.add_folder(path)
+                    paths.extend(iter_fasta_paths(path, True, self.patterns))
+            elif is_watched_file(path, self.patterns):
+                paths.append(path)
+        return paths
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """Class to get the files of a folder by listing it every so often."""
+    def __init__(
+            self,
+            directory: Path,
+            recursive: bool = False,
+            patterns: Union[list[str], None] = None
+    ):
+        self.directory = Path(directory)
+        self.recursive = recursive
+        self.patterns = patterns
+
+    def changed_files(self, timeout: float) -> list[Path]:
+        """Wait timeout seconds and get all the files of the folder."""
+        time.sleep(timeout)
+        return list(
+            iter_fasta_paths(self.directory, self.recursive, self.patterns)
+        )
+
+    def close(self) -> None:
+        pass
+
+
+def make_watcher(
+        directory: Path,
+        recursive: bool = False,
+        patterns: Union[list[str], None] = None,
+        polling: bool = False
+) -> Union[InotifyWatcher, PollingWatcher]:
+    """Use inotify if possible, or poll the folder otherwise."""
+    if not polling:
+        try:
+            return InotifyWatcher(directory, recursive, patterns)
+        except (OSError, AttributeError, TypeError):
+            # No inotify: not Linux, no libc found or no watches left.
+            pass
+    return PollingWatcher(directory, recursive, patterns)
+
+
+class StableFiles:
+    """Class to hold the files found until they stop changing.
+
+    Files that stay empty for the settle time are set aside until they
+    change, so that they don't keep a watch from going idle.
+    """
+    def __init__(self, settle_time: float = SETTLE_TIME):
+        self.settle_time = settle_time
+        # (size, modification time) of every file and when it was last seen
+        # changing.
+        self.pending = {}
+        # (size, modification time) of the files set aside while empty.
+        self.empty = {}
+
+    def add(self, path: Path, now: float) -> None:
+        if path in self.pending:
+            return
+        if path in self.empty:
+            try:
+                stat = path.stat()
+            except OSError:
+                del self.empty[path]
+                return
+            if (stat.st_size, stat.st_mtime_ns) == self.empty[path]:
+                return
+            del self.empty[path]
+        self.pending[path] = (None, now)
+
+    def pop_stable(self, now: float) -> list[Path]:
+        """Get the files that didn't change for settle_time seconds."""
+        stable = []
+        for path, (stamp, since) in list(self.pending.items()):
+            try:
+                stat = path.stat()
+            except OSError:
+                # Deleted, or renamed to its final name.
+                del self.pending[path]
+                continue
+            new_stamp = (stat.st_size, stat.st_mtime_ns)
+            if new_stamp != stamp:
+                self.pending[path] = (new_stamp, now)
+            elif now - since >= self.settle_time:
+                del self.pending[path]
+                if stat.st_size:
+                    stable.append(path)
+                else:
+                    self.empty[path] = new_stamp
+        return sorted(stable)
+
+
+def watch_fasta_files(
+        directory: Path,
+        recursive: bool = False,
+        patterns: Union[list[str], None] = None,
+        interval: float = WATCH_INTERVAL,
+        settle_time: float = SETTLE_TIME,
+        idle_exit: Union[float, None] = None,
+        polling: bool = False
+) -> Iterator[list[Path]]:
+    """Yield the FASTA files of directory as they become stable.
+
+    The files already in directory are yielded too. Lists of stable files are
+    yielded every interval seconds, empty if there is none, so that the
+    caller can do other work between them. It stops after idle_exit seconds
+    without new files, or never if idle_exit is None.
+    """
+    watcher = make_watcher(directory, recursive, patterns, polling)
+    stable_files = StableFiles(settle_time)
+    seen = set()
+    last_new = time.monotonic()
+    try:
+        changed = list(iter_fasta_paths(Path(directory), recursive, patterns))
+        while True:
+            now = time.monotonic()
+            for path in changed:
+                if path not in seen:
+                    stable_files.add(path, now)
+            stable = stable_files.pop_stable(now)
+            seen.update(stable)
+            if stable or stable_files.pending:
+                last_new = now
+            elif idle_exit is not None and now - last_new >= idle_exit:
+                return
+            yield stable
+            changed = watcher.changed_files(interval)
+    finally:
+        watcher.close()
@@ -0,0 +1,79 @@
+"""Tests of the BLAST search of mlst_cge against `mlst db build` indexes."""
+import stat
+import sys
+import textwrap
+
+from labscripts.mlst.mlst_cge import BLAST_DB_SUFFIXES, DbBlaster
+
+ALLELE = 'ACGTACGTAC'
+# The genome carries the first 7 bases of the 10 of the allele.
+GENOME = 'TTTTT' + ALLELE[:7] + 'TTTTT'
+
+# blastn stub that reports a hit of bases 1-7 of the allele.
+BLASTN = textwrap.dedent('''\
+    #!{python}
+    import sys
+    out = sys.argv[sys.argv.index('-out') + 1]
+    hsp = (
+        '<Hsp><Hsp_num>1</Hsp_num><Hsp_bit-score>14</Hsp_bit-score>'
+        '<Hsp_score>7</Hsp_score><Hsp_evalue>1e-5</Hsp_evalue>'
+        '<Hsp_query-from>6</Hsp_query-from><Hsp_query-to>12</Hsp_query-to>'
+        '<Hsp_hit-from>1</Hsp_hit-from><Hsp_hit-to>7</Hsp_hit-to>'
+        '<Hsp_query-frame>1</Hsp_query-frame><Hsp_hit-frame>1</Hsp_hit-frame>'
+        '<Hsp_identity>7</Hsp_identity><Hsp_positive>7</Hsp_positive>'
+        '<Hsp_gaps>0</Hsp_gaps><Hsp_align-len>7</Hsp_align-len>'
+        '<Hsp_qseq>ACGTACG</Hsp_qseq><Hsp_hseq>ACGTACG</Hsp_hseq>'
+        '<Hsp_midline>|||||||</Hsp_midline></Hsp>'
+    )
+    open(out, 'w').write(
+        '<?xml version="1.0"?>\\n<BlastOutput>'
+        '<BlastOutput_program>blastn</BlastOutput_program>'
+        '<BlastOutput_version>BLASTN 2.15.0+</BlastOutput_version>'
+        '<BlastOutput_reference>x</BlastOutput_reference>'
+        '<BlastOutput_db></BlastOutput_db>'
+        '<BlastOutput_query-ID>Query_1</BlastOutput_query-ID>'
+        '<BlastOutput_query-def>contig</BlastOutput_query-def>'
+        '<BlastOutput_query-len>17</BlastOutput_query-len>'
+        '<BlastOutput_param><Parameters><Parameters_expect>10'
+        '</Parameters_expect><Parameters_sc-match>1</Parameters_sc-match>'
+        '<Parameters_sc-mismatch>-2</Parameters_sc-mismatch>'
+        '<Parameters_gap-open>0</Parameters_gap-open>'
+        '<Parameters_gap-extend>0</Parameters_gap-extend>'
+        '<Parameters_filter>F</Parameters_filter></Parameters>'
+        '</BlastOutput_param><BlastOutput_iterations><Iteration>'
+        '<Iteration_iter-num>1</Iteration_iter-num>'
+        '<Iteration_query-ID>Query_1</Iteration_query-ID>'
+        '<Iteration_query-def>contig</Iteration_query-def>'
+        '<Iteration_query-len>17</Iteration_query-len><Iteration_hits>'
+        '<Hit><Hit_num>1</Hit_num><Hit_id>Subject_1</Hit_id>'
+        '<Hit_def>ecoli:adk_1</Hit_def><Hit_accession>Subject_1'
+        '</Hit_accession><Hit_len>10</Hit_len><Hit_hsps>' + hsp +
+        '</Hit_hsps></Hit></Iteration_hits></Iteration>'
+        '</BlastOutput_iterations></BlastOutput>\\n'
+    )
+''')
+
+
+def test_db_blaster_partial_hit(tmp_path):
+    """The full allele of a partial hit is read from the database alleles."""
+    scheme_dir = tmp_path / 'db' / 'ecoli'
+    scheme_dir.mkdir(parents=True)
+    for suffix in BLAST_DB_SUFFIXES:
+        (scheme_dir / f'ecoli{suffix}').touch()
+    (scheme_dir / 'ecoli.alleles.fsa').write_text(f'>ecoli:adk_1\n{ALLELE}\n')
+    genome = tmp_path / 'genome.fasta'
+    genome.write_text(f'>contig\n{GENOME}\n')
+    blastn = tmp_path / 'blastn'
+    blastn.write_text(BLASTN.format(python=sys.executable))
+    blastn.chmod(blastn.stat().st_mode | stat.S_IEXEC)
+
+    blaster = DbBlaster(
+        genome, ['ecoli'], tmp_path / 'db', tmp_path / 'out', blast=blastn
+    )
+
+    hits = blaster.results['schemes']
+    assert len(hits) == 1
+    hit_id, hit = next(iter(hits.items()))
+    assert hit['sbjct_header'] == 'ecoli:adk_1'
+    assert hit['perc_coverage'] == 70
+    assert blaster.gene_align_sbjct['schemes'][hit_id] == ALLELE